@@ -12,8 +12,16 @@ def doctor_required(f):
         pass
     return decorated
 
-from flask import Flask, render_template, request, redirect, jsonify, Response, send_from_directory, session, url_for
-from camera import camera, generate_frames
+from flask import Flask, render_template, request, redirect, jsonify, Response, send_file, send_from_directory, session, url_for
+from camera import camera, generate_frames, STREAM_VARIANTS, DEFAULT_STREAM
+from exports import FORMATS, export_stream, parquet_available
+from vitals import vitals_buffer, parse_reading, sample_tuple, decode_batch, validate_batch, MAX_BATCH_BYTES
+from sensor_state import sensor_state, sensor_registry, device_key, parse_window
+from sensor import SerialReader, available as sensor_available, available_ports, claim_serial_lock
+from photos import photo_writer, PhotoQueueFull, is_content_name
+from thumbs import thumbnail, snap_width
+import badges
+from events import event_bus, parse_last_event_id, sse_stream
 from db import (
     init_db, insert_patient, query_patients, get_patient, update_patient, delete_patient,
     store_patient, query_stored, get_stored, get_setting, set_setting,
@@ -21,21 +29,17 @@ from db import (
     add_hospital, list_hospitals, delete_hospital, verify_hospital, delete_stored,
     get_or_create_profile, get_profile, get_profile_visits, get_conn,
     create_patient_profile, update_patient_profile, get_all_patient_profiles, verify_patient_login,
-    generate_patient_qr_code, verify_patient_qr_code, parse_qr_code_data
+    profile_directory_stats, profile_visit_photo, page_profiles, profile_changes, parse_profile_fields, parse_profile_cursor,
+    PROFILE_SORTS,
+    generate_patient_qr_code, verify_patient_qr_code, parse_qr_code_data, profile_search_cte, qr_payload, qr_etag,
+    page_patients, page_stored, parse_cursor, format_cursor, parse_since, visit_cursor, latest_vitals_sample,
+    insert_vitals_samples, VITALS_SAMPLE_COLUMNS
 )
-# Serial is optional; on Render there is no COM port
-try:
-    import serial  # type: ignore
-except Exception:
-    serial = None  # sentinel for unavailable serial
-import json
 import threading
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 from functools import wraps
 import os
-import queue
-import threading as _threading
 
 init_db()  # <-- Initialize DB and create tables before anything else
 
@@ -44,139 +48,98 @@ app = Flask(__name__)
 app.secret_key = 'dev_secret_key'
 
 # ESP32 Serial Configuration (disabled by default on Render)
-SERIAL_PORT = 'COM3'
+# One reader per port; several robots can be plugged in at once. The ports
+# picked on /port are saved in settings and override SERIAL_PORTS.
+SERIAL_PORTS = [p.strip() for p in os.getenv('SERIAL_PORTS', 'COM3').split(',') if p.strip()]
 BAUD_RATE = 115200
-
-# Store latest sensor data
-latest_sensor_data = {
-    'temperature': 0,
-    'heart_rate': 0,
-    'spo2': 0,
-    'weight': 0,
-    'env_temperature': 0,
-    'humidity': 0,
-    'status': 'normal',
-    'measurements': 0,
-    'timestamp': datetime.now().strftime('%H:%M:%S')
-}
-
-# History for charts (last 50 readings)
-sensor_history = {
-    'temperature': [],
-    'heart_rate': [],
-    'spo2': [],
-    'weight': [],
-    'env_temperature': [],
-    'humidity': [],
-    'timestamps': []
-}
-
-ser = None
-
-# Optionally start ESP32 serial reader only when enabled and available
-def _maybe_start_serial_reader():
-    try:
-        import os as _os
-        enable_serial = _os.getenv('ENABLE_SERIAL', '0') == '1'
-        if not enable_serial:
-            print("ℹ️ Serial reader disabled (ENABLE_SERIAL not set)")
-            return
-        if serial is None:
-            print("ℹ️ pyserial not available; skipping serial reader")
-            return
-
-        def read_esp32_serial():
-            """Background thread to read ESP32 serial data (local dev only)"""
-            global latest_sensor_data, sensor_history, ser
-            try:
-                ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-                print(f"✅ Connected to ESP32 on {SERIAL_PORT}")
-                time.sleep(2)
-                while True:
-                    try:
-                        if ser.in_waiting > 0:
-                            line = ser.readline().decode('utf-8').strip()
-                            if line.startswith("JSON:"):
-                                json_str = line.replace("JSON:", "")
-                                data = json.loads(json_str)
-                                latest_sensor_data.update({
-                                    'temperature': data.get('temperature', 0),
-                                    'heart_rate': data.get('heartRate', 0),
-                                    'spo2': data.get('spo2', 0),
-                                    'weight': data.get('weight', 0),
-                                    'env_temperature': data.get('envTemperature', 0),
-                                    'humidity': data.get('humidity', 0),
-                                    'status': data.get('status', 'normal'),
-                                    'measurements': data.get('measurements', 0),
-                                    'timestamp': datetime.now().strftime('%H:%M:%S')
-                                })
-                                sensor_history['timestamps'].append(latest_sensor_data['timestamp'])
-                                sensor_history['temperature'].append(latest_sensor_data['temperature'])
-                                sensor_history['heart_rate'].append(latest_sensor_data['heart_rate'])
-                                sensor_history['spo2'].append(latest_sensor_data['spo2'])
-                                sensor_history['weight'].append(latest_sensor_data['weight'])
-                                sensor_history['env_temperature'].append(latest_sensor_data['env_temperature'])
-                                sensor_history['humidity'].append(latest_sensor_data['humidity'])
-                                if len(sensor_history['timestamps']) > 50:
-                                    for key in sensor_history:
-                                        sensor_history[key].pop(0)
-                                print(f"📊 ESP32 Data: Temp={latest_sensor_data['temperature']}°C, HR={latest_sensor_data['heart_rate']}bpm, SpO2={latest_sensor_data['spo2']}%, Weight={latest_sensor_data['weight']}kg, EnvTemp={latest_sensor_data['env_temperature']}°C, Humidity={latest_sensor_data['humidity']}%")
-                            else:
-                                print(line)
-                    except json.JSONDecodeError:
-                        pass
-                    except Exception as e:
-                        print(f"Error reading ESP32 serial: {e}")
-            except Exception as e:
-                print(f"ℹ️ Serial reader not started: {e}")
-
-        t = threading.Thread(target=read_esp32_serial, daemon=True)
-        t.start()
-    except Exception as _e:
+# How often the serial process picks up ports changed through another worker
+SERIAL_SYNC_INTERVAL = 2.0
+
+# Live sensor data and history are shared by all worker processes, per device
+# and combined, through sensor_registry (see sensor_state.py)
+
+serial_readers = {}
+serial_owner = False  # this process holds the serial lock
+
+def serial_enabled():
+    return os.getenv('ENABLE_SERIAL', '0') == '1' and sensor_available()
+
+def configured_serial_ports():
+    saved = get_setting('serial_ports')
+    if saved is None:
+        return list(SERIAL_PORTS)
+    return [p for p in saved.split(',') if p]
+
+def _sync_serial_readers():
+    wanted = configured_serial_ports()
+    for port in list(serial_readers):
+        if port not in wanted:
+            serial_readers.pop(port).stop()
+    for port in wanted:
+        if port not in serial_readers:
+            serial_readers[port] = SerialReader(port, BAUD_RATE)
+            serial_readers[port].start()
+
+def _watch_serial_ports():
+    while True:
+        time.sleep(SERIAL_SYNC_INTERVAL)
         try:
-            print(f"ℹ️ Skipping serial reader due to error: {_e}")
-        except Exception:
-            pass
-
-_maybe_start_serial_reader()
+            _sync_serial_readers()
+        except Exception as e:
+            print(f"⚠️ Could not update serial readers: {e}")
+
+# Optionally start ESP32 serial readers only when enabled and available.
+# Not on import: gunicorn workers call this from gunicorn.conf.py and
+# `python app.py` below, so scripts and the stream sidecar that import the
+# app never open serial ports. Of the gunicorn workers, only the first to
+# get the serial lock (sensor.claim_serial_lock) reads the ports; the others
+# see its readings through sensor_registry and change its ports through the
+# serial_ports setting.
+def start_serial_readers():
+    global serial_owner
+    if os.getenv('ENABLE_SERIAL', '0') != '1':
+        print("ℹ️ Serial reader disabled (ENABLE_SERIAL not set)")
+        return
+    if not sensor_available():
+        print("ℹ️ pyserial not available; skipping serial reader")
+        return
+    if not claim_serial_lock():
+        return
+    serial_owner = True
+    print(f"✅ Serial ports read by this process (pid {os.getpid()})")
+    _sync_serial_readers()
+    threading.Thread(target=_watch_serial_ports, name='serial-ports', daemon=True).start()
 
 # -------------------
 # Real-time SSE Broker
 # -------------------
-_sse_subscribers = []  # list[queue.Queue]
-_sse_lock = _threading.Lock()
+# Events go through the shared bus (events.py) so every worker's clients see
+# them, numbered so reconnecting clients can resume with Last-Event-ID.
 
 def sse_publish(event: str, data: dict):
     try:
-        import json as _json
-        payload = f"event: {event}\ndata: {_json.dumps(data)}\n\n"
-    except Exception:
-        payload = f"event: {event}\ndata: {{}}\n\n"
-    with _sse_lock:
-        subs = list(_sse_subscribers)
-    for q in subs:
-        try:
-            q.put_nowait(payload)
-        except Exception:
-            pass
+        event_bus.publish(event, data)
+    except Exception as e:
+        # Live updates are best effort; never fail the request over them
+        print(f"⚠️ SSE publish failed: {e}")
 
 @app.route('/events/patients')
 def sse_events():
-    def stream():
-        q = queue.Queue()
-        with _sse_lock:
-            _sse_subscribers.append(q)
-        try:
-            # Initial hello to open the stream
-            yield 'event: hello\ndata: {}\n\n'
-            while True:
-                msg = q.get()
-                yield msg
-        finally:
-            with _sse_lock:
-                if q in _sse_subscribers:
-                    _sse_subscribers.remove(q)
-    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    sub = event_bus.subscribe(last_id)
+    resp = Response(sse_stream(sub), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also runs when the client leaves before the stream starts
+    resp.call_on_close(sub.close)
+    return resp
+
+def can_view_stats():
+    return bool(session.get('hospital_ok') or session.get('doctor_ok'))
+
+@app.route('/events/stats')
+def sse_stats():
+    if not can_view_stats():
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify(event_bus.stats())
 
 # Access control gateway
 @app.before_request
@@ -198,7 +161,7 @@ def enforce_access_rules():
     if path.startswith('/qr/scan'):
         return None
     # Allow device endpoints (ESP32) to post vitals and poll commands without auth
-    if path == '/api/vitals' or path.startswith('/api/command'):
+    if path == '/api/vitals' or path == '/api/vitals/batch' or path.startswith('/api/command'):
         return None
     # Admin: full access
     if session.get('hospital_ok'):
@@ -215,7 +178,7 @@ def enforce_access_rules():
         return redirect(url_for('dashboard'))
     # Patient session: allow only their own account and QR
     if session.get('patient_ok'):
-        allowed_prefixes = ('/PatientAccount.html', '/PatientSignin.html', '/qr/', '/logout', '/upload_photo', '/patient/photo')
+        allowed_prefixes = ('/PatientAccount.html', '/PatientSignin.html', '/qr/', '/logout', '/upload_photo', '/photo_status', '/patient/photo')
         if any(path == p or path.startswith(p) for p in allowed_prefixes):
             return None
         # Redirect patient to their account by default
@@ -226,7 +189,7 @@ def enforce_access_rules():
     # Hospital limited: only QA and camera feed
     if session.get('hospital_limited'):
         allowed_prefixes = (
-            '/qa', '/camera', '/camera/video_feed', '/api/patient', '/api/sensor', '/take_picture', '/upload_photo', '/api/verify-qr'
+            '/qa', '/camera', '/camera/video_feed', '/api/patient', '/api/sensor', '/api/devices', '/take_picture', '/upload_photo', '/photo_status', '/api/verify-qr'
         )
         if any(path == p or path.startswith(p) for p in allowed_prefixes):
             return None
@@ -271,7 +234,7 @@ def sensor():
                     SELECT heart_rate, spo2, body_temp_f, env_temp_f, humidity_percent, weight_kg, datetime(created_at) AS ts
                     FROM patients
                     WHERE profile_id = ?
-                    ORDER BY datetime(created_at) DESC
+                    ORDER BY created_at DESC, id DESC
                     LIMIT 1
                     """,
                     (pid_int,)
@@ -281,13 +244,25 @@ def sensor():
                     """
                     SELECT heart_rate, spo2, body_temp_f, env_temp_f, humidity_percent, weight_kg, datetime(created_at) AS ts
                     FROM patients
-                    ORDER BY datetime(created_at) DESC
+                    ORDER BY created_at DESC, id DESC
                     LIMIT 1
                     """
                 ).fetchone()
     except Exception as e:
         row = None
 
+    # Latest device reading from the vitals time series (UTC, like created_at)
+    sample = None
+    try:
+        sample = latest_vitals_sample(pid_int)
+    except Exception:
+        sample = None
+    sample_ts = None
+    if sample:
+        sample_ts = datetime.fromtimestamp(sample['ts'], tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if row and row['ts'] and row['ts'] > sample_ts:
+            sample = None
+
     # Map DB row to template data, converting F->C where needed
     def f_to_c(v):
         try:
@@ -295,8 +270,20 @@ def sensor():
         except Exception:
             return 0
 
-    data = dict(latest_sensor_data)  # default from serial for local dev
-    if row:
+    data = sensor_state.snapshot()  # default from serial/device for local dev
+    if sample:
+        data = {
+            'temperature': sample['body_temp_c'] or 0,
+            'heart_rate': sample['heart_rate'] or 0,
+            'spo2': sample['spo2'] or 0,
+            'weight': sample['weight_kg'] or 0,
+            'env_temperature': sample['env_temp_c'] or 0,
+            'humidity': sample['humidity_percent'] or 0,
+            'status': 'normal',
+            'measurements': 0,
+            'timestamp': sample_ts
+        }
+    elif row:
         try:
             data = {
                 'temperature': f_to_c(row['body_temp_f']) if 'body_temp_f' in row.keys() else 0,
@@ -318,16 +305,88 @@ def sensor():
 def port_page():
     if not session.get('hospital_ok'):
         return redirect(url_for('hospital_login'))
-    return render_template('port.html', ports=[SERIAL_PORT], selected_port=SERIAL_PORT)
+    configured = configured_serial_ports()
+    ports = available_ports()
+    for port in reversed(configured):
+        if port not in ports:
+            ports.insert(0, port)
+    # The readers may run in another worker; their readings are shared
+    readers = []
+    for port in configured:
+        state = sensor_registry.get(f'serial:{port}')
+        last_seen = state.last_seen() if state is not None else None
+        readers.append({
+            'port': port,
+            'readings': state.write_count() if state is not None else 0,
+            'age': None if last_seen is None else max(0, int(time.time() - last_seen)),
+        })
+    return render_template('port.html', ports=ports, readers=readers, serial_enabled=serial_enabled())
 
-# JSON sensor snapshot
+def _device_state():
+    """(device, state, error response) for the request's ?device= (combined view without one)"""
+    try:
+        device = device_key(request.args.get('device'))
+    except ValueError as e:
+        return None, None, (jsonify({'error': str(e)}), 400)
+    if device is None:
+        return None, sensor_state, None
+    state = sensor_registry.get(device)
+    if state is None:
+        return device, None, (jsonify({'error': f"Unknown device '{device}'"}), 404)
+    return device, state, None
+
+# JSON sensor snapshot (?device= for one robot, else the newest from any)
 @app.route('/api/sensor')
 def api_sensor():
-    return jsonify(latest_sensor_data)
+    device, state, error = _device_state()
+    if error:
+        return error
+    data = state.snapshot()
+    if device is not None:
+        data['device'] = device
+        data['last_seen'] = state.last_seen()
+    return jsonify(data)
 
 @app.route('/api/sensor/history')
 def api_sensor_history():
-    return jsonify(sensor_history)
+    # ?window=10m&points=200 -> min/max/mean buckets over the last 10 minutes
+    try:
+        window = parse_window(request.args.get('window'))
+        points = request.args.get('points', type=int)
+    except ValueError:
+        return jsonify({'error': 'window must look like 90, 30s, 10m or 2h'}), 400
+    _device, state, error = _device_state()
+    if error:
+        return error
+    return jsonify(state.history(window, points))
+
+# Every robot that has reported, most recently seen first
+@app.route('/api/devices')
+def api_devices():
+    devices = sensor_registry.devices()
+    return jsonify({'devices': devices, 'count': len(devices)})
+
+def _live_snapshot(device_id=None):
+    """Latest live reading of ``device_id`` if it has reported, else of any device"""
+    try:
+        state = sensor_registry.get(device_id) if device_id else None
+    except ValueError:
+        state = None
+    return (state or sensor_state).snapshot()
+
+def _record_live_reading(reading, status=None, ts=None, device_id=None):
+    """Publish a device reading to the shared snapshot/history behind /api/sensor"""
+    try:
+        sensor_registry.publish(device_id, {
+            'temperature': reading['body_temp_c'],
+            'heart_rate': reading['heart_rate'],
+            'spo2': reading['spo2'],
+            'weight': reading['weight_kg'],
+            'env_temperature': reading['env_temp_c'],
+            'humidity': reading['humidity_percent'],
+        }, status=status, ts=ts)
+    except Exception as e:
+        print(f"❌ Could not publish sensor reading: {e}")
 
 # ESP32 Vitals ingestion (cloud)
 @app.route('/api/vitals', methods=['POST'])
@@ -335,82 +394,78 @@ def api_vitals():
     data = request.get_json(silent=True) or {}
     # Accept both snake_case and camelCase keys from ESP32
     # Expected keys (either form): heart_rate/heartRate, spo2, body_temp/temperature (C),
-    # weight (kg), env_temp/envTemperature (C), humidity, patient_id
+    # weight (kg), env_temp/envTemperature (C), humidity, patient_id, optional device_id
     pid_raw = data.get('patient_id')
-    profile = None
     profile_id = None
     if pid_raw is not None and pid_raw != '':
         try:
             profile_id = int(pid_raw)
-            profile = get_profile(profile_id)
-            if not profile:
-                # If provided patient_id doesn't exist, still proceed to update in-memory values
+            if not get_profile(profile_id):
+                # Unknown patient_id: still record the reading, just unlinked
                 profile_id = None
         except (TypeError, ValueError):
             profile_id = None
 
-    def num_or_none(v):
-        try:
-            return float(v) if v is not None and v != '' else None
-        except Exception:
-            return None
+    reading = parse_reading(data)
+    device_id = str(data.get('device_id') or '') or None
+    # Readings go to the vitals_samples time series via the write-behind buffer;
+    # visit rows are only created when an intake is finalised (/api/patient, /api/robot-patient)
+    queued = vitals_buffer.add(sample_tuple(reading, device_id, profile_id))
 
-    heart_rate = num_or_none(data.get('heart_rate') if 'heart_rate' in data else data.get('heartRate'))
-    spo2 = num_or_none(data.get('spo2'))
-    body_temp_c = num_or_none(data.get('body_temp') if 'body_temp' in data else data.get('temperature'))
-    env_temp_c = num_or_none(data.get('env_temp') if 'env_temp' in data else data.get('envTemperature'))
-    humidity_percent = num_or_none(data.get('humidity'))
-    weight_kg = num_or_none(data.get('weight'))
-
-    body_temp_f = (body_temp_c * 9/5 + 32) if (body_temp_c is not None) else None
-    env_temp_f = (env_temp_c * 9/5 + 32) if (env_temp_c is not None) else None
-
-    # If a valid patient profile is available, insert a minimal row linked to profile
-    row_id = None
-    if profile_id is not None:
-        values = (
-            profile_id, None, None, None, None, None, None,
-            None, None, None,
-            None,
-            None, None, None,
-            None,
-            None, None,
-            heart_rate, spo2,
-            body_temp_f, env_temp_f, humidity_percent, weight_kg
+    _record_live_reading(reading, data.get('status'), device_id=device_id)
+    if not queued:
+        return jsonify({'status': 'busy', 'id': None, 'profile_id': profile_id}), 503
+    return jsonify({'status': 'ok', 'id': None, 'profile_id': profile_id})
+
+def _read_body(limit: int):
+    """The request body, or None once it exceeds ``limit`` bytes (never reads more than limit + 1)"""
+    if request.content_length is not None and request.content_length > limit:
+        return None
+    chunks, size = [], 0
+    while size <= limit:
+        chunk = request.stream.read(min(65536, limit + 1 - size))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks) if size <= limit else None
+
+# Bulk ingestion: many timestamped readings per request, one transaction
+@app.route('/api/vitals/batch', methods=['POST'])
+def api_vitals_batch():
+    # Checked before reading: an oversized (or chunked) body is refused, not buffered
+    body = _read_body(MAX_BATCH_BYTES)
+    if body is None:
+        return jsonify({'status': 'error', 'message': f'batch body exceeds {MAX_BATCH_BYTES} bytes'}), 413
+    try:
+        items = decode_batch(
+            body,
+            request.headers.get('Content-Type', ''),
+            request.headers.get('Content-Encoding', '')
         )
-        row_id = insert_patient(values)
-    # Update in-memory snapshot and history so /api/sensor reflects latest cloud data
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    rows, statuses = validate_batch(items, lambda pid: get_profile(pid) is not None)
     try:
-        latest_sensor_data.update({
-            'temperature': float(body_temp_c) if body_temp_c is not None else 0,
-            'heart_rate': float(heart_rate) if heart_rate is not None else 0,
-            'spo2': float(spo2) if spo2 is not None else 0,
-            'weight': float(weight_kg) if weight_kg is not None else 0,
-            'env_temperature': float(env_temp_c) if env_temp_c is not None else 0,
-            'humidity': float(humidity_percent) if humidity_percent is not None else 0,
-            'status': str(data.get('status') or 'normal'),
-            'measurements': int((latest_sensor_data.get('measurements') or 0)) + 1,
-            'timestamp': datetime.now().strftime('%H:%M:%S')
-        })
-        # Append to history with max length 50
-        sensor_history['timestamps'].append(latest_sensor_data['timestamp'])
-        sensor_history['temperature'].append(latest_sensor_data['temperature'])
-        sensor_history['heart_rate'].append(latest_sensor_data['heart_rate'])
-        sensor_history['spo2'].append(latest_sensor_data['spo2'])
-        sensor_history['weight'].append(latest_sensor_data['weight'])
-        sensor_history['env_temperature'].append(latest_sensor_data['env_temperature'])
-        sensor_history['humidity'].append(latest_sensor_data['humidity'])
-        if len(sensor_history['timestamps']) > 50:
-            for key in sensor_history:
-                sensor_history[key].pop(0)
-    except Exception:
-        pass
-    if row_id is not None and profile_id is not None:
-        try:
-            sse_publish('patient_added', {'id': int(row_id), 'profile_id': int(profile_id)})
-        except Exception:
-            pass
-    return jsonify({'status': 'ok', 'id': row_id, 'profile_id': profile_id})
+        inserted = insert_vitals_samples(rows)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Could not store readings: {e}'}), 500
+
+    # Reflect each device's newest accepted reading in the live snapshots
+    newest = {}
+    for row in rows:
+        if row[0] not in newest or row[2] > newest[row[0]][2]:
+            newest[row[0]] = row
+    for row in sorted(newest.values(), key=lambda r: r[2]):
+        _record_live_reading(dict(zip(VITALS_SAMPLE_COLUMNS, row)), ts=row[2], device_id=row[0])
+    rejected = len(statuses) - inserted
+    return jsonify({
+        'status': 'ok' if not rejected else ('partial' if inserted else 'error'),
+        'accepted': inserted,
+        'rejected': rejected,
+        'items': statuses
+    }), (200 if inserted or not statuses else 422)
 
 # Optional: ESP32 command polling stub
 @app.route('/api/command', methods=['GET', 'POST'])
@@ -420,10 +475,19 @@ def api_command():
 
 @app.route('/set_port', methods=['POST'])
 def set_port():
-    global SERIAL_PORT
-    port = request.form.get('port')
-    SERIAL_PORT = port
-    return redirect('/sensor')
+    # Connect (or with action=disconnect, stop) one port; other ports keep reading.
+    # Saved for the serial process, which may be another worker
+    port = (request.form.get('port') or '').strip()
+    if port and ',' not in port and serial_enabled():
+        ports = configured_serial_ports()
+        if request.form.get('action') == 'disconnect':
+            ports = [p for p in ports if p != port]
+        elif port not in ports:
+            ports.append(port)
+        set_setting('serial_ports', ','.join(ports))
+        if serial_owner:
+            _sync_serial_readers()
+    return redirect('/port' if request.form.get('action') == 'disconnect' else '/sensor')
 
 # Q&A Integration Routes
 @app.route('/qa')
@@ -439,53 +503,80 @@ def camera_page():
         return redirect(url_for('hospital_login'))
     return render_template('camera.html')
 
+def can_view_camera():
+    return bool(session.get('hospital_ok') or session.get('hospital_limited'))
+
+def requested_stream():
+    """?stream=full|half|thumb; clients asking to save data default to half-res"""
+    default = 'half' if request.headers.get('Save-Data', '').lower() == 'on' else DEFAULT_STREAM
+    return request.args.get('stream', default)
+
 @app.route('/camera/video_feed')
 def video_feed():
-    if not (session.get('hospital_ok') or session.get('hospital_limited')):
+    if not can_view_camera():
         return redirect(url_for('hospital_login'))
-    if not camera.running:
-        try:
-            camera.start()
-        except Exception as e:
-            return f"Camera error: {e}", 503, {'Content-Type': 'text/plain'}
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    stream = requested_stream()
+    if stream not in STREAM_VARIANTS:
+        return f"Unknown stream '{stream}' (choose {', '.join(STREAM_VARIANTS)})", 400, {'Content-Type': 'text/plain'}
+    try:
+        camera.acquire()
+    except Exception as e:
+        return f"Camera error: {e}", 503, {'Content-Type': 'text/plain'}
+    resp = Response(generate_frames(stream), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # Runs when the viewer disconnects, even if no frame was ever sent
+    resp.call_on_close(camera.release)
+    return resp
+
+@app.route('/camera/stream_stats')
+def camera_stream_stats():
+    if not can_view_camera():
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify(camera.stream_stats())
 
 @app.route('/take_picture')
 def take_picture():
-    if not camera.running:
-        try:
-            camera.start()
-            print("✅ Camera started for photo capture")
-        except Exception as e:
-            print(f"❌ Camera start error: {e}")
-            return jsonify({'status': 'error', 'message': str(e)}), 503
-    filename = camera.take_picture()
+    try:
+        camera.acquire()
+    except Exception as e:
+        print(f"❌ Camera start error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    try:
+        filename = camera.take_picture()
+    except PhotoQueueFull as e:
+        return jsonify({'status': 'busy', 'message': str(e)}), 503, {'Retry-After': '1'}
+    finally:
+        camera.release()
     if not filename:
         print("❌ No frame available for photo capture")
         return jsonify({'status': 'error', 'message': 'No frame available'}), 500
     print(f"✅ Photo captured: {filename}")
-    return jsonify({'status': 'success', 'filename': filename})
+    return jsonify({'status': 'success', 'filename': filename, 'photo_status': 'pending'})
 
 @app.route('/camera_status')
 def camera_status():
     return jsonify({
         'running': camera.running,
         'has_frame': camera.frame is not None,
-        'camera_index': camera.camera_index
+        'camera_index': camera.camera_index,
+        'owners': camera.owners,
+        'idle_timeout': camera.idle_timeout
     })
 
 @app.route('/test_photo')
 def test_photo():
     """Test route to verify photo capture is working"""
-    if not camera.running:
-        try:
-            camera.start()
-            print("✅ Camera started for test photo")
-        except Exception as e:
-            print(f"❌ Camera start error: {e}")
-            return jsonify({'status': 'error', 'message': str(e)}), 503
+    try:
+        camera.acquire()
+    except Exception as e:
+        print(f"❌ Camera start error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 503
     
-    filename = camera.take_picture()
+    try:
+        filename = camera.take_picture()
+    except PhotoQueueFull as e:
+        return jsonify({'status': 'busy', 'message': str(e)}), 503, {'Retry-After': '1'}
+    finally:
+        camera.release()
     if not filename:
         print("❌ No frame available for test photo")
         return jsonify({'status': 'error', 'message': 'No frame available'}), 500
@@ -509,34 +600,26 @@ def upload_photo():
         print("❌ Empty photo filename")
         return jsonify({'status': 'error', 'message': 'No photo selected'}), 400
     
-    # Generate unique filename
-    import uuid
-    filename = f"patient_{uuid.uuid4().hex[:8]}.jpg"
-    print(f"📸 Generated filename: {filename}")
-    
-    # Save photo to uploads directory
+    # Hand the bytes to the background writer; the file is fsynced and renamed
+    # into uploads/ off the request path (see /photo_status/<filename>)
     try:
-        # Ensure uploads directory exists at absolute path
-        uploads_dir = os.path.join(app.root_path, 'uploads')
-        os.makedirs(uploads_dir, exist_ok=True)
-
-        filepath = os.path.join(uploads_dir, filename)
-        photo.save(filepath)
-
-        # Verify file was created
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            print(f"✅ Photo saved successfully: {filename} ({file_size} bytes)")
-            return jsonify({'status': 'success', 'filename': filename})
-        else:
-            print(f"❌ Photo file was not created: {filepath}")
-            return jsonify({'status': 'error', 'message': 'File not created'}), 500
-            
+        filename = photo_writer.submit_bytes(photo.read())
+    except PhotoQueueFull as e:
+        return jsonify({'status': 'busy', 'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         print(f"❌ Photo save error: {e}")
-        import traceback
-        traceback.print_exc()
         return jsonify({'status': 'error', 'message': str(e)}), 500
+    print(f"✅ Photo queued: {filename}")
+    return jsonify({'status': 'success', 'filename': filename, 'photo_status': 'pending'})
+
+@app.route('/photo_status/<path:filename>')
+def photo_status(filename):
+    # ?wait=2 blocks up to that many seconds for a pending write to finish
+    wait = min(request.args.get('wait', 0, type=float), 10.0)
+    if wait > 0:
+        photo_writer.wait(filename, wait)
+    info = photo_writer.get_status(filename)
+    return jsonify(info), (404 if info['status'] == 'unknown' else 200)
 
 # Robot Interview Data Submission (links to existing patient profiles)
 @app.route('/api/robot-patient', methods=['POST'])
@@ -563,7 +646,8 @@ def save_robot_patient():
     if not profile:
         return jsonify({'status': 'error', 'message': f'Patient profile with ID {patient_id} not found'}), 404
     
-    # Prefer captured values sent by client; fallback to latest_sensor_data
+    # Prefer captured values sent by client; fallback to latest shared sensor data
+    latest_sensor_data = _live_snapshot(data.get('device_id'))
     temp_c = latest_sensor_data.get('temperature', 0)
     temp_f_latest = (temp_c * 9/5 + 32) if temp_c > 0 else None
     env_temp_c = latest_sensor_data.get('env_temperature', 0)
@@ -637,7 +721,8 @@ def save_patient():
     print(f"📊 Received patient data: {data}")
     print(f"📸 Photo field: {data.get('photo')}")
     
-    # Prefer captured values sent by client; fallback to latest_sensor_data
+    # Prefer captured values sent by client; fallback to latest shared sensor data
+    latest_sensor_data = _live_snapshot(data.get('device_id'))
     temp_c = latest_sensor_data.get('temperature', 0)
     temp_f_latest = (temp_c * 9/5 + 32) if temp_c > 0 else None
     env_temp_c = latest_sensor_data.get('env_temperature', 0)
@@ -695,32 +780,58 @@ def save_patient():
         pass
     return jsonify({'status': 'ok', 'id': row_id})
 
-# Dashboard
+# Dashboard (first page rendered server-side, further pages fetched lazily)
+DASHBOARD_PAGE_SIZE = 50
+
 @app.route('/dashboard')
 @doctor_required
 def dashboard():
     # Doctor-only
     q = request.args.get('q')
-    rows = query_patients(q)
-    return render_template('dashboard.html', rows=rows, q=q)
+    rows, next_cursor = page_patients(q, None, DASHBOARD_PAGE_SIZE)
+    return render_template('dashboard.html', rows=rows, q=q, next_cursor=next_cursor, page_size=DASHBOARD_PAGE_SIZE)
+
+# Exports: streamed in batches. ?format=csv|ndjson|parquet, ?gzip=1.
+# Every export ends at the newest row when it started, returned as the
+# X-Export-Cursor header; ?since=<that cursor> pulls only the rows after it
+# (?since=<ISO timestamp> starts at that time instead).
+def _export_response(table: str, basename: str, headers):
+    fmt = (request.args.get('format') or 'csv').lower()
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be an export cursor (<timestamp>,<id>) or an ISO timestamp'}), 400
+    if fmt == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+    if fmt != 'csv':
+        # Analytics formats carry the row and profile keys as well
+        headers = ['id', 'profile_id'] + headers
+    gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+    mimetype, ext = FORMATS[fmt]
+    filename = f"{basename}.{ext}" + ('.gz' if gzip else '')
+    cursor = visit_cursor(table)
+    if cursor is None and since:
+        cursor = format_cursor(*since)
+    body = export_stream(
+        table, fmt, headers,
+        search=request.args.get('q'), since=since, until=parse_cursor(cursor), gzip=gzip
+    )
+    response_headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if cursor:
+        response_headers['X-Export-Cursor'] = cursor
+    return Response(body, mimetype='application/gzip' if gzip else mimetype, headers=response_headers)
 
 # CSV export
 @app.route('/export.csv')
 def export_csv():
-    q = request.args.get('q')
-    rows = query_patients(q)
     headers = [
         'photo','name','age','gender','contact','address','chief_complaint','pain_level','pain_description','additional_symptoms',
         'medical_history','emergency_name','emergency_relation','emergency_gender','emergency_contact','emergency_address',
         'heart_rate','spo2','body_temp_f','env_temp_f','humidity_percent','weight_kg','created_at'
     ]
-    def generate():
-        yield ','.join(headers) + '\n'
-        for r in rows:
-            vals = [str(r[h] if h in r.keys() else '') for h in headers]
-            vals = ['"' + v.replace('"','""') + '"' if (',' in v or '"' in v or '\n' in v) else v for v in vals]
-            yield ','.join(vals) + '\n'
-    return Response(generate(), mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename="patients.csv"'})
+    return _export_response('patients', 'patients', headers)
 
 # Store page (archived list)
 @app.route('/store')
@@ -728,8 +839,8 @@ def export_csv():
 def store_page():
     # Doctor-only
     q = request.args.get('q')
-    rows = query_stored(q)
-    return render_template('store.html', rows=rows, q=q)
+    rows, next_cursor = page_stored(q, None, DASHBOARD_PAGE_SIZE)
+    return render_template('store.html', rows=rows, q=q, next_cursor=next_cursor, page_size=DASHBOARD_PAGE_SIZE)
 
 @app.route('/store/delete/<int:stored_id>', methods=['POST'])
 @doctor_required
@@ -740,20 +851,12 @@ def store_delete(stored_id: int):
 @app.route('/store.csv')
 @doctor_required
 def export_store_csv():
-    q = request.args.get('q')
-    rows = query_stored(q)
     headers = [
         'photo','name','age','gender','contact','address','chief_complaint','pain_level','pain_description','additional_symptoms',
         'medical_history','emergency_name','emergency_relation','emergency_gender','emergency_contact','emergency_address',
         'heart_rate','spo2','body_temp_f','env_temp_f','humidity_percent','weight_kg','created_at','archived_at'
     ]
-    def generate():
-        yield ','.join(headers) + '\n'
-        for r in rows:
-            vals = [str(r[h] if h in r.keys() else '') for h in headers]
-            vals = ['"' + v.replace('"','""') + '"' if (',' in v or '"' in v or '\n' in v) else v for v in vals]
-            yield ','.join(vals) + '\n'
-    return Response(generate(), mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename="store.csv"'})
+    return _export_response('stored_patients', 'store', headers)
 
 # Archive on view: move to store then show report
 @app.route('/view/<int:patient_id>')
@@ -772,44 +875,106 @@ def archive_and_view(patient_id: int):
 # -------------------
 # Realtime JSON APIs
 # -------------------
-@app.route('/api/patients/recent')
-def api_patients_recent():
+MAX_PAGE_SIZE = 200
+
+def _page_args():
+    """Read ?limit=&before=<created_at,id> for the keyset-paginated APIs"""
     try:
         limit = int(request.args.get('limit', 25))
     except Exception:
         limit = 25
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return limit, parse_cursor(request.args.get('before'))
+
+@app.route('/api/patients/recent')
+def api_patients_recent():
+    limit, before = _page_args()
     q = request.args.get('q')
-    rows = query_patients(q)
-    out = []
-    for r in rows[:limit]:
-        out.append({k: r[k] for k in r.keys()})
-    return jsonify(out)
+    rows, next_cursor = page_patients(q, before, limit)
+    return jsonify({'items': [dict(r) for r in rows], 'next_cursor': next_cursor})
 
 @app.route('/api/stored/recent')
 def api_stored_recent():
-    try:
-        limit = int(request.args.get('limit', 25))
-    except Exception:
-        limit = 25
+    limit, before = _page_args()
     q = request.args.get('q')
-    rows = query_stored(q)
-    out = []
-    for r in rows[:limit]:
-        out.append({k: r[k] for k in r.keys()})
-    return jsonify(out)
+    rows, next_cursor = page_stored(q, before, limit)
+    return jsonify({'items': [dict(r) for r in rows], 'next_cursor': next_cursor})
 
 @app.route('/api/profiles/list')
 def api_profiles_list():
+    # Unpaged legacy listing; the directory page uses /api/profiles
     search = request.args.get('search')
-    rows = get_all_patient_profiles(search)
-    out = []
-    for r in rows:
-        out.append({k: r[k] for k in r.keys()})
-    return jsonify(out)
+    return jsonify([dict(r) for r in get_all_patient_profiles(search)])
+
+# Paged profile directory. ?sort=created|name|id|last_visit|visits (prefix '-'
+# to reverse), ?q=, ?fields=id,name,photo, ?limit=, ?cursor=<next_cursor>.
+# ?since=<version> instead returns the profiles changed after that version
+# (plus deleted ids) so a client can patch its list rather than reload it.
+PROFILE_PAGE_SIZE = 50
+
+@app.route('/api/profiles')
+def api_profiles():
+    try:
+        fields = parse_profile_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit, _ = _page_args()
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'since must be an integer version'}), 400
+        changed, deleted, version, more = profile_changes(since, limit=MAX_PAGE_SIZE, fields=fields)
+        return jsonify({'items': changed, 'deleted': deleted, 'version': version, 'more': more})
+    sort = request.args.get('sort') or 'created'
+    if sort.lstrip('-') not in PROFILE_SORTS:
+        return jsonify({'error': f"Unsupported sort: {sort}"}), 400
+    cursor = request.args.get('cursor')
+    parsed = parse_profile_cursor(cursor)
+    if cursor and parsed is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    try:
+        items, next_cursor, version = page_profiles(sort, request.args.get('q'), parsed, limit, fields)
+    except ValueError:
+        # A numeric sort resumed from a non-numeric key
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'items': items, 'next_cursor': next_cursor, 'version': version})
 
 # Serve uploaded photos
+THUMB_MAX_AGE = 30 * 24 * 3600
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def _private_cache(resp, immutable=False):
+    # Patient photos: browsers may keep them, shared caches may not
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    if immutable:
+        # Content-addressed names never change content
+        resp.cache_control.immutable = True
+    return resp
+
 @app.route('/uploads/<path:filename>')
 def uploads(filename):
+    # A photo queued moments ago may still be on its way to disk
+    photo_writer.wait(filename, 2.0)
+    immutable = is_content_name(filename)
+    max_age = IMMUTABLE_MAX_AGE if immutable else THUMB_MAX_AGE
+    # ?w=96 serves a cached resized derivative (avatars, profile grids)
+    w = request.args.get('w', type=int)
+    if w and w > 0:
+        thumb = thumbnail(filename, w)
+        if thumb:
+            path, src = thumb
+            resp = send_file(
+                path, mimetype='image/jpeg', conditional=True,
+                etag=f'{snap_width(w)}-{int(src.st_mtime)}-{src.st_size}',
+                last_modified=src.st_mtime, max_age=max_age
+            )
+            return _private_cache(resp, immutable)
+    if immutable:
+        resp = send_from_directory(os.path.join(app.root_path, 'uploads'), filename, max_age=IMMUTABLE_MAX_AGE)
+        return _private_cache(resp, immutable)
     return send_from_directory(os.path.join(app.root_path, 'uploads'), filename)
 
 # Patient report page
@@ -867,6 +1032,7 @@ def patient_set_photo():
         with get_conn() as conn:
             conn.execute('UPDATE patient_profiles SET photo = ? WHERE id = ?', (filename, int(session.get('patient_id'))))
             conn.commit()
+        sse_publish('profile_changed', {'id': int(session.get('patient_id'))})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     return redirect(url_for('patient_account') + f'?patient_id={int(session.get("patient_id"))}')
@@ -876,24 +1042,7 @@ def _get_representative_photo(profile_row):
     try:
         if profile_row and profile_row['photo']:
             return profile_row['photo']
-    except Exception:
-        pass
-    try:
-        with get_conn() as conn:
-            row = conn.execute(
-                """
-                SELECT photo FROM (
-                  SELECT photo, datetime(created_at) AS ts FROM patients WHERE profile_id = ? AND photo IS NOT NULL
-                  UNION ALL
-                  SELECT photo, datetime(archived_at) AS ts FROM stored_patients WHERE profile_id = ? AND photo IS NOT NULL
-                )
-                WHERE photo IS NOT NULL
-                ORDER BY ts DESC
-                LIMIT 1
-                """,
-                (profile_row['id'], profile_row['id'])
-            ).fetchone()
-            return row['photo'] if row else None
+        return profile_visit_photo(int(profile_row['id']))
     except Exception:
         return None
 
@@ -1035,6 +1184,7 @@ def doctor_delete_profile(profile_id: int):
             conn.execute('DELETE FROM stored_patients WHERE profile_id = ?', (profile_id,))
             # Delete the patient profile itself
             conn.execute('DELETE FROM patient_profiles WHERE id = ?', (profile_id,))
+        sse_publish('profile_changed', {'id': int(profile_id)})
         return redirect(url_for('patient_profiles'))
     except Exception as e:
         # On error, redirect back with a basic message (could be improved with flash)
@@ -1170,112 +1320,55 @@ def settings_page():
 def patient_profiles():
     """Display all registered patients with links to their accounts"""
     search_query = request.args.get('search', '')
-    
-    # Get all unique patient profiles with visit counts
-    with get_conn() as conn:
-        try:
-            # Enriched query with representative photo
-            query = """
-                SELECT 
-                    pp.id,
-                    pp.name,
-                    pp.gender,
-                    pp.contact,
-                    pp.address,
-                    pp.photo,
-                    COALESCE(pp.photo, lp.photo, lsp.photo) AS representative_photo,
-                    pp.medical_history,
-                    pp.allergies,
-                    pp.medications,
-                    pp.notes,
-                    pp.created_at,
-                    COUNT(DISTINCT p.id) + COUNT(DISTINCT sp.id) as visit_count,
-                    MAX(COALESCE(p.created_at, sp.archived_at)) as last_visit
-                FROM patient_profiles pp
-                LEFT JOIN patients p ON pp.id = p.profile_id
-                LEFT JOIN stored_patients sp ON pp.id = sp.profile_id
-                LEFT JOIN (
-                    SELECT p1.profile_id, p1.photo
-                    FROM patients p1
-                    INNER JOIN (
-                        SELECT profile_id, MAX(created_at) AS max_created
-                        FROM patients
-                        WHERE profile_id IS NOT NULL AND photo IS NOT NULL
-                        GROUP BY profile_id
-                    ) pm ON pm.profile_id = p1.profile_id AND pm.max_created = p1.created_at
-                ) lp ON lp.profile_id = pp.id
-                LEFT JOIN (
-                    SELECT sp1.profile_id, sp1.photo
-                    FROM stored_patients sp1
-                    INNER JOIN (
-                        SELECT profile_id, MAX(archived_at) AS max_archived
-                        FROM stored_patients
-                        WHERE profile_id IS NOT NULL AND photo IS NOT NULL
-                        GROUP BY profile_id
-                    ) spm ON spm.profile_id = sp1.profile_id AND spm.max_archived = sp1.archived_at
-                ) lsp ON lsp.profile_id = pp.id
-            """
-            params = []
-            if search_query:
-                query += " WHERE pp.name LIKE ? OR pp.contact LIKE ? OR pp.id LIKE ?"
-                like_query = f"%{search_query}%"
-                params = [like_query, like_query, like_query]
-            query += " GROUP BY pp.id ORDER BY pp.created_at DESC"
-            patients = conn.execute(query, params).fetchall()
-        except Exception:
-            # Fallback: basic query with representative_photo as pp.photo
-            query = """
-                SELECT 
-                    pp.id,
-                    pp.name,
-                    pp.gender,
-                    pp.contact,
-                    pp.address,
-                    pp.photo,
-                    pp.photo AS representative_photo,
-                    pp.medical_history,
-                    pp.allergies,
-                    pp.medications,
-                    pp.notes,
-                    pp.created_at,
-                    0 as visit_count,
-                    NULL as last_visit
-                FROM patient_profiles pp
-            """
-            params = []
-            if search_query:
-                query += " WHERE pp.name LIKE ? OR pp.contact LIKE ? OR CAST(pp.id AS TEXT) LIKE ?"
-                like_query = f"%{search_query}%"
-                params = [like_query, like_query, like_query]
-            query += " ORDER BY pp.created_at DESC"
-            patients = conn.execute(query, params).fetchall()
-
-        # Get statistics (guard if tables/columns missing)
-        try:
-            total_patients = conn.execute("SELECT COUNT(*) as count FROM patient_profiles").fetchone()['count']
-        except Exception:
-            total_patients = len(patients)
-        try:
-            active_patients = conn.execute("SELECT COUNT(DISTINCT profile_id) as count FROM patients WHERE profile_id IS NOT NULL").fetchone()['count']
-        except Exception:
-            active_patients = 0
-        try:
-            total_visits = conn.execute("SELECT COUNT(*) as count FROM patients").fetchone()['count']
-            total_visits += conn.execute("SELECT COUNT(*) as count FROM stored_patients").fetchone()['count']
-        except Exception:
-            total_visits = 0
-    
+    # First page server-side; the page fetches more from /api/profiles as it scrolls
+    patients, next_cursor, version = page_profiles('created', search_query or None, None, PROFILE_PAGE_SIZE)
+    stats = profile_directory_stats()
     return render_template('PatientProfiles.html',
         patients=patients,
         search_query=search_query,
-        total_patients=total_patients,
-        active_patients=active_patients,
-        total_visits=total_visits
+        next_cursor=next_cursor,
+        version=version,
+        page_size=PROFILE_PAGE_SIZE,
+        **stats
     )
 
 
 # QR Code Routes
 
+# Bulk badge sheets for onboarding: ?ids=1,2,3 or ?q=<search> (default: all
+# profiles). ?format=pdf streams every page; ?format=png&page=N is one sheet.
+@app.route('/qr/badges')
+def qr_badge_sheet():
+    if session.get('patient_ok'):
+        return jsonify({'error': 'Forbidden'}), 403
+    if not badges.available():
+        return jsonify({'error': 'Badge sheets require Pillow'}), 501
+    ids = None
+    if request.args.get('ids'):
+        try:
+            ids = [int(x) for x in request.args['ids'].split(',') if x.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be comma-separated profile ids'}), 400
+    search = (request.args.get('q') or '').strip() or None
+    fmt = (request.args.get('format') or 'pdf').lower()
+    if fmt == 'png':
+        page = request.args.get('page', 1, type=int)
+        png = badges.png_page(page, ids=ids, search=search)
+        if png is None:
+            return jsonify({'error': f'No badges on page {page}'}), 404
+        return Response(png, mimetype='image/png',
+                        headers={'Content-Disposition': f'inline; filename="qr_badges_{page}.png"'})
+    if fmt != 'pdf':
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    return Response(badges.pdf_stream(ids=ids, search=search), mimetype='application/pdf',
+                    headers={'Content-Disposition': 'attachment; filename="qr_badges.pdf"'})
+
+def _revalidate(resp):
+    # Profiles can change, so clients must check the ETag before reusing a QR
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
 @app.route('/qr/<int:patient_id>')
 def patient_qr_code(patient_id):
     """Generate and display QR code for a patient"""
@@ -1285,14 +1378,16 @@ def patient_qr_code(patient_id):
         if not own_id or int(patient_id) != int(own_id):
             return redirect(url_for('patient_account') + f'?patient_id={own_id}')
     try:
-        qr_image_base64 = generate_patient_qr_code(patient_id)
         profile = get_profile(patient_id)
         if not profile:
             return "Patient not found", 404
+        qr_image_base64 = generate_patient_qr_code(patient_id, profile)
         
-        return render_template('qr_display.html', 
+        resp = app.make_response(render_template('qr_display.html', 
                              qr_image=qr_image_base64, 
-                             patient=profile)
+                             patient=profile))
+        resp.add_etag()
+        return _revalidate(resp).make_conditional(request)
     except Exception as e:
         return f"Error generating QR code: {str(e)}", 500
 
@@ -1305,17 +1400,25 @@ def api_patient_qr_code(patient_id):
         if not own_id or int(patient_id) != int(own_id):
             return jsonify({'error': 'Forbidden'}), 403
     try:
-        qr_image_base64 = generate_patient_qr_code(patient_id)
         profile = get_profile(patient_id)
         if not profile:
             return jsonify({'error': 'Patient not found'}), 404
+        # The response depends only on the payload and the name, so a matching ETag skips rendering
+        etag = qr_etag(f"{qr_payload(profile)}\n{profile['name'] or ''}")
+        if etag in request.if_none_match:
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            return _revalidate(resp)
+        qr_image_base64 = generate_patient_qr_code(patient_id, profile)
         
-        return jsonify({
+        resp = jsonify({
             'status': 'success',
             'qr_image': qr_image_base64,
             'patient_id': patient_id,
             'patient_name': profile['name'] if profile['name'] else 'Unknown'
         })
+        resp.set_etag(etag)
+        return _revalidate(resp).make_conditional(request)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1356,6 +1459,7 @@ def doctor_create_patient():
         try:
             # Create new patient profile
             profile_id = create_patient_profile(data)
+            sse_publish('profile_changed', {'id': int(profile_id)})
             return jsonify({'status': 'success', 'message': f'Patient account created successfully with ID: {profile_id}'})
         except Exception as e:
             return jsonify({'status': 'error', 'message': f'Error creating patient account: {str(e)}'}), 400
@@ -1391,6 +1495,7 @@ def doctor_edit_patient(profile_id):
         data = request.form.to_dict()
         try:
             update_patient_profile(profile_id, data)
+            sse_publish('profile_changed', {'id': int(profile_id)})
             return jsonify({'status': 'success', 'message': 'Patient profile updated successfully'})
         except Exception as e:
             return jsonify({'status': 'error', 'message': f'Error updating patient profile: {str(e)}'}), 400
@@ -1434,7 +1539,8 @@ if __name__ == '__main__':
             set_setting('secret_key', 'sharda1')
     except Exception:
         pass
-    
+    start_serial_readers()
+
     # Start camera automatically (commented out for testing without hardware)
     # try:
     #     camera.start()
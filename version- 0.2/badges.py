@@ -0,0 +1,243 @@
+"""Printable QR badge sheets for many patients at once (onboarding, wristbands).
+
+Profiles stream from db.iter_profiles in id order. Each badge's QR payload
+comes from db.generate_qr_code_data in this process (it is signed with this
+database's key), and the QR image from db.generate_qr_code_image, rendered in
+a process pool (QR encoding is pure Python and would otherwise serialise on
+the GIL) with a bounded number of chunks in flight. Pool workers never open
+the database. Badges are laid out on A4 pages; a PDF is
+written page by page as a stream, and PNG sheets are produced one page at a
+time, so memory depends on the page size rather than the number of patients.
+"""
+import base64
+import functools
+import multiprocessing
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from db import generate_qr_code_data, generate_qr_code_image, iter_profiles
+
+# Pillow is optional for the app, but required for badge sheets
+try:
+    from PIL import Image, ImageDraw, ImageFont  # type: ignore
+except Exception:
+    Image = None
+    ImageDraw = None
+    ImageFont = None
+
+# A4 at 150 dpi: QR modules stay several pixels wide, pages stay small
+DPI = 150
+PAGE_PX = (1240, 1754)
+PAGE_PT = (595, 842)
+MARGIN_PX = 45
+COLS, ROWS = 3, 5
+PER_PAGE = COLS * ROWS
+CELL_PX = ((PAGE_PX[0] - 2 * MARGIN_PX) // COLS, (PAGE_PX[1] - 2 * MARGIN_PX) // ROWS)
+QR_PX = 240
+WORKERS = int(os.getenv('BADGE_WORKERS', str(os.cpu_count() or 2)))
+
+# (id, name, age, gender, QR payload)
+Profile = Tuple[int, str, Optional[int], Optional[str], str]
+
+
+class PdfWriter:
+    """Minimal streaming PDF: one full-page grayscale image per page.
+
+    Each call returns the bytes to emit next; only object offsets and page
+    ids are kept, so nothing is buffered between pages.
+    """
+
+    def __init__(self, size_pt: Tuple[int, int] = PAGE_PT):
+        self.size_pt = size_pt
+        self.position = 0
+        self.offsets = {}
+        self.page_ids: List[int] = []
+        self.next_id = 3  # 1 = catalog and 2 = page tree, written by finish()
+
+    def _emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def _obj(self, num: int, body: bytes) -> bytes:
+        self.offsets[num] = self.position
+        return self._emit(b'%d 0 obj\n' % num + body + b'\nendobj\n')
+
+    def _stream(self, num: int, info: bytes, data: bytes) -> bytes:
+        return self._obj(num, b'<< %s /Length %d >>\nstream\n' % (info, len(data)) + data + b'\nendstream')
+
+    def start(self) -> bytes:
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, image) -> bytes:
+        image = image.convert('L')
+        img_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        self.page_ids.append(page_id)
+        w, h = self.size_pt
+        out = self._stream(img_id, b'/Type /XObject /Subtype /Image /Width %d /Height %d '
+                                   b'/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode'
+                           % image.size, zlib.compress(image.tobytes(), 6))
+        out += self._stream(content_id, b'', b'q %d 0 0 %d 0 0 cm /Im0 Do Q' % (w, h))
+        out += self._obj(page_id, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                                  b'/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>'
+                         % (w, h, img_id, content_id))
+        return out
+
+    def finish(self) -> bytes:
+        kids = b' '.join(b'%d 0 R' % p for p in self.page_ids)
+        out = self._obj(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))
+        out += self._obj(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref_at = self.position
+        size = self.next_id
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for num in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[num])
+        out += self._emit(b''.join(xref))
+        out += self._emit(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref_at))
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed bitmap font
+        return ImageFont.load_default()
+
+
+def _fit(draw, text: str, font, width: int) -> str:
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '...', font=font) > width:
+        text = text[:-1]
+    return text + '...'
+
+
+def render_badge(profile: Profile) -> bytes:
+    """One badge cell as raw 8-bit grayscale pixels (CELL_PX)"""
+    pid, name, age, gender, qr_data = profile
+    qr = Image.open(BytesIO(base64.b64decode(generate_qr_code_image(qr_data)))).convert('L')
+    qr = qr.resize((QR_PX, QR_PX), Image.NEAREST)
+    cell = Image.new('L', CELL_PX, 255)
+    draw = ImageDraw.Draw(cell)
+    draw.rectangle((0, 0, CELL_PX[0] - 1, CELL_PX[1] - 1), outline=210)  # cutting guide
+    cell.paste(qr, ((CELL_PX[0] - QR_PX) // 2, 8))
+    text_w = CELL_PX[0] - 24
+    big, small = _font(24), _font(18)
+    line = _fit(draw, name or 'Unnamed', big, text_w)
+    draw.text((CELL_PX[0] // 2, QR_PX + 22), line, fill=0, font=big, anchor='mt')
+    details = ' | '.join(str(v) for v in (f'ID {pid}', f'{age}y' if age else None, gender) if v)
+    draw.text((CELL_PX[0] // 2, QR_PX + 54), _fit(draw, details, small, text_w), fill=60, font=small, anchor='mt')
+    return cell.tobytes()
+
+
+def _render_chunk(profiles: Sequence[Profile]) -> List[bytes]:
+    return [render_badge(p) for p in profiles]
+
+
+def _profiles(ids: Optional[List[int]], search: Optional[str]) -> Iterator[Profile]:
+    for batch in iter_profiles(ids=ids, search=search):
+        for r in batch:
+            pid = int(r['id'])
+            # The payload is signed here: pool workers would sign with the default database's key
+            qr_data = generate_qr_code_data(patient_id=pid, name=r['name'] or '', age=r['age'] or None,
+                                            gender=r['gender'] or None)
+            yield (pid, r['name'], r['age'], r['gender'], qr_data)
+
+
+def _chunks(profiles: Iterable[Profile], size: int) -> Iterator[List[Profile]]:
+    chunk = []
+    for p in profiles:
+        chunk.append(p)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _tiles(profiles: Iterable[Profile], workers: int) -> Iterator[bytes]:
+    chunks = _chunks(profiles, PER_PAGE)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None or workers <= 1:
+        # A single page is not worth starting worker processes for
+        for chunk in (first, second):
+            if chunk:
+                yield from _render_chunk(chunk)
+        for chunk in chunks:
+            yield from _render_chunk(chunk)
+        return
+    # spawn, not fork: the web workers are multi-threaded
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        pending = deque(pool.submit(_render_chunk, c) for c in (first, second))
+        for chunk in chunks:
+            # Keep every worker busy, but never more than 2 chunks per worker in memory
+            pending.append(pool.submit(_render_chunk, chunk))
+            while len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _pages(tiles: Iterable[bytes]) -> Iterator['Image.Image']:
+    page, n = None, 0
+    for tile in tiles:
+        if page is None:
+            page = Image.new('L', PAGE_PX, 255)
+        col, row = n % COLS, n // COLS
+        page.paste(Image.frombytes('L', CELL_PX, tile),
+                   (MARGIN_PX + col * CELL_PX[0], MARGIN_PX + row * CELL_PX[1]))
+        n += 1
+        if n == PER_PAGE:
+            yield page
+            page, n = None, 0
+    if page is not None:
+        yield page
+
+
+def sheets(ids: Optional[List[int]] = None, search: Optional[str] = None,
+           workers: int = WORKERS) -> Iterator['Image.Image']:
+    """Badge sheet images for the selected profiles, one page at a time"""
+    return _pages(_tiles(_profiles(ids, search), workers))
+
+
+def pdf_stream(ids: Optional[List[int]] = None, search: Optional[str] = None,
+               workers: int = WORKERS) -> Iterator[bytes]:
+    """Badge sheet PDF for the selected profiles, yielded page by page"""
+    pdf = PdfWriter()
+    yield pdf.start()
+    for page in sheets(ids, search, workers):
+        yield pdf.page(page)
+    yield pdf.finish()
+
+
+def png_page(page: int, ids: Optional[List[int]] = None, search: Optional[str] = None) -> Optional[bytes]:
+    """One badge sheet (1-based page number) as PNG, or None past the last page"""
+    start = (page - 1) * PER_PAGE
+    selected = []
+    for i, p in enumerate(_profiles(ids, search)):
+        if i >= start + PER_PAGE:
+            break
+        if i >= start:
+            selected.append(p)
+    if page < 1 or not selected:
+        return None
+    sheet = next(_pages(_render_chunk(selected)))
+    buf = BytesIO()
+    sheet.save(buf, format='PNG', optimize=True, dpi=(DPI, DPI))
+    return buf.getvalue()
+
+
+def available() -> bool:
+    return Image is not None
@@ -1,89 +1,295 @@
 import cv2
 import threading
 import time
-from datetime import datetime
 import os
 
+from photos import photo_writer
+
+# Stream ladder for /camera/video_feed?stream=<name>: output scale relative to
+# the capture size, JPEG quality and a frame-rate cap. Each variant is
+# encoded at most once per captured frame and only while someone watches it.
+STREAM_VARIANTS = {
+    'full': {'scale': 1.0, 'quality': 80, 'max_fps': 30},
+    'half': {'scale': 0.5, 'quality': 70, 'max_fps': 15},
+    'thumb': {'scale': 0.25, 'quality': 60, 'max_fps': 5},
+}
+DEFAULT_STREAM = 'full'
+CAPTURE_FPS = 30
+# Seconds without any owner (viewer or photo capture) before the device is released
+IDLE_TIMEOUT = float(os.getenv('CAMERA_IDLE_TIMEOUT', '30'))
+
+
+class StreamVariant:
+    """Latest encoded frame of one ladder rung plus its metrics"""
+
+    def __init__(self, name, scale, quality, max_fps):
+        self.name = name
+        self.scale = scale
+        self.quality = quality
+        self.min_interval = 1.0 / max_fps
+        self.max_fps = max_fps
+        self.subscribers = 0
+        self.seq = 0
+        self.part = None
+        self.jpeg = None
+        self.size = None
+        self.last_encode = 0.0
+        self.frames_encoded = 0
+        self.encode_seconds = 0.0
+        self.bytes_encoded = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def due(self, now):
+        return self.subscribers > 0 and now - self.last_encode >= self.min_interval
+
+    def encode(self, frame):
+        """JPEG-encode frame for this rung; returns the multipart chunk or None"""
+        started = time.perf_counter()
+        if self.scale != 1.0:
+            h, w = frame.shape[:2]
+            frame = cv2.resize(frame, (max(1, int(w * self.scale)), max(1, int(h * self.scale))),
+                               interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.encode_seconds += time.perf_counter() - started
+        if not ok:
+            return None
+        data = jpeg.tobytes()
+        self.size = (frame.shape[1], frame.shape[0])
+        self.frames_encoded += 1
+        self.bytes_encoded += len(data)
+        return data
+
+    def stats(self, elapsed):
+        n = self.frames_encoded
+        return {
+            'width': self.size[0] if self.size else None,
+            'height': self.size[1] if self.size else None,
+            'quality': self.quality,
+            'max_fps': self.max_fps,
+            'subscribers': self.subscribers,
+            'frames_encoded': n,
+            'avg_encode_ms': round(self.encode_seconds / n * 1000, 3) if n else None,
+            'avg_frame_bytes': self.bytes_encoded // n if n else None,
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'send_kbps': round(self.bytes_sent * 8 / 1000 / elapsed, 1) if elapsed else 0.0,
+        }
+
+
 class Camera:
-    def __init__(self, camera_index=0):
+    def __init__(self, camera_index=0, idle_timeout=IDLE_TIMEOUT):
         self.camera_index = camera_index
         self.cap = None
         self.frame = None
+        self.frame_ts = None
         self.running = False
         self.thread = None
         self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        # Encode-once broadcast: each captured frame is JPEG-encoded a single
+        # time per subscribed variant and shared (as an immutable multipart
+        # chunk) by every viewer of that variant
+        self.frame_ready = threading.Condition(self.lock)
+        self.variants = {name: StreamVariant(name, **cfg) for name, cfg in STREAM_VARIANTS.items()}
+        self.stats_since = time.monotonic()
+        # Reference-counted ownership: the device runs while anyone holds it
+        # and is released idle_timeout seconds after the last owner lets go
+        self.idle_timeout = idle_timeout
+        self.owners = 0
+        self.idle_since = None
         
     def start(self):
         """Start the camera feed"""
-        if self.running:
-            return
-            
-        self.cap = cv2.VideoCapture(self.camera_index)
-        if not self.cap.isOpened():
-            raise RuntimeError(f"Could not open camera {self.camera_index}")
+        with self.start_lock:
+            if self.running:
+                return
+            # An idle-expired capture thread may still hold the device until
+            # its finally releases it; opening it again now would share it
+            previous = self.thread
+            if previous is not None and previous is not threading.current_thread():
+                previous.join()
+
+            cap = cv2.VideoCapture(self.camera_index)
+            if not cap.isOpened():
+                raise RuntimeError(f"Could not open camera {self.camera_index}")
+                
+            # Set camera properties
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            cap.set(cv2.CAP_PROP_FPS, CAPTURE_FPS)
             
-        # Set camera properties
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.cap.set(cv2.CAP_PROP_FPS, 30)
-        
-        self.running = True
-        self.thread = threading.Thread(target=self._capture_frames)
-        self.thread.daemon = True
-        self.thread.start()
+            with self.lock:
+                self.cap = cap
+                self.frame = None
+                self.frame_ts = None
+                # Started without acquire(): runs until the idle timeout
+                if self.owners == 0:
+                    self.idle_since = time.monotonic()
+                self.running = True
+            self.thread = threading.Thread(target=self._capture_frames, args=(cap,))
+            self.thread.daemon = True
+            self.thread.start()
         
     def stop(self):
         """Stop the camera feed"""
-        self.running = False
-        if self.thread:
+        with self.frame_ready:
+            self.running = False
+            self.frame_ready.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
             self.thread.join()
-        if self.cap:
-            self.cap.release()
+
+    def acquire(self):
+        """Take a reference on the camera, starting it if needed"""
+        with self.lock:
+            self.owners += 1
+            self.idle_since = None
+        try:
+            self.start()
+        except Exception:
+            self.release()
+            raise
+
+    def release(self):
+        """Drop a reference; the last one arms the idle timeout"""
+        with self.lock:
+            self.owners = max(0, self.owners - 1)
+            if self.owners == 0:
+                self.idle_since = time.monotonic()
+
+    def _frame_interval(self):
+        # Capture no faster than the fastest subscribed stream needs
+        fps = max((v.max_fps for v in self.variants.values() if v.subscribers), default=CAPTURE_FPS)
+        return 1.0 / fps
+
+    def _idle_expired(self, now):
+        return self.owners == 0 and self.idle_since is not None and now - self.idle_since >= self.idle_timeout
             
-    def _capture_frames(self):
+    def _capture_frames(self, cap):
         """Continuously capture frames from camera"""
-        while self.running:
-            ret, frame = self.cap.read()
-            if ret:
-                with self.lock:
-                    self.frame = frame.copy()
-            time.sleep(1/30)  # ~30 FPS
+        try:
+            while self.running:
+                ret, frame = cap.read()
+                now = time.monotonic()
+                if ret:
+                    due = [v for v in self.variants.values() if v.due(now)]
+                    # Encode outside the lock so viewers are never blocked on it
+                    encoded = [(v, v.encode(frame)) for v in due]
+                    with self.frame_ready:
+                        # read() hands back a fresh array, so swap it in without a
+                        # copy; read-only because photo writers hold on to it
+                        frame.flags.writeable = False
+                        self.frame = frame
+                        self.frame_ts = now
+                        for v, data in encoded:
+                            v.last_encode = now
+                            if data is not None:
+                                v.jpeg = data
+                                v.part = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + data + b'\r\n'
+                                v.seq += 1
+                        self.frame_ready.notify_all()
+                with self.frame_ready:
+                    if self._idle_expired(now):
+                        self.running = False
+                        self.frame_ready.notify_all()
+                        print(f"📷 Camera idle for {self.idle_timeout:.0f}s, releasing device")
+                        break
+                # read() normally blocks until the device delivers the next
+                # frame; only sleep for whatever is left of the frame interval
+                delay = now + self._frame_interval() - time.monotonic()
+                if not ret:
+                    delay = max(delay, 0.1)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            cap.release()
             
     def get_frame(self):
         """Get the latest frame as JPEG bytes"""
         with self.lock:
-            if self.frame is None:
-                return None
-            ret, jpeg = cv2.imencode('.jpg', self.frame)
-            return jpeg.tobytes() if ret else None
-            
-    def take_picture(self, filename=None):
-        """Take a picture and save it"""
+            full = self.variants[DEFAULT_STREAM]
+            if full.subscribers and full.jpeg is not None:
+                return full.jpeg
+            frame = self.frame
+        if frame is None:
+            return None
+        ret, jpeg = cv2.imencode('.jpg', frame)
+        return jpeg.tobytes() if ret else None
+
+    def subscribe(self, name=DEFAULT_STREAM):
         with self.lock:
-            if self.frame is None:
-                return None
-                
-        if filename is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"patient_{timestamp}.jpg"
+            self.variants[name].subscribers += 1
+
+    def unsubscribe(self, name=DEFAULT_STREAM):
+        with self.lock:
+            self.variants[name].subscribers = max(0, self.variants[name].subscribers - 1)
+
+    def wait_for_frame(self, last_seq=0, timeout=1.0, name=DEFAULT_STREAM, count=True):
+        """Block until the variant has a frame newer than last_seq.
+
+        Returns (seq, multipart chunk); the chunk is None on timeout or when
+        the camera stops. count=False leaves the sent-frame metrics to the
+        caller (the streams.py relay sends one frame to many viewers).
+        """
+        v = self.variants[name]
+        with self.frame_ready:
+            if v.seq == last_seq and self.running:
+                self.frame_ready.wait_for(lambda: v.seq != last_seq or not self.running, timeout)
+            if v.seq == last_seq or v.part is None:
+                return last_seq, None
+            if count:
+                v.frames_sent += 1
+                v.bytes_sent += len(v.part)
+            return v.seq, v.part
+
+    def record_sent(self, name, nbytes):
+        with self.lock:
+            v = self.variants[name]
+            v.frames_sent += 1
+            v.bytes_sent += nbytes
+
+    def stream_stats(self):
+        """Per-variant encode time and bandwidth since the stats were last reset"""
+        with self.lock:
+            elapsed = time.monotonic() - self.stats_since
+            return {
+                'running': self.running,
+                'owners': self.owners,
+                'seconds': round(elapsed, 1),
+                'variants': {name: v.stats(elapsed) for name, v in self.variants.items()},
+            }
             
-        # Create uploads directory if it doesn't exist
-        os.makedirs('uploads', exist_ok=True)
-        filepath = os.path.join('uploads', filename)
-        
-        # Save the image
-        cv2.imwrite(filepath, self.frame)
-        return filename
+    def latest_frame(self, timeout=3.0):
+        """Latest captured frame (read-only array), waiting briefly for the
+        first frame of a freshly started camera"""
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.frame is not None or not self.running, timeout)
+            return self.frame
+            
+    def take_picture(self, filename=None, timeout=3.0):
+        """Take a picture; it is written in the background by photo_writer.
+
+        Returns the filename (or None without a frame). Raises PhotoQueueFull
+        when the writer is backed up.
+        """
+        frame = self.latest_frame(timeout)
+        if frame is None:
+            return None
+        return photo_writer.submit_frame(frame, filename)
 
 # Global camera instance
 camera = Camera()
 
-def generate_frames():
+def generate_frames(stream=DEFAULT_STREAM):
     """Generator function for streaming video frames"""
-    while True:
-        frame = camera.get_frame()
-        if frame is not None:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        else:
-            time.sleep(0.1)
\ No newline at end of file
+    camera.subscribe(stream)
+    try:
+        seq = 0
+        while True:
+            seq, part = camera.wait_for_frame(seq, name=stream)
+            if part is not None:
+                yield part
+            elif not camera.running:
+                time.sleep(0.1)
+    finally:
+        camera.unsubscribe(stream)
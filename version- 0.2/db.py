@@ -1,20 +1,83 @@
 import sqlite3
 import os
 import json
+import re
+import threading
 import qrcode
 import base64
+import hashlib
+import hmac
+import secrets
+import struct
+from collections import OrderedDict
+from datetime import datetime, timezone
 from io import BytesIO
-from typing import Iterable, Tuple, Any, Optional, Union
+from typing import Iterable, Iterator, List, Tuple, Any, Optional, Union
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'app.db')
 
+# Connection tuning. WAL lets dashboard reads proceed while /api/vitals writes,
+# and synchronous=NORMAL is durable across application crashes in WAL mode.
+BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+MMAP_SIZE_BYTES = int(os.getenv('DB_MMAP_SIZE_BYTES', str(64 * 1024 * 1024)))
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# One connection per (thread, database path). gunicorn gthread workers reuse
+# their threads, so each thread opens its connection once and keeps it.
+_local = threading.local()
+
+
+def _connect(path: Optional[str] = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open a new tuned connection (callers own it and must close it).
+
+    check_same_thread=False is for connections shared between threads
+    under the caller's own lock.
+    """
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000.0, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+    except sqlite3.OperationalError:
+        # Another process holds a lock while switching modes; WAL is persistent
+        # so the next connection will pick it up.
+        pass
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE_BYTES}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
 
+def get_conn() -> sqlite3.Connection:
+    """Return this thread's pooled connection to DB_PATH.
+
+    The connection stays open between calls; ``with get_conn() as conn:``
+    still commits on success and rolls back on error as before.
+    """
+    conns = getattr(_local, 'conns', None)
+    # Connections must not cross a fork (gunicorn workers, multiprocessing)
+    if conns is None or getattr(_local, 'pid', None) != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(DB_PATH)
+    if conn is None:
+        conn = conns[DB_PATH] = _connect(DB_PATH)
+    return conn
+
+
+def close_conn() -> None:
+    """Close the calling thread's pooled connections"""
+    conns = getattr(_local, 'conns', None) or {}
+    if getattr(_local, 'pid', None) == os.getpid():
+        for conn in conns.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+    _local.conns = {}
+
+
 def init_db() -> None:
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     with get_conn() as conn:
@@ -176,7 +239,8 @@ def init_db() -> None:
         for col_name, col_type in new_pp_columns:
             if col_name not in pp_cols:
                 conn.execute(f'ALTER TABLE patient_profiles ADD COLUMN {col_name} {col_type}')
-        
+
+        apply_migrations(conn)
         conn.commit()
     # Backfill profiles after ensuring schemas
     try:
@@ -185,6 +249,387 @@ def init_db() -> None:
         pass
 
 
+# Full-text search. Each searchable table gets an external-content FTS5 index
+# (no duplicated row data) kept in sync by triggers. Weights rank name matches
+# above contact/age and those above free-text clinical fields.
+SEARCH_INDEXES = {
+    'patients': ('patients_fts', ['name', 'contact', 'age', 'chief_complaint', 'additional_symptoms', 'medical_history'],
+                 [10.0, 5.0, 2.0, 3.0, 1.0, 1.0]),
+    'stored_patients': ('stored_patients_fts', ['name', 'contact', 'age', 'chief_complaint', 'additional_symptoms', 'medical_history'],
+                        [10.0, 5.0, 2.0, 3.0, 1.0, 1.0]),
+    'patient_profiles': ('patient_profiles_fts', ['name', 'contact', 'medical_history'], [10.0, 5.0, 1.0]),
+}
+
+_fts_enabled = {}  # DB_PATH -> bool
+
+
+def _create_search_indexes(conn: sqlite3.Connection) -> None:
+    try:
+        conn.execute('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE temp._fts5_probe')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: searches keep using LIKE
+        return
+    for table, (fts, cols, weights) in SEARCH_INDEXES.items():
+        col_list = ', '.join(cols)
+        new_vals = ', '.join(f'new.{c}' for c in cols)
+        old_vals = ', '.join(f'old.{c}' for c in cols)
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{col_list}, content='{table}', content_rowid='id', prefix='2 3')"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col_list} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+            f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+        )
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        conn.execute(
+            f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', ?)",
+            (f"bm25({', '.join(str(w) for w in weights)})",)
+        )
+
+
+# Tables whose photo column references a file in uploads/
+PHOTO_TABLES = ('patients', 'stored_patients', 'patient_profiles')
+
+
+def _create_photo_refs(conn: sqlite3.Connection) -> None:
+    # Reference counts per stored photo, kept current by triggers so the
+    # photo garbage collector never has to scan the visit tables
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS photo_refs ("
+        "name TEXT PRIMARY KEY, refs INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID"
+    )
+    inc = ("INSERT INTO photo_refs(name, refs) VALUES (new.photo, 1) "
+           "ON CONFLICT(name) DO UPDATE SET refs = refs + 1;")
+    dec = "UPDATE photo_refs SET refs = refs - 1 WHERE name = old.photo;"
+    for table in PHOTO_TABLES:
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS photo_refs_{table}_ai AFTER INSERT ON {table} "
+            f"WHEN COALESCE(new.photo, '') <> '' BEGIN {inc} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS photo_refs_{table}_ad AFTER DELETE ON {table} "
+            f"WHEN COALESCE(old.photo, '') <> '' BEGIN {dec} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS photo_refs_{table}_au AFTER UPDATE OF photo ON {table} "
+            f"WHEN old.photo IS NOT new.photo BEGIN "
+            f"UPDATE photo_refs SET refs = refs - 1 WHERE name = old.photo AND COALESCE(old.photo, '') <> ''; "
+            f"INSERT INTO photo_refs(name, refs) SELECT new.photo, 1 WHERE COALESCE(new.photo, '') <> '' "
+            f"ON CONFLICT(name) DO UPDATE SET refs = refs + 1; END"
+        )
+    union = ' UNION ALL '.join(f"SELECT photo FROM {t} WHERE COALESCE(photo, '') <> ''" for t in PHOTO_TABLES)
+    conn.execute("DELETE FROM photo_refs")
+    conn.execute(f"INSERT INTO photo_refs(name, refs) SELECT photo, COUNT(*) FROM ({union}) GROUP BY photo")
+
+
+# Per-profile visit statistics for one profile id expression ({pid}). Every
+# subquery is answered from the (profile_id, created_at/archived_at) indexes,
+# so refreshing a profile costs O(its visits), not a scan of the visit tables.
+_PROFILE_STATS_ROW = """
+    SELECT {pid},
+        (SELECT COUNT(*) FROM patients WHERE profile_id = {pid})
+            + (SELECT COUNT(*) FROM stored_patients WHERE profile_id = {pid}),
+        (SELECT COUNT(*) FROM patients WHERE profile_id = {pid}),
+        (SELECT MAX(ts) FROM (
+            SELECT MAX(created_at) AS ts FROM patients WHERE profile_id = {pid}
+            UNION ALL
+            SELECT MAX(archived_at) FROM stored_patients WHERE profile_id = {pid})),
+        (SELECT photo FROM (
+            SELECT photo, created_at AS ts FROM patients
+            WHERE profile_id = {pid} AND COALESCE(photo, '') <> ''
+            UNION ALL
+            SELECT photo, archived_at FROM stored_patients
+            WHERE profile_id = {pid} AND COALESCE(photo, '') <> ''
+        ) ORDER BY ts DESC LIMIT 1)
+"""
+_PROFILE_STATS_COLS = 'profile_id, visit_count, current_visits, last_visit, visit_photo'
+
+
+def _refresh_profile_stats_sql(pid: str, when: str = '1') -> str:
+    # Upsert rather than INSERT OR REPLACE: an OR clause on the statement that
+    # fired the trigger would override the one written here
+    return (f"INSERT INTO profile_stats({_PROFILE_STATS_COLS}) "
+            + _PROFILE_STATS_ROW.format(pid=pid)
+            + f" WHERE {when} ON CONFLICT(profile_id) DO UPDATE SET "
+            "visit_count = excluded.visit_count, current_visits = excluded.current_visits, "
+            "last_visit = excluded.last_visit, visit_photo = excluded.visit_photo;")
+
+
+def rebuild_profile_stats(conn: sqlite3.Connection) -> None:
+    """Recompute profile_stats for every profile and every visited profile id"""
+    conn.execute("DELETE FROM profile_stats")
+    conn.execute(
+        f"INSERT INTO profile_stats({_PROFILE_STATS_COLS}) "
+        + _PROFILE_STATS_ROW.format(pid='u.profile_id')
+        + " FROM (SELECT profile_id FROM patients UNION SELECT profile_id FROM stored_patients"
+        " UNION SELECT id FROM patient_profiles) u"
+        " WHERE u.profile_id IS NOT NULL"
+    )
+
+
+def _create_profile_stats(conn: sqlite3.Connection) -> None:
+    # Visit count, last visit and newest visit photo per profile, refreshed
+    # by triggers whenever a visit is added, archived, moved or deleted, so
+    # profile listings no longer aggregate both visit tables per page load.
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS profile_stats ("
+        "profile_id INTEGER PRIMARY KEY, visit_count INTEGER NOT NULL DEFAULT 0, "
+        "current_visits INTEGER NOT NULL DEFAULT 0, last_visit TEXT, visit_photo TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_profile_stats_active ON profile_stats(current_visits)")
+    for table, ts_col in (('patients', 'created_at'), ('stored_patients', 'archived_at')):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS profile_stats_{table}_ai AFTER INSERT ON {table} "
+            f"WHEN new.profile_id IS NOT NULL BEGIN {_refresh_profile_stats_sql('new.profile_id')} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS profile_stats_{table}_ad AFTER DELETE ON {table} "
+            f"WHEN old.profile_id IS NOT NULL BEGIN {_refresh_profile_stats_sql('old.profile_id')} END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS profile_stats_{table}_au AFTER UPDATE OF profile_id, photo, {ts_col} "
+            f"ON {table} BEGIN "
+            + _refresh_profile_stats_sql('old.profile_id', 'old.profile_id IS NOT NULL AND old.profile_id IS NOT new.profile_id')
+            + _refresh_profile_stats_sql('new.profile_id', 'new.profile_id IS NOT NULL')
+            + " END"
+        )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS profile_stats_profiles_ad AFTER DELETE ON patient_profiles "
+        "BEGIN DELETE FROM profile_stats WHERE profile_id = old.id; END"
+    )
+    rebuild_profile_stats(conn)
+
+
+def _bump_profile_version_sql(pid: str) -> str:
+    return (f"INSERT INTO profile_versions(profile_id, seq) "
+            f"VALUES ({pid}, (SELECT COALESCE(MAX(seq), 0) + 1 FROM profile_versions)) "
+            "ON CONFLICT(profile_id) DO UPDATE SET seq = excluded.seq;")
+
+
+def _create_profile_versions(conn: sqlite3.Connection) -> None:
+    # Change feed for the profile directory: every profile edit, visit-stat
+    # change or delete moves that profile to a new, higher seq. Clients ask
+    # for "changed since seq N" and patch their list; a changed id whose
+    # profile no longer exists is a deletion (tombstone).
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS profile_versions ("
+        "profile_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_profile_versions_seq ON profile_versions(seq)")
+    for event, pid in (('INSERT', 'new.id'), ('UPDATE', 'new.id'), ('DELETE', 'old.id')):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS profile_versions_profiles_{event.lower()} AFTER {event} "
+            f"ON patient_profiles BEGIN {_bump_profile_version_sql(pid)} END"
+        )
+    for event in ('INSERT', 'UPDATE'):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS profile_versions_stats_{event.lower()} AFTER {event} "
+            f"ON profile_stats BEGIN {_bump_profile_version_sql('new.profile_id')} END"
+        )
+    conn.execute(
+        "INSERT OR IGNORE INTO profile_versions(profile_id, seq) "
+        "SELECT id, ROW_NUMBER() OVER (ORDER BY id) FROM patient_profiles"
+    )
+    # Every profile gets a stats row, so sorting by visits or last visit can
+    # walk a profile_stats index
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS profile_stats_profiles_ai AFTER INSERT ON patient_profiles "
+        "BEGIN INSERT INTO profile_stats(profile_id) VALUES (new.id) ON CONFLICT(profile_id) DO NOTHING; END"
+    )
+    conn.execute("INSERT OR IGNORE INTO profile_stats(profile_id) SELECT id FROM patient_profiles")
+
+
+def fts_enabled(conn: sqlite3.Connection) -> bool:
+    """True when the FTS5 search indexes exist in this database"""
+    if DB_PATH not in _fts_enabled:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+        ).fetchone()
+        _fts_enabled[DB_PATH] = bool(row)
+    return _fts_enabled[DB_PATH]
+
+
+def fts_query(search: Optional[str]) -> Optional[str]:
+    """Turn free text into an FTS5 prefix query ('ann head' -> '"ann"* "head"*')"""
+    tokens = re.findall(r'\w+', search or '', re.UNICODE)
+    if not tokens:
+        return None
+    return ' '.join('"' + t.replace('"', '""') + '"*' for t in tokens)
+
+
+def _search_visits(conn: sqlite3.Connection, table: str, order_col: str, search: str,
+                   limit: Optional[int]) -> list:
+    """Ranked visit search with the LIMIT applied in SQL"""
+    match = fts_query(search)
+    if match and fts_enabled(conn):
+        fts = SEARCH_INDEXES[table][0]
+        return conn.execute(
+            f"""
+            SELECT t.* FROM {fts} f
+            JOIN {table} t ON t.id = f.rowid
+            WHERE {fts} MATCH ?
+            ORDER BY f.rank, t.{order_col} DESC
+            LIMIT ?
+            """,
+            (match, -1 if limit is None else int(limit)),
+        ).fetchall()
+    like = f"%{search}%"
+    return conn.execute(
+        f"""
+        SELECT * FROM {table}
+        WHERE COALESCE(name,'') LIKE ?
+           OR COALESCE(age,'') LIKE ?
+           OR COALESCE(chief_complaint,'') LIKE ?
+        ORDER BY {order_col} DESC, id DESC
+        LIMIT ?
+        """,
+        (like, like, like, -1 if limit is None else int(limit)),
+    ).fetchall()
+
+
+def profile_search_cte(conn: sqlite3.Connection, search: str, limit: Optional[int] = None) -> Tuple[str, list]:
+    """Build a ``profile_hits(id, score)`` CTE of ranked matching profile ids.
+
+    An exact numeric profile id always ranks first. Callers join
+    ``profile_hits h ON h.id = pp.id`` and order by ``MIN(h.score)``.
+    """
+    term = (search or '').strip()
+    exact_id = int(term) if term.isdigit() else -1
+    match = fts_query(term)
+    lim = -1 if limit is None else int(limit)
+    if match and fts_enabled(conn):
+        sql = """
+            WITH profile_hits(id, score) AS (
+                SELECT id, -1e300 FROM patient_profiles WHERE id = ?
+                UNION ALL
+                SELECT * FROM (
+                    SELECT rowid, rank FROM patient_profiles_fts
+                    WHERE patient_profiles_fts MATCH ?
+                    ORDER BY rank LIMIT ?
+                )
+            )
+        """
+        return sql, [exact_id, match, lim]
+    like = f"%{term}%"
+    sql = """
+        WITH profile_hits(id, score) AS (
+            SELECT id, 0 FROM patient_profiles
+            WHERE name LIKE ? OR contact LIKE ? OR CAST(id AS TEXT) LIKE ?
+            LIMIT ?
+        )
+    """
+    return sql, [like, like, like, lim]
+
+
+# Versioned schema changes applied on top of the base tables. Each step (SQL
+# text or a callable taking the connection) runs once per database;
+# PRAGMA user_version records the last applied version.
+MIGRATIONS = [
+    (1, [
+        # Timestamps are compared as text below, so normalise any legacy
+        # formats to SQLite's canonical 'YYYY-MM-DD HH:MM:SS'.
+        "UPDATE patients SET created_at = datetime(created_at) "
+        "WHERE datetime(created_at) IS NOT NULL AND created_at IS NOT datetime(created_at)",
+        "UPDATE stored_patients SET created_at = datetime(created_at) "
+        "WHERE datetime(created_at) IS NOT NULL AND created_at IS NOT datetime(created_at)",
+        "UPDATE stored_patients SET archived_at = datetime(archived_at) "
+        "WHERE datetime(archived_at) IS NOT NULL AND archived_at IS NOT datetime(archived_at)",
+        # Recent-first listings (dashboard, store, /sensor). The implicit
+        # trailing rowid makes 'ORDER BY created_at DESC, id DESC' index-ordered.
+        "CREATE INDEX IF NOT EXISTS idx_patients_created ON patients(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stored_archived ON stored_patients(archived_at)",
+        # Per-profile visit history; also covers the profile visit-count joins
+        "CREATE INDEX IF NOT EXISTS idx_patients_profile ON patients(profile_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stored_profile ON stored_patients(profile_id, archived_at)",
+        # Profile lookups: get_or_create_profile, directory ordering, patient login
+        "CREATE INDEX IF NOT EXISTS idx_profiles_name_contact "
+        "ON patient_profiles(COALESCE(name,''), COALESCE(contact,''))",
+        "CREATE INDEX IF NOT EXISTS idx_profiles_created ON patient_profiles(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_profiles_login ON patient_profiles(username, patient_id_number)",
+    ]),
+    (2, [
+        _create_search_indexes,
+    ]),
+    (3, [
+        # Device readings live here instead of as mostly-NULL visit rows.
+        # ts is unix epoch seconds; temperatures are Celsius as sent by devices.
+        """
+        CREATE TABLE IF NOT EXISTS vitals_samples (
+            id INTEGER PRIMARY KEY,
+            device_id TEXT,
+            profile_id INTEGER,
+            ts REAL NOT NULL,
+            heart_rate REAL,
+            spo2 REAL,
+            body_temp_c REAL,
+            env_temp_c REAL,
+            humidity_percent REAL,
+            weight_kg REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_vitals_profile_ts ON vitals_samples(profile_id, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_vitals_device_ts ON vitals_samples(device_id, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_vitals_ts ON vitals_samples(ts)",
+    ]),
+    (4, [
+        _create_photo_refs,
+    ]),
+    (5, [
+        _create_profile_stats,
+    ]),
+    (6, [
+        _create_profile_versions,
+        # Keyset orders for the paged profile directory (rowid breaks ties)
+        "CREATE INDEX IF NOT EXISTS idx_profiles_name ON patient_profiles(COALESCE(name, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_profile_stats_last ON profile_stats(COALESCE(last_visit, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_profile_stats_visits ON profile_stats(visit_count)",
+    ]),
+    (7, [
+        # Server-sent event log shared by all workers (see events.py).
+        # AUTOINCREMENT so ids are never reused after old events are pruned;
+        # ts is unix epoch seconds.
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Apply pending MIGRATIONS and return the resulting schema version"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        for step in statements:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        current = version
+    return current
+
+
 def insert_patient(values: Tuple[Any, ...]) -> int:
     with get_conn() as conn:
         cur = conn.execute(
@@ -203,27 +648,191 @@ def insert_patient(values: Tuple[Any, ...]) -> int:
         return cur.lastrowid
 
 
-def query_patients(search: Optional[str] = None) -> Iterable[sqlite3.Row]:
+def query_patients(search: Optional[str] = None, limit: Optional[int] = None) -> Iterable[sqlite3.Row]:
+    """Current visits, newest first; searches are ranked by relevance"""
     with get_conn() as conn:
         if search:
-            like = f"%{search}%"
-            cur = conn.execute(
-                """
-                SELECT * FROM patients
-                WHERE COALESCE(name,'') LIKE ?
-                   OR COALESCE(age,'') LIKE ?
-                   OR COALESCE(chief_complaint,'') LIKE ?
-                ORDER BY datetime(created_at) DESC
-                """,
-                (like, like, like),
-            )
-        else:
-            cur = conn.execute(
-                "SELECT * FROM patients ORDER BY datetime(created_at) DESC"
-            )
+            return _search_visits(conn, 'patients', 'created_at', search, limit)
+        cur = conn.execute(
+            "SELECT * FROM patients ORDER BY created_at DESC, id DESC LIMIT ?",
+            (-1 if limit is None else int(limit),)
+        )
         return cur.fetchall()
 
 
+def parse_cursor(raw: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Parse a keyset cursor of the form '<timestamp>,<id>'"""
+    if not raw:
+        return None
+    ts, sep, rid = raw.rpartition(',')
+    if not sep or not ts:
+        return None
+    try:
+        return ts, int(rid)
+    except ValueError:
+        return None
+
+
+def format_cursor(ts: Optional[str], row_id: int) -> str:
+    return f"{ts or ''},{int(row_id)}"
+
+
+def _visit_search_filter(conn: sqlite3.Connection, table: str, search: Optional[str]) -> Tuple[list, list]:
+    """WHERE terms and params restricting a visit table to search matches"""
+    if not search:
+        return [], []
+    match = fts_query(search)
+    if match and fts_enabled(conn):
+        fts = SEARCH_INDEXES[table][0]
+        return [f"id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)"], [match]
+    like = f"%{search}%"
+    return (["(COALESCE(name,'') LIKE ? OR COALESCE(age,'') LIKE ? OR COALESCE(chief_complaint,'') LIKE ?)"],
+            [like, like, like])
+
+
+def _page_visits(table: str, order_col: str, search: Optional[str], before: Optional[Tuple[str, int]],
+                 limit: int) -> Tuple[list, Optional[str]]:
+    """Keyset page of visits ordered by (order_col, id) descending.
+
+    Returns the rows and the cursor for the next page (None on the last page).
+    Searches filter through the FTS index but keep recency order so cursors
+    stay stable between pages.
+    """
+    with get_conn() as conn:
+        where, params = _visit_search_filter(conn, table, search)
+        if before:
+            where.append(f"({order_col}, id) < (?, ?)")
+            params += [before[0], before[1]]
+        sql = f"SELECT * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order_col} DESC, id DESC LIMIT ?"
+        rows = conn.execute(sql, (*params, int(limit) + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = format_cursor(rows[-1][order_col], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def page_patients(search: Optional[str] = None, before: Optional[Tuple[str, int]] = None,
+                  limit: int = 25) -> Tuple[list, Optional[str]]:
+    """One page of current visits, newest first"""
+    return _page_visits('patients', 'created_at', search, before, limit)
+
+
+def parse_since(raw: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Parse an incremental export starting point.
+
+    Either an export cursor '<timestamp>,<id>' (resume right after that row)
+    or a bare ISO date/timestamp (everything stamped at or after it). The
+    timestamp is normalised to the stored UTC 'YYYY-MM-DD HH:MM:SS' form, so
+    '2024-05-01T08:00:00Z' and '2024-05-01 08:00:00' mean the same thing.
+    Raises ValueError for anything else.
+    """
+    if not raw:
+        return None
+    ts, rid = raw, 0
+    if ',' in raw:
+        ts, _sep, rid_text = raw.rpartition(',')
+        rid = int(rid_text)
+    stamp = datetime.fromisoformat(ts.strip())
+    if stamp.tzinfo is not None:
+        stamp = stamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return stamp.strftime('%Y-%m-%d %H:%M:%S'), rid
+
+
+def visit_cursor(table: str) -> Optional[str]:
+    """Export cursor of the newest row in a visit table (None when empty)"""
+    order_col = 'archived_at' if table == 'stored_patients' else 'created_at'
+    with get_conn() as conn:
+        row = conn.execute(
+            f"SELECT {order_col} AS ts, id FROM {table} ORDER BY {order_col} DESC, id DESC LIMIT 1").fetchone()
+    return format_cursor(row['ts'], row['id']) if row else None
+
+
+def iter_visits(table: str, search: Optional[str] = None, since: Optional[Tuple[str, int]] = None,
+                until: Optional[Tuple[str, int]] = None, batch_size: int = 1000) -> Iterator[List[sqlite3.Row]]:
+    """Stream visits in fetchmany batches from a dedicated connection.
+
+    Without ``since`` rows come newest first (as on the dashboard). With a
+    ``since`` cursor (parse_since) only rows after it in (timestamp, id) order
+    are returned, oldest first; timestamps have second resolution, so the id
+    breaks ties between rows stamped in the same second. ``until`` caps the
+    export at a cursor taken beforehand (visit_cursor), which is the next
+    incremental starting point.
+    """
+    order_col = 'archived_at' if table == 'stored_patients' else 'created_at'
+    conn = _connect()
+    try:
+        where, params = _visit_search_filter(conn, table, search)
+        if since:
+            where.append(f"({order_col}, id) > (?, ?)")
+            params += [since[0], since[1]]
+        if until:
+            where.append(f"({order_col}, id) <= (?, ?)")
+            params += [until[0], until[1]]
+        sql = f"SELECT * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        direction = 'ASC' if since else 'DESC'
+        sql += f" ORDER BY {order_col} {direction}, id {direction}"
+        cur = conn.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        conn.close()
+
+
+def iter_profiles(ids: Optional[List[int]] = None, search: Optional[str] = None,
+                  batch_size: int = 500) -> Iterator[List[sqlite3.Row]]:
+    """Stream profiles (id, name, age, gender) in id order, batch by batch.
+
+    Selects the given ``ids``, the profiles matching ``search``, or every
+    profile. Uses keyset paging on a dedicated connection, so memory stays
+    flat however many profiles are selected.
+    """
+    conn = _connect()
+    try:
+        if ids is not None:
+            wanted = sorted(set(int(i) for i in ids))
+            for start in range(0, len(wanted), batch_size):
+                chunk = wanted[start:start + batch_size]
+                marks = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT id, name, age, gender FROM patient_profiles WHERE id IN ({marks}) ORDER BY id",
+                    chunk).fetchall()
+                if rows:
+                    yield rows
+            return
+        cte, params = ('', [])
+        join = ''
+        if search:
+            cte, params = profile_search_cte(conn, search)
+            join = 'JOIN (SELECT DISTINCT id FROM profile_hits) h ON h.id = pp.id'
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"{cte} SELECT pp.id, pp.name, pp.age, pp.gender FROM patient_profiles pp {join} "
+                "WHERE pp.id > ? ORDER BY pp.id LIMIT ?",
+                params + [last_id, batch_size]).fetchall()
+            if not rows:
+                break
+            yield rows
+            last_id = rows[-1]['id']
+    finally:
+        conn.close()
+
+
+def table_columns(table: str) -> List[Tuple[str, str]]:
+    """(name, declared type) for each column of a table"""
+    with get_conn() as conn:
+        return [(r['name'], (r['type'] or '').upper()) for r in conn.execute(f'PRAGMA table_info({table})')]
+
+
 def get_patient(patient_id: int):
     with get_conn() as conn:
         cur = conn.execute("SELECT * FROM patients WHERE id = ?", (patient_id,))
@@ -289,11 +898,11 @@ def get_profile(profile_id: int):
 def get_profile_visits(profile_id: int):
     with get_conn() as conn:
         current = conn.execute(
-            "SELECT *, 'current' AS source FROM patients WHERE profile_id = ? ORDER BY datetime(created_at) DESC",
+            "SELECT *, 'current' AS source FROM patients WHERE profile_id = ? ORDER BY created_at DESC, id DESC",
             (profile_id,)
         ).fetchall()
         archived = conn.execute(
-            "SELECT *, 'archived' AS source FROM stored_patients WHERE profile_id = ? ORDER BY datetime(archived_at) DESC",
+            "SELECT *, 'archived' AS source FROM stored_patients WHERE profile_id = ? ORDER BY archived_at DESC, id DESC",
             (profile_id,)
         ).fetchall()
         return current, archived
@@ -319,27 +928,24 @@ def backfill_profiles() -> None:
         conn.commit()
 
 
-def query_stored(search: Optional[str] = None) -> Iterable[sqlite3.Row]:
+def query_stored(search: Optional[str] = None, limit: Optional[int] = None) -> Iterable[sqlite3.Row]:
+    """Archived visits, newest first; searches are ranked by relevance"""
     with get_conn() as conn:
         if search:
-            like = f"%{search}%"
-            cur = conn.execute(
-                """
-                SELECT * FROM stored_patients
-                WHERE COALESCE(name,'') LIKE ?
-                   OR COALESCE(age,'') LIKE ?
-                   OR COALESCE(chief_complaint,'') LIKE ?
-                ORDER BY datetime(archived_at) DESC
-                """,
-                (like, like, like),
-            )
-        else:
-            cur = conn.execute(
-                "SELECT * FROM stored_patients ORDER BY datetime(archived_at) DESC"
-            )
+            return _search_visits(conn, 'stored_patients', 'archived_at', search, limit)
+        cur = conn.execute(
+            "SELECT * FROM stored_patients ORDER BY archived_at DESC, id DESC LIMIT ?",
+            (-1 if limit is None else int(limit),)
+        )
         return cur.fetchall()
 
 
+def page_stored(search: Optional[str] = None, before: Optional[Tuple[str, int]] = None,
+                limit: int = 25) -> Tuple[list, Optional[str]]:
+    """One page of archived visits, most recently archived first"""
+    return _page_visits('stored_patients', 'archived_at', search, before, limit)
+
+
 def get_stored(stored_id: int):
     with get_conn() as conn:
         return conn.execute("SELECT * FROM stored_patients WHERE id = ?", (stored_id,)).fetchone()
@@ -351,6 +957,20 @@ def delete_stored(stored_id: int) -> None:
         conn.commit()
 
 
+def referenced_photos() -> set:
+    """Names of photos referenced by at least one visit or profile row"""
+    conn = get_conn()
+    return {r[0] for r in conn.execute('SELECT name FROM photo_refs WHERE refs > 0')}
+
+
+def prune_photo_refs() -> int:
+    """Drop reference-count rows that have fallen to zero"""
+    with get_conn() as conn:
+        cur = conn.execute('DELETE FROM photo_refs WHERE refs <= 0')
+        conn.commit()
+        return cur.rowcount
+
+
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     with get_conn() as conn:
         row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
@@ -443,6 +1063,38 @@ def delete_patient(patient_id: int) -> None:
         conn.commit()
 
 
+# Vitals time series
+
+VITALS_SAMPLE_COLUMNS = [
+    'device_id', 'profile_id', 'ts', 'heart_rate', 'spo2',
+    'body_temp_c', 'env_temp_c', 'humidity_percent', 'weight_kg'
+]
+
+
+def insert_vitals_samples(samples: Iterable[Tuple[Any, ...]]) -> int:
+    """Insert sample tuples (VITALS_SAMPLE_COLUMNS order) in one transaction"""
+    rows = list(samples)
+    if not rows:
+        return 0
+    cols = ', '.join(VITALS_SAMPLE_COLUMNS)
+    marks = ', '.join(['?'] * len(VITALS_SAMPLE_COLUMNS))
+    with get_conn() as conn:
+        conn.executemany(f"INSERT INTO vitals_samples ({cols}) VALUES ({marks})", rows)
+        conn.commit()
+    return len(rows)
+
+
+def latest_vitals_sample(profile_id: Optional[int] = None) -> Optional[sqlite3.Row]:
+    """Most recent device reading, optionally for one profile"""
+    with get_conn() as conn:
+        if profile_id is not None:
+            return conn.execute(
+                "SELECT * FROM vitals_samples WHERE profile_id = ? ORDER BY ts DESC LIMIT 1",
+                (profile_id,)
+            ).fetchone()
+        return conn.execute("SELECT * FROM vitals_samples ORDER BY ts DESC LIMIT 1").fetchone()
+
+
 # Patient Profile Management Functions
 
 def update_patient_profile(profile_id: int, data: dict) -> None:
@@ -466,6 +1118,7 @@ def update_patient_profile(profile_id: int, data: dict) -> None:
     with get_conn() as conn:
         conn.execute(f"UPDATE patient_profiles SET {', '.join(set_parts)} WHERE id = ?", tuple(values))
         conn.commit()
+    invalidate_qr_cache(profile_id)
 
 
 def create_patient_profile(data: dict) -> int:
@@ -492,44 +1145,197 @@ def create_patient_profile(data: dict) -> int:
             )
         )
         conn.commit()
-        return cur.lastrowid
+    # A recycled id must not serve the previous profile's QR
+    invalidate_qr_cache(cur.lastrowid)
+    return cur.lastrowid
 
 
 def get_all_patient_profiles(search: Optional[str] = None) -> Iterable[sqlite3.Row]:
-    """Get all patient profiles with optional search"""
+    """Get all patient profiles with optional search, plus their visit statistics"""
+    # Visit statistics come from profile_stats (kept current by triggers)
+    # instead of joining and grouping both visit tables on every call
+    select = """
+        SELECT pp.*,
+               COALESCE(ps.visit_count, 0) AS visit_count,
+               ps.last_visit AS last_visit,
+               COALESCE(NULLIF(pp.photo, ''), ps.visit_photo) AS representative_photo
+    """
     with get_conn() as conn:
         if search:
-            like = f"%{search}%"
+            cte, params = profile_search_cte(conn, search)
             cur = conn.execute(
-                """
-                SELECT pp.*, 
-                       COUNT(DISTINCT p.id) + COUNT(DISTINCT sp.id) as visit_count,
-                       MAX(COALESCE(p.created_at, sp.archived_at)) as last_visit
-                FROM patient_profiles pp
-                LEFT JOIN patients p ON pp.id = p.profile_id
-                LEFT JOIN stored_patients sp ON pp.id = sp.profile_id
-                WHERE pp.name LIKE ? OR pp.contact LIKE ? OR pp.id LIKE ?
+                cte + select + """
+                FROM profile_hits h
+                JOIN patient_profiles pp ON pp.id = h.id
+                LEFT JOIN profile_stats ps ON ps.profile_id = pp.id
                 GROUP BY pp.id
-                ORDER BY pp.created_at DESC
+                ORDER BY MIN(h.score), pp.created_at DESC
                 """,
-                (like, like, like),
+                params,
             )
         else:
             cur = conn.execute(
-                """
-                SELECT pp.*, 
-                       COUNT(DISTINCT p.id) + COUNT(DISTINCT sp.id) as visit_count,
-                       MAX(COALESCE(p.created_at, sp.archived_at)) as last_visit
+                select + """
                 FROM patient_profiles pp
-                LEFT JOIN patients p ON pp.id = p.profile_id
-                LEFT JOIN stored_patients sp ON pp.id = sp.profile_id
-                GROUP BY pp.id
+                LEFT JOIN profile_stats ps ON ps.profile_id = pp.id
                 ORDER BY pp.created_at DESC
                 """
             )
         return cur.fetchall()
 
 
+def profile_directory_stats() -> dict:
+    """Header counts for the profile directory in a single round trip"""
+    with get_conn() as conn:
+        row = conn.execute(
+            """
+            SELECT (SELECT COUNT(*) FROM patient_profiles) AS total_patients,
+                   (SELECT COUNT(*) FROM profile_stats WHERE current_visits > 0) AS active_patients,
+                   (SELECT COUNT(*) FROM patients) + (SELECT COUNT(*) FROM stored_patients) AS total_visits
+            """
+        ).fetchone()
+        return dict(row)
+
+
+def profile_visit_photo(profile_id: int) -> Optional[str]:
+    """Newest visit photo for a profile (from profile_stats)"""
+    with get_conn() as conn:
+        row = conn.execute("SELECT visit_photo FROM profile_stats WHERE profile_id = ?", (profile_id,)).fetchone()
+        return row['visit_photo'] if row else None
+
+
+# Fields the paged profile API can project (?fields=). Login credentials
+# (username, patient_id_number) are deliberately not exposed.
+PROFILE_FIELDS = {
+    **{col: f"pp.{col}" for col in (
+        'id', 'name', 'dob', 'age', 'gender', 'contact', 'address', 'emergency_name', 'emergency_relation',
+        'emergency_contact', 'emergency_address', 'medical_history', 'allergies', 'medications',
+        'prescriptions', 'test_results', 'diagnoses', 'treatment_records', 'photo', 'notes', 'created_at')},
+    'visit_count': "COALESCE(ps.visit_count, 0)",
+    'last_visit': "ps.last_visit",
+    'representative_photo': "COALESCE(NULLIF(pp.photo, ''), ps.visit_photo)",
+}
+# What a directory card shows
+PROFILE_CARD_FIELDS = ('id', 'name', 'age', 'gender', 'contact', 'representative_photo',
+                       'visit_count', 'last_visit', 'created_at')
+# sort name -> (key expression, id expression, default direction, drive from profile_stats)
+PROFILE_SORTS = {
+    'created': ("pp.created_at", "pp.id", 'DESC', False),
+    'name': ("COALESCE(pp.name, '')", "pp.id", 'ASC', False),
+    'id': ("pp.id", "pp.id", 'ASC', False),
+    'last_visit': ("COALESCE(ps.last_visit, '')", "ps.profile_id", 'DESC', True),
+    'visits': ("ps.visit_count", "ps.profile_id", 'DESC', True),
+}
+
+
+def parse_profile_cursor(raw: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Parse a directory cursor '<sort key>,<id>' (the key may be empty)"""
+    key, sep, rid = (raw or '').rpartition(',')
+    if not sep:
+        return None
+    try:
+        return key, int(rid)
+    except ValueError:
+        return None
+
+
+def parse_profile_fields(raw: Optional[str]) -> List[str]:
+    """Validate ?fields=a,b,c (id is always included); raises ValueError"""
+    if not raw:
+        return list(PROFILE_CARD_FIELDS)
+    fields = ['id']
+    for f in (x.strip() for x in raw.split(',')):
+        if not f or f in fields:
+            continue
+        if f not in PROFILE_FIELDS:
+            raise ValueError(f"Unknown field: {f}")
+        fields.append(f)
+    return fields
+
+
+def profile_version(conn: Optional[sqlite3.Connection] = None) -> int:
+    """Current head of the profile change feed"""
+    conn = conn or get_conn()
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM profile_versions").fetchone()[0]
+
+
+def page_profiles(sort: str = 'created', search: Optional[str] = None, cursor: Optional[Tuple[str, int]] = None,
+                  limit: int = 50, fields: Optional[List[str]] = None) -> Tuple[List[dict], Optional[str], int]:
+    """One keyset page of the profile directory.
+
+    ``sort`` is a PROFILE_SORTS key, prefixed with '-' to reverse it. Returns
+    the projected rows, the cursor for the next page (None on the last page)
+    and the change-feed version the page is at least as new as.
+    """
+    reverse = sort.startswith('-')
+    key, id_expr, direction, from_stats = PROFILE_SORTS[sort.lstrip('-')]
+    if reverse:
+        direction = 'ASC' if direction == 'DESC' else 'DESC'
+    fields = fields or list(PROFILE_CARD_FIELDS)
+    if 'id' not in fields:
+        fields = ['id'] + list(fields)
+    select = ', '.join(f"{PROFILE_FIELDS[f]} AS {f}" for f in fields)
+    if from_stats:
+        source = "profile_stats ps JOIN patient_profiles pp ON pp.id = ps.profile_id"
+    else:
+        source = "patient_profiles pp LEFT JOIN profile_stats ps ON ps.profile_id = pp.id"
+    with get_conn() as conn:
+        # Read the version first: anything changed after it is redelivered by
+        # profile_changes, which is harmless
+        version = profile_version(conn)
+        cte, params, where = '', [], []
+        if search:
+            cte, params = profile_search_cte(conn, search)
+            where.append("pp.id IN (SELECT id FROM profile_hits)")
+        if cursor:
+            after = int(cursor[0] or 0) if sort.lstrip('-') in ('id', 'visits') else cursor[0]
+            op = '<' if direction == 'DESC' else '>'
+            # The plain bound on the key lets SQLite seek expression indexes,
+            # which it does not do for the row-value comparison alone
+            where.append(f"{key} {op}= ? AND ({key}, {id_expr}) {op} (?, ?)")
+            params += [after, after, cursor[1]]
+        sql = f"{cte} SELECT {select}, {key} AS _sort_key FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {key} {direction}, {id_expr} {direction} LIMIT ?"
+        cur = conn.execute(sql, (*params, int(limit) + 1))
+        rows = cur.fetchall()
+    items = [dict(zip(fields, r)) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        key = last['_sort_key']
+        next_cursor = f"{'' if key is None else key},{int(last['id'])}"
+    return items, next_cursor, version
+
+
+def profile_changes(since: int, limit: int = 500,
+                    fields: Optional[List[str]] = None) -> Tuple[List[dict], List[int], int, bool]:
+    """Profiles changed after change-feed version ``since``, oldest change first.
+
+    Returns (changed rows, deleted ids, version to ask from next, more pending).
+    """
+    fields = fields or list(PROFILE_CARD_FIELDS)
+    select = ', '.join(f"{PROFILE_FIELDS[f]} AS {f}" for f in fields)
+    with get_conn() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT pv.seq AS _seq, pv.profile_id AS _pid, pp.id IS NULL AS _gone, {select}
+            FROM profile_versions pv
+            LEFT JOIN patient_profiles pp ON pp.id = pv.profile_id
+            LEFT JOIN profile_stats ps ON ps.profile_id = pv.profile_id
+            WHERE pv.seq > ? ORDER BY pv.seq LIMIT ?
+            """,
+            (int(since), int(limit) + 1),
+        ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changed = [dict(zip(fields, tuple(r)[3:])) for r in rows if not r['_gone']]
+    deleted = [r['_pid'] for r in rows if r['_gone']]
+    version = rows[-1]['_seq'] if rows else int(since)
+    return changed, deleted, version, more
+
+
 def verify_patient_login(username: str, patient_id_number: str) -> Optional[sqlite3.Row]:
     """Verify patient login credentials"""
     with get_conn() as conn:
@@ -542,8 +1348,70 @@ def verify_patient_login(username: str, patient_id_number: str) -> Optional[sqli
 
 # QR Code Generation Functions
 
+# New QR codes carry a compact signed token instead of the JSON blob:
+# 'HC1:' + base32(version byte, profile id, truncated HMAC-SHA256). It uses
+# only QR alphanumeric characters, so it fits a version 1 code (21x21 modules
+# instead of ~37x37), and forged or damaged codes are rejected before any
+# database lookup. QR_FORMAT=json keeps generating the legacy payload, and
+# QR_ACCEPT_UNSIGNED=0 stops accepting it once old wristbands are reprinted.
+QR_FORMAT = os.getenv('QR_FORMAT', 'compact')
+QR_ACCEPT_UNSIGNED = os.getenv('QR_ACCEPT_UNSIGNED', '1') == '1'
+QR_COMPACT_PREFIX = 'HC1:'
+QR_COMPACT_VERSION = 1
+QR_MAC_BYTES = 8
+_QR_BODY = struct.Struct('>BI')
+_qr_secret = {'key': None, 'mac': None}
+
+
+def qr_secret() -> bytes:
+    """HMAC key for signed QR codes: created once, stored in settings"""
+    if _qr_secret['key'] is None:
+        with get_conn() as conn:
+            # INSERT OR IGNORE so concurrent workers all end up with the same key
+            conn.execute("INSERT OR IGNORE INTO settings(key, value) VALUES('qr_secret', ?)", (secrets.token_hex(32),))
+            conn.commit()
+            row = conn.execute("SELECT value FROM settings WHERE key = 'qr_secret'").fetchone()
+        _qr_secret['key'] = row['value'].encode('utf-8')
+        _qr_secret['mac'] = hmac.new(_qr_secret['key'], digestmod=hashlib.sha256)
+    return _qr_secret['key']
+
+
+def _qr_mac(body: bytes) -> bytes:
+    qr_secret()
+    mac = _qr_secret['mac'].copy()  # keyed state is reused, not re-derived per scan
+    mac.update(body)
+    return mac.digest()[:QR_MAC_BYTES]
+
+
+def compact_qr_data(patient_id: int) -> str:
+    """Signed compact QR payload for a profile id"""
+    body = _QR_BODY.pack(QR_COMPACT_VERSION, int(patient_id))
+    return QR_COMPACT_PREFIX + base64.b32encode(body + _qr_mac(body)).decode('ascii').rstrip('=')
+
+
+def parse_compact_qr(qr_data: str) -> Optional[int]:
+    """Profile id from a compact payload, or None if it is malformed or forged"""
+    token = qr_data.strip().upper()
+    if not token.startswith(QR_COMPACT_PREFIX):
+        return None
+    token = token[len(QR_COMPACT_PREFIX):]
+    try:
+        raw = base64.b32decode(token + '=' * (-len(token) % 8))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) != _QR_BODY.size + QR_MAC_BYTES:
+        return None
+    body, mac = raw[:_QR_BODY.size], raw[_QR_BODY.size:]
+    version, patient_id = _QR_BODY.unpack(body)
+    if version != QR_COMPACT_VERSION or not hmac.compare_digest(mac, _qr_mac(body)):
+        return None
+    return patient_id
+
+
 def generate_qr_code_data(patient_id: int, name: str, age: Optional[int] = None, gender: Optional[str] = None) -> str:
-    """Generate QR code data string for patient"""
+    """Generate QR code data string for patient (compact signed token unless QR_FORMAT=json)"""
+    if QR_FORMAT == 'compact':
+        return compact_qr_data(patient_id)
     qr_data = {
         "patient_id": patient_id,
         "name": name,
@@ -554,6 +1422,66 @@ def generate_qr_code_data(patient_id: int, name: str, age: Optional[int] = None,
     return json.dumps(qr_data)
 
 
+# Rendered QR images keyed by payload. A profile edit changes a legacy JSON
+# payload, so other workers simply miss; the worker making the edit also drops
+# the old entry right away (invalidate_qr_cache). Compact payloads depend on
+# the id alone and stay cached across edits.
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '512'))
+_qr_cache: 'OrderedDict[str, str]' = OrderedDict()
+_qr_keys = {}  # profile id -> payload currently cached for it
+_qr_lock = threading.Lock()
+qr_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def qr_payload(profile: sqlite3.Row) -> str:
+    """QR payload for a profile row"""
+    return generate_qr_code_data(
+        patient_id=int(profile['id']),
+        name=profile['name'] if profile['name'] else '',
+        age=profile['age'] if profile['age'] else None,
+        gender=profile['gender'] if profile['gender'] else None
+    )
+
+
+def qr_etag(qr_data: str) -> str:
+    """Validator for a QR image: the image is a pure function of its payload"""
+    return hashlib.sha1(qr_data.encode('utf-8')).hexdigest()
+
+
+def cached_qr_code_image(qr_data: str, patient_id: Optional[int] = None) -> str:
+    """generate_qr_code_image with a bounded LRU cache"""
+    with _qr_lock:
+        img = _qr_cache.get(qr_data)
+        if img is not None:
+            _qr_cache.move_to_end(qr_data)
+            qr_cache_stats['hits'] += 1
+            return img
+    img = generate_qr_code_image(qr_data)
+    with _qr_lock:
+        qr_cache_stats['misses'] += 1
+        _qr_cache[qr_data] = img
+        if patient_id is not None:
+            old = _qr_keys.get(patient_id)
+            if old is not None and old != qr_data:
+                _qr_cache.pop(old, None)
+            _qr_keys[patient_id] = qr_data
+        while len(_qr_cache) > QR_CACHE_SIZE:
+            _qr_cache.popitem(last=False)
+    return img
+
+
+def invalidate_qr_cache(profile_id: Optional[int] = None) -> None:
+    """Forget the cached QR image of one profile (or all of them)"""
+    with _qr_lock:
+        if profile_id is None:
+            _qr_cache.clear()
+            _qr_keys.clear()
+            return
+        old = _qr_keys.pop(int(profile_id), None)
+        if old is not None:
+            _qr_cache.pop(old, None)
+
+
 def generate_qr_code_image(qr_data: str) -> str:
     """Generate QR code image and return as base64 string"""
     qr = qrcode.QRCode(
@@ -574,24 +1502,25 @@ def generate_qr_code_image(qr_data: str) -> str:
     return img_str
 
 
-def generate_patient_qr_code(patient_id: int) -> str:
-    """Generate QR code for a patient profile"""
-    profile = get_profile(patient_id)
+def generate_patient_qr_code(patient_id: int, profile: Optional[sqlite3.Row] = None) -> str:
+    """Generate QR code for a patient profile (pass the row if already loaded)"""
+    if profile is None:
+        profile = get_profile(patient_id)
     if not profile:
         raise ValueError(f"Patient profile with ID {patient_id} not found")
     
-    qr_data = generate_qr_code_data(
-        patient_id=patient_id,
-        name=profile['name'] if profile['name'] else '',
-        age=profile['age'] if profile['age'] else None,
-        gender=profile['gender'] if profile['gender'] else None
-    )
-    
-    return generate_qr_code_image(qr_data)
+    return cached_qr_code_image(qr_payload(profile), int(patient_id))
 
 
 def parse_qr_code_data(qr_data: str) -> dict:
-    """Parse QR code data and return patient information"""
+    """Parse QR code data (compact or legacy JSON) and return patient information"""
+    if qr_data.lstrip()[:len(QR_COMPACT_PREFIX)].upper() == QR_COMPACT_PREFIX:
+        patient_id = parse_compact_qr(qr_data)
+        if patient_id is None:
+            raise ValueError("Invalid QR code signature")
+        return {'patient_id': patient_id, 'type': 'patient_id', 'format': 'compact'}
+    if not QR_ACCEPT_UNSIGNED:
+        raise ValueError("Unsigned QR codes are not accepted")
     try:
         data = json.loads(qr_data)
         if data.get('type') != 'patient_id':
@@ -0,0 +1,602 @@
+"""Server-sent event bus shared by every worker process.
+
+sse_publish() used to push into per-process queues. With several gunicorn
+workers, a dashboard connected to one worker never saw events posted through
+another. A client that reconnected also missed everything sent while it was
+away. Events now go through a bus that numbers them:
+
+- SQLiteEventBus (default, EVENT_BUS=sqlite) appends each event to the
+  events table in app.db. One poller thread per process tails the table and
+  hands new rows to that process's subscribers, so every worker delivers
+  every event, in id order.
+- LocalEventBus (EVENT_BUS=local) keeps recent events in memory in one
+  process, like the old broker. It is meant for the dev server.
+
+Ids only ever grow, so they double as the SSE ``id:`` field. A reconnecting
+EventSource sends Last-Event-ID, and subscribe() replays what it missed from
+the retained window (the newest EVENT_RETENTION events, none older than
+EVENT_RETENTION_SECONDS). If the client is further behind than that, the
+subscription is marked ``reset`` and the client should reload its data.
+
+Each subscriber has a bounded queue. Bursts of list-changed events are
+coalesced into one 'refresh' hint. Subscribers that fall too far behind are
+evicted, and idle streams are closed. sse_stream() adds heartbeats, and
+stats() reports the counters.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import db
+
+BACKEND = os.getenv('EVENT_BUS', 'sqlite')
+RETENTION = int(os.getenv('EVENT_RETENTION', '1000'))
+RETENTION_SECONDS = float(os.getenv('EVENT_RETENTION_SECONDS', '3600'))
+# How often an idle poller checks the log for other workers' events
+POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', '0.2'))
+# Prune the log every this many publishes (per process)
+PRUNE_EVERY = 100
+POLL_BATCH = 500
+
+# Per-subscriber delivery (see Subscription and sse_stream)
+QUEUE_MAX = int(os.getenv('SSE_QUEUE_MAX', '256'))
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+IDLE_TIMEOUT = float(os.getenv('SSE_IDLE_TIMEOUT', '600'))
+STALL_SECONDS = float(os.getenv('SSE_STALL_SECONDS', '60'))
+RECONNECT_MS = 3000
+# "Something changed, reload the list" events: bursts collapse into one REFRESH
+COALESCE_EVENTS = frozenset({'patient_added', 'patient_archived', 'profile_changed'})
+REFRESH = 'refresh'
+COUNTERS = ('published', 'delivered', 'coalesced', 'dropped', 'evicted', 'idle_closed', 'heartbeats')
+
+
+class Event(NamedTuple):
+    id: int
+    event: str
+    data: str  # JSON text
+
+    def sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.event}\ndata: {self.data}\n\n"
+
+
+def parse_last_event_id(raw: Optional[str]) -> Optional[int]:
+    """Last-Event-ID header value -> int, or None when absent or malformed"""
+    try:
+        value = int(str(raw).strip())
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+class Subscription:
+    """One client's stream: replayed backlog, then live events in id order.
+
+    ``last_id`` is the newest id the client has seen. Events reach the queue
+    from the bus and may overlap the replayed backlog, so anything at or
+    below ``last_id`` is skipped.
+
+    The queue is bounded. Undelivered COALESCE_EVENTS are folded into one
+    'refresh' hint, so a burst of intakes costs one slot. A subscriber whose
+    queue still fills up, or whose consumer has not asked for an event in
+    STALL_SECONDS, is evicted: its queue is dropped and get() returns None
+    with ``evicted`` set. The client reconnects with Last-Event-ID and
+    catches up from the log.
+    """
+
+    def __init__(self, bus: '_EventBus', max_queue: int = QUEUE_MAX):
+        self.bus = bus
+        self.max_queue = max_queue
+        self.last_id = 0
+        self.backlog: List[Event] = []
+        self.reset = False
+        self.evicted = False
+        self.last_event = time.monotonic()  # last event handed to the client
+        self._items: deque = deque()
+        self._tail_counts: Optional[Dict[str, int]] = None  # when the tail is a refresh hint
+        self._cond = threading.Condition()
+        self._waiting = False
+        self._returned = time.monotonic()
+
+    def _put(self, ev: Event) -> None:
+        with self._cond:
+            if self.evicted:
+                return
+            tail = self._items[-1] if self._items else None
+            if tail is not None and ev.event in COALESCE_EVENTS and tail.event in COALESCE_EVENTS | {REFRESH}:
+                if self._tail_counts is None:
+                    self._tail_counts = {tail.event: 1}
+                counts = self._tail_counts
+                counts[ev.event] = counts.get(ev.event, 0) + 1
+                self._items[-1] = Event(ev.id, REFRESH, json.dumps({'events': counts}))
+                self.bus._count('coalesced')
+            elif len(self._items) >= self.max_queue or self._stalled():
+                self._evict(len(self._items) + 1)
+                return
+            else:
+                self._items.append(ev)
+                self._tail_counts = None
+            self._wake()
+
+    def _wake(self) -> None:
+        # Called with _cond held
+        self._cond.notify()
+
+    def _stalled(self) -> bool:
+        # Not waiting in get() and not back for a long time: the consumer
+        # thread is stuck writing to a dead or stalled connection
+        return not self._waiting and time.monotonic() - self._returned > STALL_SECONDS
+
+    def _evict(self, dropped: int) -> None:
+        self.evicted = True
+        self._items.clear()
+        self._tail_counts = None
+        self.bus._count('evicted')
+        self.bus._count('dropped', dropped)
+        self._wake()
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Next unseen event, or None on timeout or once evicted"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            try:
+                self._waiting = True
+                while True:
+                    while not self._items and not self.evicted:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            return None
+                        self._cond.wait(remaining)
+                    if self.evicted:
+                        return None
+                    ev = self._pop()
+                    if ev is not None:
+                        return ev
+            finally:
+                self._waiting = False
+                self._returned = time.monotonic()
+
+    def _pop(self) -> Optional[Event]:
+        # Next unseen queued event, or None once the queue is empty; _cond held
+        while self._items:
+            ev = self._items.popleft()
+            if not self._items:
+                self._tail_counts = None
+            if ev.id > self.last_id:
+                self.last_id = ev.id
+                self.last_event = time.monotonic()
+                self.bus._count('delivered')
+                return ev
+        return None
+
+    def drain_backlog(self) -> List[Event]:
+        """The replayed events (coalesced), once; advances ``last_id`` past them"""
+        backlog, self.backlog = self.backlog, []
+        if backlog:
+            self.last_id = max(self.last_id, backlog[-1].id)
+        return coalesce(backlog)
+
+    def close(self) -> None:
+        self.bus._unsubscribe(self)
+
+
+def coalesce(events: Iterable[Event]) -> List[Event]:
+    """Fold runs of COALESCE_EVENTS into 'refresh' hints carrying per-event counts"""
+    out: List[Event] = []
+    counts: Optional[Dict[str, int]] = None
+    for ev in events:
+        if ev.event in COALESCE_EVENTS and out and (counts is not None or out[-1].event in COALESCE_EVENTS):
+            counts = counts or {out[-1].event: 1}
+            counts[ev.event] = counts.get(ev.event, 0) + 1
+            out[-1] = Event(ev.id, REFRESH, json.dumps({'events': counts}))
+        else:
+            out.append(ev)
+            counts = None
+    return out
+
+
+class _LoopWaker:
+    """Wakes an event loop's subscriptions from the bus's threads, with one
+    loop callback per fan-out batch rather than one per subscriber"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._pending: Set['AsyncSubscription'] = set()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def add(self, sub: 'AsyncSubscription') -> None:
+        with self._lock:
+            self._pending.add(sub)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self.loop.call_soon_threadsafe(self._run)
+        except RuntimeError:
+            pass  # loop closed; nobody left to wake
+
+    def _run(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._scheduled = False
+        for sub in pending:
+            sub._ready.set()
+
+
+_wakers: Dict[asyncio.AbstractEventLoop, _LoopWaker] = {}
+
+
+class AsyncSubscription(Subscription):
+    """A Subscription consumed by a coroutine (the streams.py sidecar)"""
+
+    def __init__(self, bus: '_EventBus', loop: asyncio.AbstractEventLoop, max_queue: int = QUEUE_MAX):
+        super().__init__(bus, max_queue)
+        self._ready = asyncio.Event()
+        waker = _wakers.get(loop)
+        if waker is None:
+            waker = _wakers[loop] = _LoopWaker(loop)
+        self._waker = waker
+
+    def _wake(self) -> None:
+        self._waker.add(self)
+
+    async def aget(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Next unseen event, or None on timeout or once evicted"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self.evicted:
+                    return None
+                ev = self._pop()
+                if ev is not None:
+                    self._returned = time.monotonic()
+                    return ev
+                # Cleared under the lock: a later _put always sets it again
+                self._ready.clear()
+                self._waiting = True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                if remaining is not None and remaining <= 0:
+                    return None
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._waiting = False
+                self._returned = time.monotonic()
+
+
+def _opening(sub: Subscription) -> List[str]:
+    # Initial hello to open the stream; its id is where a reconnect resumes
+    frames = [f'retry: {RECONNECT_MS}\nid: {sub.last_id}\nevent: hello\ndata: {{}}\n\n']
+    if sub.reset:
+        # Missed more than the bus retains: the page must reload its data
+        frames.append('event: reset\ndata: {}\n\n')
+    return frames + [ev.sse() for ev in sub.drain_backlog()]
+
+
+def _idle_closed(sub: Subscription, idle_timeout: float) -> bool:
+    if time.monotonic() - sub.last_event >= idle_timeout:
+        sub.bus._count('idle_closed')
+        return True
+    return False
+
+
+def sse_stream(sub: Subscription, heartbeat: float = HEARTBEAT_SECONDS,
+               idle_timeout: float = IDLE_TIMEOUT) -> Iterator[str]:
+    """SSE text for one subscription: hello, replay, then live events.
+
+    Sends a comment every ``heartbeat`` seconds so proxies keep the
+    connection open and a dead client is noticed at the next write. The
+    stream ends after ``idle_timeout`` seconds without an event, or when the
+    subscriber is evicted. EventSource then reconnects and resumes from its
+    Last-Event-ID, so nothing is lost either way.
+    """
+    try:
+        yield from _opening(sub)
+        while True:
+            ev = sub.get(timeout=heartbeat)
+            if ev is not None:
+                yield ev.sse()
+            elif sub.evicted or _idle_closed(sub, idle_timeout):
+                return
+            else:
+                sub.bus._count('heartbeats')
+                yield ': ping\n\n'
+    finally:
+        sub.close()
+
+
+async def asse_stream(sub: AsyncSubscription, heartbeat: float = HEARTBEAT_SECONDS,
+                      idle_timeout: float = IDLE_TIMEOUT) -> AsyncIterator[str]:
+    """sse_stream() for a coroutine: the same frames, heartbeats and timeouts"""
+    try:
+        for frame in _opening(sub):
+            yield frame
+        while True:
+            ev = await sub.aget(timeout=heartbeat)
+            if ev is not None:
+                yield ev.sse()
+            elif sub.evicted or _idle_closed(sub, idle_timeout):
+                return
+            else:
+                sub.bus._count('heartbeats')
+                yield ': ping\n\n'
+    finally:
+        sub.close()
+
+
+class _EventBus:
+    def __init__(self):
+        self._subs: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._counters[name] += n
+
+    def stats(self) -> Dict[str, object]:
+        """Subscriber gauges and counters for this process (since start)"""
+        with self._lock:
+            subs = list(self._subs)
+        depths = [sub.depth() for sub in subs]
+        with self._stats_lock:
+            counters = dict(self._counters)
+        return {
+            'backend': type(self).__name__,
+            'pid': os.getpid(),
+            'head': self.head(),
+            'subscribers': len(subs),
+            'queue_depth': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'queue_limit': QUEUE_MAX,
+            **counters,
+        }
+
+    def publish(self, event: str, data: Optional[dict] = None) -> int:
+        raise NotImplementedError
+
+    def head(self) -> int:
+        """Newest event id (0 if nothing was ever published)"""
+        raise NotImplementedError
+
+    def since(self, last_id: int) -> Tuple[List[Event], bool]:
+        """Retained events after ``last_id`` and whether some were pruned first"""
+        raise NotImplementedError
+
+    def subscribe(self, last_id: Optional[int] = None,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        """Start a stream; replay from ``last_id`` (a Last-Event-ID) if given.
+
+        The subscription is registered before the backlog is read, so no
+        event can fall between the replay and the live stream. With ``loop``
+        it is an AsyncSubscription for a coroutine on that loop.
+        """
+        sub = Subscription(self) if loop is None else AsyncSubscription(self, loop)
+        with self._lock:
+            self._subs.append(sub)
+        self._started()
+        head = self.head()
+        if last_id is None or last_id > head:
+            # Fresh client, or an id from before the log was recreated
+            sub.last_id = head
+            sub.reset = last_id is not None
+        else:
+            sub.last_id = last_id
+            sub.backlog, sub.reset = self.since(last_id)
+            if sub.reset:
+                # The client reloads everything; replaying part of it is pointless
+                sub.backlog, sub.last_id = [], head
+        return sub
+
+    def _started(self) -> None:
+        pass
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def _fanout(self, events: Iterable[Event]) -> None:
+        with self._lock:
+            subs = list(self._subs)
+        for ev in events:
+            for sub in subs:
+                sub._put(ev)
+        # Evicted subscribers whose stream never comes back to notice
+        gone = [sub for sub in subs if sub.evicted]
+        if gone:
+            with self._lock:
+                self._subs = [sub for sub in self._subs if sub not in gone]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+
+def _encode(data: Optional[dict]) -> str:
+    try:
+        return json.dumps(data or {})
+    except (TypeError, ValueError):
+        return '{}'
+
+
+class LocalEventBus(_EventBus):
+    """In-process bus: events reach only this process's subscribers"""
+
+    def __init__(self, retention: int = RETENTION, retention_seconds: float = RETENTION_SECONDS):
+        super().__init__()
+        self.retention_seconds = retention_seconds
+        self._ring: deque = deque(maxlen=retention)  # (ts, Event)
+        self._ids = itertools.count(1)
+        self._head = 0
+        self._publish_lock = threading.Lock()
+
+    def publish(self, event: str, data: Optional[dict] = None) -> int:
+        # Numbering and fan-out under one lock keep every queue in id order
+        with self._publish_lock:
+            with self._lock:
+                ev = Event(next(self._ids), event, _encode(data))
+                self._ring.append((time.time(), ev))
+                self._head = ev.id
+                self._expire()
+            self._fanout([ev])
+        self._count('published')
+        return ev.id
+
+    def head(self) -> int:
+        return self._head
+
+    def since(self, last_id: int) -> Tuple[List[Event], bool]:
+        with self._lock:
+            self._expire()
+            kept = [ev for _ts, ev in self._ring]
+            head = self._head
+        first = kept[0].id if kept else head + 1
+        return [ev for ev in kept if ev.id > last_id], first > last_id + 1
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        while self._ring and self._ring[0][0] < cutoff:
+            self._ring.popleft()
+
+
+class SQLiteEventBus(_EventBus):
+    """Event log in app.db, tailed by one poller thread per process"""
+
+    def __init__(self, retention: int = RETENTION, retention_seconds: float = RETENTION_SECONDS,
+                 poll_interval: float = POLL_INTERVAL):
+        super().__init__()
+        self.retention = retention
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self._conn = None       # publish connection
+        self._conn_lock = threading.Lock()
+        self._pid = None
+        self._published = 0
+        self._wake = threading.Event()
+        self._poller = None
+        self._cursor = 0
+
+    def _connection(self):
+        # Fresh connection (and poller) after a fork; callers hold _conn_lock,
+        # which serialises the request threads sharing it
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = db._connect(check_same_thread=False)
+            self._pid = os.getpid()
+            self._poller = None
+        return self._conn
+
+    def publish(self, event: str, data: Optional[dict] = None) -> int:
+        payload = _encode(data)
+        with self._conn_lock:
+            conn = self._connection()
+            with conn:
+                cur = conn.execute("INSERT INTO events (ts, event, data) VALUES (?, ?, ?)",
+                                   (time.time(), event, payload))
+            event_id = cur.lastrowid
+            self._published += 1
+            if self._published % PRUNE_EVERY == 0:
+                self._prune(conn, event_id)
+        self._count('published')
+        # Local subscribers get it from our own poller straight away
+        self._wake.set()
+        return event_id
+
+    def _prune(self, conn, head: int) -> None:
+        with conn:
+            conn.execute("DELETE FROM events WHERE id <= ? OR ts < ?",
+                         (head - self.retention, time.time() - self.retention_seconds))
+
+    def prune(self) -> None:
+        with self._conn_lock:
+            conn = self._connection()
+            self._prune(conn, self._head(conn))
+
+    @staticmethod
+    def _head(conn) -> int:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return int(row[0]) if row else 0
+
+    def head(self) -> int:
+        with self._conn_lock:
+            return self._head(self._connection())
+
+    def since(self, last_id: int) -> Tuple[List[Event], bool]:
+        with self._conn_lock:
+            conn = self._connection()
+            # One read transaction, so a concurrent prune cannot slip between
+            # MIN(id) and the rows
+            conn.execute('BEGIN')
+            try:
+                first = conn.execute("SELECT MIN(id) FROM events").fetchone()[0]
+                rows = conn.execute("SELECT id, event, data FROM events WHERE id > ? ORDER BY id",
+                                    (int(last_id),)).fetchall()
+                if first is None:
+                    first = self._head(conn) + 1
+            finally:
+                conn.execute('COMMIT')
+        return [Event(*r) for r in rows], first > last_id + 1
+
+    def _started(self) -> None:
+        with self._conn_lock:
+            self._connection()
+            if self._poller is not None and self._poller.is_alive():
+                return
+            self._cursor = self._head(self._conn)
+            self._poller = threading.Thread(target=self._poll, args=(os.getpid(),),
+                                            name='event-bus-poller', daemon=True)
+            self._poller.start()
+
+    def _poll(self, pid: int) -> None:
+        conn = db._connect()
+        data_version = None
+        try:
+            while self._pid == pid:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                if not self.subscriber_count():
+                    continue
+                try:
+                    # data_version only moves when another connection commits
+                    version = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if version == data_version:
+                        continue
+                    data_version = version
+                    while True:
+                        rows = conn.execute(
+                            "SELECT id, event, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                            (self._cursor, POLL_BATCH)).fetchall()
+                        if not rows:
+                            break
+                        self._cursor = rows[-1]['id']
+                        self._fanout(Event(r['id'], r['event'], r['data']) for r in rows)
+                        if len(rows) < POLL_BATCH:
+                            break
+                except Exception as e:
+                    print(f"⚠️ Event bus poll failed: {e}")
+                    data_version = None
+                    time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+
+def make_bus(backend: str = BACKEND) -> _EventBus:
+    if backend == 'local':
+        return LocalEventBus()
+    if backend != 'sqlite':
+        print(f"ℹ️ Unknown EVENT_BUS={backend!r}; using sqlite")
+    return SQLiteEventBus()
+
+
+event_bus = make_bus()
@@ -0,0 +1,147 @@
+"""Streaming visit exports (CSV, NDJSON, Parquet) with bounded memory.
+
+Rows arrive in fetchmany batches from db.iter_visits; each batch is encoded
+and yielded before the next one is read, so memory stays flat no matter how
+many visits are exported. Any format can additionally be gzip'd on the fly.
+Incremental exports resume from a (timestamp, id) cursor (db.parse_since).
+"""
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from db import iter_visits, table_columns
+
+# Parquet/Arrow output is optional; CSV and NDJSON need only the stdlib
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:
+    pa = None
+    pq = None
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def csv_stream(batches: Iterable[list], headers: List[str]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(headers)
+    for batch in batches:
+        for r in batch:
+            writer.writerow([r[h] for h in headers])
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def ndjson_stream(batches: Iterable[list], headers: List[str]) -> Iterator[bytes]:
+    for batch in batches:
+        yield ''.join(
+            json.dumps({h: r[h] for h in headers}, default=str) + '\n' for r in batch
+        ).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        b = bytes(data)
+        self.chunks.append(b)
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        out = b''.join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def _arrow_type(decl: str):
+    if 'INT' in decl:
+        return pa.int64()
+    if 'REAL' in decl or 'FLOA' in decl or 'DOUB' in decl:
+        return pa.float64()
+    return pa.string()
+
+
+def _coerce(value, kind: str):
+    # SQLite columns are loosely typed; values that do not fit the declared
+    # type become nulls instead of failing the whole export.
+    if value is None:
+        return None
+    try:
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def parquet_stream(batches: Iterable[list], table: str, headers: List[str]) -> Iterator[bytes]:
+    """One Parquet row group per batch, flushed as soon as it is written"""
+    if pa is None:
+        raise RuntimeError('pyarrow is not installed')
+    declared = dict(table_columns(table))
+    fields = [pa.field(h, _arrow_type(declared.get(h, ''))) for h in headers]
+    schema = pa.schema(fields)
+    kinds = ['int' if f.type == pa.int64() else 'float' if f.type == pa.float64() else 'str' for f in fields]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for batch in batches:
+            columns = [
+                pa.array([_coerce(r[h], kind) for r in batch], type=f.type)
+                for h, kind, f in zip(headers, kinds, fields)
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    comp = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def export_stream(table: str, fmt: str, headers: List[str], search: Optional[str] = None,
+                  since: Optional[Tuple[str, int]] = None, until: Optional[Tuple[str, int]] = None,
+                  gzip: bool = False, batch_size: int = 1000) -> Iterator[bytes]:
+    """Encoded export body for a visit table (rows after ``since`` up to ``until``)"""
+    batches = iter_visits(table, search=search, since=since, until=until, batch_size=batch_size)
+    if fmt == 'ndjson':
+        body = ndjson_stream(batches, headers)
+    elif fmt == 'parquet':
+        body = parquet_stream(batches, table, headers)
+    else:
+        body = csv_stream(batches, headers)
+    return gzip_stream(body) if gzip else body
@@ -0,0 +1,13 @@
+"""gunicorn settings for the Flask app (render.yaml passes it with -c).
+
+Long-lived streams are served by streams.py, so the workers only handle
+ordinary requests.
+"""
+workers = 2
+worker_class = 'gthread'
+
+
+def post_worker_init(worker):
+    # Start-up work that must not happen on a plain `import app`
+    from app import start_serial_readers
+    start_serial_readers()
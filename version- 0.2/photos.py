@@ -0,0 +1,283 @@
+"""Background photo persistence for /take_picture and /upload_photo.
+
+Requests hand over an immutable camera frame or the uploaded bytes, get a
+filename back straight away, and a small pool of writer threads encodes,
+writes and fsyncs the file off the request path. Each file is written to a
+temporary name and renamed into place, so /uploads never serves a partial
+photo. The queue is bounded: when the disk cannot keep up, new photos are
+refused (callers answer 503) instead of piling up in memory.
+
+Photos are content-addressed: the name is the SHA-256 of the uploaded bytes
+(of the raw pixels for camera frames), sharded as ab/cd/<hash>.jpg. Names
+never collide, identical photos are stored once, and a name's content never
+changes, so it can be cached forever. Rows in patients, stored_patients and
+patient_profiles reference photos (counted in the photo_refs table);
+collect_garbage() removes files nothing references any more.
+"""
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import cv2
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+WRITER_THREADS = int(os.getenv('PHOTO_WRITER_THREADS', '2'))
+QUEUE_MAX = int(os.getenv('PHOTO_QUEUE_MAX', '32'))
+JPEG_QUALITY = int(os.getenv('PHOTO_JPEG_QUALITY', '90'))
+# Completed/failed statuses remembered for the status endpoint
+STATUS_KEEP = 1000
+# collect_garbage keeps unreferenced photos modified within this window
+GC_GRACE_SECONDS = float(os.getenv('PHOTO_GC_GRACE_HOURS', '24')) * 3600
+
+PENDING, DONE, ERROR = 'pending', 'done', 'error'
+
+
+class PhotoQueueFull(Exception):
+    """Raised when the writer queue is at capacity"""
+
+
+def new_filename() -> str:
+    """Random legacy-style name (patient_<uuid8>.jpg)"""
+    return f"patient_{uuid.uuid4().hex[:8]}.jpg"
+
+
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.(jpg|png|webp)$')
+
+
+def content_name(digest: str, ext: str = '.jpg') -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_content_name(name: str) -> bool:
+    return bool(CONTENT_NAME_RE.match(name or ''))
+
+
+def _sniff_ext(data: bytes) -> str:
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.jpg'
+
+
+class PhotoWriter:
+    def __init__(self, directory: str = UPLOADS_DIR, threads: int = WRITER_THREADS,
+                 maxsize: int = QUEUE_MAX, quality: int = JPEG_QUALITY):
+        self.directory = directory
+        self.threads = threads
+        self.quality = quality
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.status = OrderedDict()
+        self.workers = []
+        self.pid = None
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deduplicated = 0
+
+    def _ensure_workers(self):
+        # Started lazily, and again after a fork (gunicorn workers)
+        if self.pid == os.getpid() and all(t.is_alive() for t in self.workers):
+            return
+        with self.lock:
+            if self.pid == os.getpid() and all(t.is_alive() for t in self.workers):
+                return
+            self.pid = os.getpid()
+            self.workers = [
+                threading.Thread(target=self._run, name=f'photo-writer-{i}', daemon=True)
+                for i in range(self.threads)
+            ]
+            for t in self.workers:
+                t.start()
+
+    def _submit(self, kind: str, payload, filename: str) -> str:
+        self._ensure_workers()
+        with self.lock:
+            if is_content_name(filename) and self.status.get(filename, (None,))[0] == PENDING:
+                # Identical photo already queued
+                self.deduplicated += 1
+                return filename
+            self._set_status(filename, PENDING)
+        try:
+            self.queue.put_nowait((kind, payload, filename))
+        except queue.Full:
+            with self.lock:
+                self.status.pop(filename, None)
+                self.rejected += 1
+            raise PhotoQueueFull('photo writer queue is full')
+        return filename
+
+    def submit_frame(self, frame, filename: Optional[str] = None) -> str:
+        """Queue a camera frame (BGR array, not modified afterwards) for JPEG encoding"""
+        if filename is None:
+            h = hashlib.sha256(repr(frame.shape).encode())
+            h.update(memoryview(frame if frame.flags.c_contiguous else frame.copy()).cast('B'))
+            filename = content_name(h.hexdigest())
+        return self._submit('frame', frame, filename)
+
+    def submit_bytes(self, data: bytes, filename: Optional[str] = None) -> str:
+        """Queue an already encoded upload"""
+        data = bytes(data)
+        if filename is None:
+            filename = content_name(hashlib.sha256(data).hexdigest(), _sniff_ext(data))
+        return self._submit('bytes', data, filename)
+
+    def _set_status(self, filename: str, state: str, error: Optional[str] = None):
+        self.status[filename] = (state, error)
+        self.status.move_to_end(filename)
+        while len(self.status) > STATUS_KEEP:
+            oldest_state, _error = next(iter(self.status.values()))
+            if oldest_state == PENDING:
+                break
+            self.status.popitem(last=False)
+
+    def _write(self, kind: str, payload, filename: str) -> bool:
+        """Persist one photo; False when identical content was already stored"""
+        path = os.path.join(self.directory, filename)
+        if is_content_name(filename):
+            try:
+                # Same content already stored under this name. Refresh its
+                # mtime so collect_garbage gives it a new grace period: the
+                # intake referencing it has not been saved yet.
+                os.utime(path)
+                return False
+            except FileNotFoundError:
+                pass
+        if kind == 'frame':
+            ok, jpeg = cv2.imencode('.jpg', payload, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                raise RuntimeError('JPEG encoding failed')
+            payload = jpeg.tobytes()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex[:6]}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return True
+
+    def _run(self):
+        while True:
+            kind, payload, filename = self.queue.get()
+            try:
+                wrote = self._write(kind, payload, filename)
+                state, error = DONE, None
+            except Exception as e:
+                print(f"❌ Photo write failed for {filename}: {e}")
+                wrote, state, error = False, ERROR, str(e)
+            with self.done:
+                self._set_status(filename, state, error)
+                if wrote:
+                    self.written += 1
+                elif state == DONE:
+                    self.deduplicated += 1
+                else:
+                    self.failed += 1
+                self.done.notify_all()
+            self.queue.task_done()
+
+    def get_status(self, filename: str) -> Dict[str, Optional[str]]:
+        """pending/done/error for photos queued by this process; otherwise
+        done if the file exists (e.g. written by another worker) or unknown.
+
+        done means the file was written or, for a duplicate, had its mtime
+        refreshed, so collect_garbage keeps it for GC_GRACE_SECONDS even
+        before anything references it."""
+        with self.lock:
+            state, error = self.status.get(filename, (None, None))
+        if state is None:
+            # Flat legacy names or sharded content names; nothing that climbs out
+            safe = is_content_name(filename) or os.path.basename(filename) == filename
+            state = DONE if safe and os.path.isfile(os.path.join(self.directory, filename)) else 'unknown'
+        out = {'filename': filename, 'status': state}
+        if error:
+            out['message'] = error
+        return out
+
+    def wait(self, filename: str, timeout: float = 5.0) -> str:
+        """Block until a photo queued by this process is no longer pending"""
+        with self.done:
+            self.done.wait_for(lambda: self.status.get(filename, (None,))[0] != PENDING, timeout)
+            return (self.status.get(filename) or (None,))[0] or 'unknown'
+
+    def join(self):
+        """Wait until everything queued so far has been written"""
+        self.queue.join()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'deduplicated': self.deduplicated,
+        }
+
+
+def collect_garbage(referenced: Iterable[str], directory: str = UPLOADS_DIR,
+                    grace_seconds: float = GC_GRACE_SECONDS, dry_run: bool = False,
+                    on_delete=None) -> Dict[str, int]:
+    """Delete photos in ``directory`` that are not in ``referenced``.
+
+    Files modified within grace_seconds are kept: a photo is uploaded (or
+    re-uploaded, which refreshes its mtime) before the intake that references
+    it is saved. Leftover .tmp files are removed too.
+    """
+    referenced = set(referenced)
+    cutoff = time.time() - grace_seconds
+    stats = {'kept': 0, 'recent': 0, 'deleted': 0, 'bytes': 0}
+    for root, _dirs, files in os.walk(directory):
+        for f in files:
+            path = os.path.join(root, f)
+            name = os.path.relpath(path, directory).replace(os.sep, '/')
+            if name in referenced:
+                stats['kept'] += 1
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_mtime > cutoff:
+                stats['recent'] += 1
+                continue
+            if not dry_run:
+                try:
+                    # A re-upload may have refreshed it since the first stat
+                    if os.stat(path).st_mtime > cutoff:
+                        stats['recent'] += 1
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                if on_delete:
+                    on_delete(name)
+            stats['deleted'] += 1
+            stats['bytes'] += st.st_size
+    if not dry_run:
+        # Drop shard directories that are now empty
+        for root, _dirs, _files in os.walk(directory, topdown=False):
+            if root != directory and not os.listdir(root):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+    return stats
+
+
+photo_writer = PhotoWriter()
@@ -0,0 +1,123 @@
+"""CPU cost per /camera/video_feed viewer: per-client encoding vs the
+encode-once broadcaster and its stream ladder.
+
+A fake 640x480 capture device produces 30 frames per second, so no camera is
+needed. For each viewer count, viewer threads consume the MJPEG generator for
+a few seconds while process CPU time is measured. With per-client encoding
+CPU grows with every viewer; with the broadcaster it should stay near flat.
+
+    python scripts/bench_camera_viewers.py --seconds 3 --viewers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import camera as camera_module  # noqa: E402
+
+
+class FakeCapture:
+    """Stands in for cv2.VideoCapture: a noisy frame every 1/30 s"""
+
+    def __init__(self, *_args):
+        rng = np.random.default_rng(0)
+        self.frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(8)]
+        self.n = 0
+
+    def isOpened(self):
+        return True
+
+    def set(self, *_args):
+        return True
+
+    def read(self):
+        self.n += 1
+        return True, self.frames[self.n % len(self.frames)]
+
+    def release(self):
+        pass
+
+
+def legacy_frames(cam, stop, _stream=None):
+    # The old generator: every viewer encodes the latest frame itself, unpaced
+    while not stop.is_set():
+        with cam.lock:
+            frame = cam.frame
+            ok, jpeg = cv2.imencode('.jpg', frame) if frame is not None else (False, None)
+        if ok:
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n'
+        else:
+            time.sleep(0.1)
+
+
+def broadcast_frames(cam, stop, stream='full'):
+    cam.subscribe(stream)
+    try:
+        seq = 0
+        while not stop.is_set():
+            seq, part = cam.wait_for_frame(seq, name=stream)
+            if part is not None:
+                yield part
+    finally:
+        cam.unsubscribe(stream)
+
+
+def measure(cam, gen, viewers: int, seconds: float, streams=('full',)):
+    stop = threading.Event()
+    delivered = [0] * viewers
+
+    def viewer(i):
+        for _ in gen(cam, stop, streams[i % len(streams)]):
+            delivered[i] += 1
+
+    threads = [threading.Thread(target=viewer, args=(i,)) for i in range(viewers)]
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    cpu, wall = time.process_time() - cpu0, time.monotonic() - wall0
+    return cpu / wall, sum(delivered) / wall / viewers
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--seconds', type=float, default=3.0)
+    ap.add_argument('--viewers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = ap.parse_args()
+
+    camera_module.cv2.VideoCapture = FakeCapture
+    cam = camera_module.Camera()
+    cam.acquire()
+    time.sleep(0.5)
+    idle_cpu, _ = measure(cam, lambda c, s, _n: iter(()), 1, args.seconds)
+    print(f'capture only: {idle_cpu * 100:5.1f}% CPU')
+    for name, gen in (('per-client encode', legacy_frames), ('encode-once', broadcast_frames)):
+        for n in args.viewers:
+            cpu, fps = measure(cam, gen, n, args.seconds)
+            print(f'{name:>18} {n:3d} viewers: {cpu * 100:6.1f}% CPU  {fps:7.1f} frames/s per viewer')
+
+    # Stream ladder: viewers spread over every variant, then per-variant metrics
+    cam.stats_since = time.monotonic()
+    for v in cam.variants.values():
+        v.frames_encoded = v.frames_sent = v.bytes_encoded = v.bytes_sent = 0
+        v.encode_seconds = 0.0
+    names = tuple(camera_module.STREAM_VARIANTS)
+    cpu, _ = measure(cam, broadcast_frames, 3 * len(names), args.seconds, names)
+    print(f'\nladder, {3 * len(names)} viewers over {", ".join(names)}: {cpu * 100:.1f}% CPU')
+    for name, s in cam.stream_stats()['variants'].items():
+        print(f'{name:>8} {s["width"]}x{s["height"]} q{s["quality"]}: {s["frames_encoded"]:5d} encodes  '
+              f'{s["avg_encode_ms"]} ms/encode  {s["avg_frame_bytes"]} B/frame  {s["send_kbps"]} kbit/s sent')
+    cam.release()
+    cam.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Concurrent read/write throughput: per-call connections vs the pooled WAL layer.
+
+Runs writer threads (insert_patient, like /api/vitals) alongside reader threads
+(latest visits, like the dashboard) against a scratch database and reports
+operations per second for both connection strategies.
+
+    python scripts/bench_db_concurrency.py --seconds 5 --writers 4 --readers 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+
+def legacy_get_conn() -> sqlite3.Connection:
+    # The original behaviour: a fresh rollback-journal connection per call
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+VISIT = (
+    None, None, 'Bench Patient', 40, 'Male', '0000', 'Ward 1',
+    'checkup', None, None, None, None, None, None, None, None, None,
+    72.0, 98.0, 98.6, 77.0, 50.0, 70.0,
+)
+
+
+def run(label: str, seconds: float, writers: int, readers: int) -> None:
+    counts = {'write': 0, 'read': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def writer():
+        n = err = 0
+        while time.monotonic() < stop:
+            try:
+                db.insert_patient(VISIT)
+                n += 1
+            except sqlite3.OperationalError:
+                err += 1
+        with lock:
+            counts['write'] += n
+            counts['errors'] += err
+
+    def reader():
+        n = err = 0
+        while time.monotonic() < stop:
+            try:
+                with db.get_conn() as conn:
+                    conn.execute('SELECT * FROM patients ORDER BY id DESC LIMIT 25').fetchall()
+                n += 1
+            except sqlite3.OperationalError:
+                err += 1
+        with lock:
+            counts['read'] += n
+            counts['errors'] += err
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f"{label:>8}: writes/s={counts['write'] / seconds:9.1f}  "
+          f"reads/s={counts['read'] / seconds:9.1f}  errors={counts['errors']}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--writers', type=int, default=4)
+    ap.add_argument('--readers', type=int, default=8)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy run on its own file so it never sees WAL mode
+        db.DB_PATH = os.path.join(tmp, 'legacy.db')
+        db.init_db()
+        db.close_conn()
+        with sqlite3.connect(db.DB_PATH) as conn:
+            conn.execute('PRAGMA journal_mode = DELETE')
+        pooled_get_conn = db.get_conn
+        db.get_conn = legacy_get_conn
+        try:
+            run('legacy', args.seconds, args.writers, args.readers)
+        finally:
+            db.get_conn = pooled_get_conn
+
+        db.DB_PATH = os.path.join(tmp, 'pooled.db')
+        db.init_db()
+        run('pooled', args.seconds, args.writers, args.readers)
+
+
+if __name__ == '__main__':
+    main()
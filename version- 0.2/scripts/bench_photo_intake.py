@@ -0,0 +1,121 @@
+"""Latency of the qa.js intake flow: photo upload followed by the patient save.
+
+Simulated tablets (threads) each run the flow the QA page uses:
+POST /upload_photo with a camera JPEG, then POST /api/patient referencing the
+returned filename. Compares photos written on the request thread (the old
+upload_photo, with and without fsync) against the background photo writer,
+and reports p50/p95 latency for the upload and the whole intake plus the
+time until every photo is durably on disk.
+
+    python scripts/bench_photo_intake.py --tablets 4 --intakes 25 --dir /var/tmp
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+import photos  # noqa: E402
+
+
+class InlineWriter:
+    """The old behaviour: write (optionally fsync) and stat before responding"""
+
+    def __init__(self, directory, fsync):
+        self.directory = directory
+        self.fsync = fsync
+
+    def submit_bytes(self, data, filename=None):
+        filename = filename or photos.new_filename()
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.path.getsize(path)
+        return filename
+
+    def join(self):
+        pass
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def run(app, tablets, intakes, jpeg):
+    upload_ms, intake_ms = [], []
+    lock = threading.Lock()
+
+    def tablet(i):
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['hospital_ok'] = True
+        for n in range(intakes):
+            t0 = time.perf_counter()
+            resp = client.post('/upload_photo', data={'photo': (io.BytesIO(jpeg), 'patient_photo.jpg')},
+                               content_type='multipart/form-data')
+            t1 = time.perf_counter()
+            filename = resp.get_json()['filename']
+            client.post('/api/patient', json={'name': f'Tablet {i} patient {n}', 'photo': filename, 'heart_rate': 70})
+            t2 = time.perf_counter()
+            with lock:
+                upload_ms.append(t1 - t0)
+                intake_ms.append(t2 - t0)
+
+    threads = [threading.Thread(target=tablet, args=(i,)) for i in range(tablets)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    responded = time.perf_counter() - started
+    return upload_ms, intake_ms, responded
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--tablets', type=int, default=4)
+    ap.add_argument('--intakes', type=int, default=25, help='intakes per tablet')
+    ap.add_argument('--dir', default=None, help='where photos are written (use a real disk to see fsync cost)')
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (5, 5), 0)
+    jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory(dir=args.dir) as photo_dir:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        photos.photo_writer.directory = photo_dir
+        modes = (
+            ('inline write', InlineWriter(photo_dir, fsync=False)),
+            ('inline write+fsync', InlineWriter(photo_dir, fsync=True)),
+            ('background writer', photos.photo_writer),
+        )
+        print(f'{len(jpeg)} byte photos, {args.tablets} tablets x {args.intakes} intakes')
+        for name, writer in modes:
+            app_module.photo_writer = writer
+            upload, intake, responded = run(app_module.app, args.tablets, args.intakes, jpeg)
+            t = time.perf_counter()
+            writer.join()
+            on_disk = responded + time.perf_counter() - t
+            print(f'{name:>19}: upload p50 {percentile(upload, 50):6.1f} ms  p95 {percentile(upload, 95):6.1f} ms  '
+                  f'intake p50 {percentile(intake, 50):6.1f} ms  p95 {percentile(intake, 95):6.1f} ms  '
+                  f'mean {statistics.mean(intake) * 1000:6.1f} ms  all photos on disk after {on_disk:5.2f} s')
+        stats = photos.photo_writer.stats()
+        print(f'background writer: {stats["written"]} written, {stats["failed"]} failed, {stats["rejected"]} rejected')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Profile directory load time: per-request aggregate joins vs profile_stats.
+
+Builds a scratch database with --profiles profiles and about --visits visits
+each (a third of them archived). It then times:
+- the old PatientProfiles.html query, plus its three header COUNT queries;
+- the old get_all_patient_profiles query;
+- both readers reading the trigger-maintained profile_stats table instead;
+- the full /PatientProfiles.html and /api/profiles/list requests;
+- what the triggers add to a single insert_patient.
+
+    python scripts/bench_profile_list.py --profiles 50000 --visits 3
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+# The queries these pages ran before profile_stats existed
+OLD_PAGE_QUERY = """
+    SELECT pp.id, pp.name, pp.gender, pp.contact, pp.address, pp.photo,
+           COALESCE(pp.photo, lp.photo, lsp.photo) AS representative_photo,
+           pp.medical_history, pp.allergies, pp.medications, pp.notes, pp.created_at,
+           COUNT(DISTINCT p.id) + COUNT(DISTINCT sp.id) as visit_count,
+           MAX(COALESCE(p.created_at, sp.archived_at)) as last_visit
+    FROM patient_profiles pp
+    LEFT JOIN patients p ON pp.id = p.profile_id
+    LEFT JOIN stored_patients sp ON pp.id = sp.profile_id
+    LEFT JOIN (
+        SELECT p1.profile_id, p1.photo FROM patients p1
+        INNER JOIN (
+            SELECT profile_id, MAX(created_at) AS max_created FROM patients
+            WHERE profile_id IS NOT NULL AND photo IS NOT NULL GROUP BY profile_id
+        ) pm ON pm.profile_id = p1.profile_id AND pm.max_created = p1.created_at
+    ) lp ON lp.profile_id = pp.id
+    LEFT JOIN (
+        SELECT sp1.profile_id, sp1.photo FROM stored_patients sp1
+        INNER JOIN (
+            SELECT profile_id, MAX(archived_at) AS max_archived FROM stored_patients
+            WHERE profile_id IS NOT NULL AND photo IS NOT NULL GROUP BY profile_id
+        ) spm ON spm.profile_id = sp1.profile_id AND spm.max_archived = sp1.archived_at
+    ) lsp ON lsp.profile_id = pp.id
+    GROUP BY pp.id ORDER BY pp.created_at DESC
+"""
+OLD_HEADER_QUERIES = (
+    "SELECT COUNT(*) FROM patient_profiles",
+    "SELECT COUNT(DISTINCT profile_id) FROM patients WHERE profile_id IS NOT NULL",
+    "SELECT COUNT(*) FROM patients",
+    "SELECT COUNT(*) FROM stored_patients",
+)
+OLD_LIST_QUERY = """
+    SELECT pp.*, COUNT(DISTINCT p.id) + COUNT(DISTINCT sp.id) as visit_count,
+           MAX(COALESCE(p.created_at, sp.archived_at)) as last_visit
+    FROM patient_profiles pp
+    LEFT JOIN patients p ON pp.id = p.profile_id
+    LEFT JOIN stored_patients sp ON pp.id = sp.profile_id
+    GROUP BY pp.id ORDER BY pp.created_at DESC
+"""
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+
+def fill(profiles: int, visits: int) -> None:
+    rng = random.Random(0)
+    conn = db.get_conn()
+    with conn:
+        conn.executemany("INSERT INTO patient_profiles (name, contact, created_at) VALUES (?, ?, datetime('now', ?))",
+                         [(f'Patient {i}', f'555-{i:06d}', f'-{i} minutes') for i in range(profiles)])
+        rows = []
+        for pid in range(1, profiles + 1):
+            for v in range(rng.randint(0, 2 * visits)):
+                photo = f'p{pid}_{v}.jpg' if rng.random() < 0.5 else None
+                rows.append((pid, photo, f'Patient {pid}', f'-{rng.randint(0, 500000)} minutes'))
+        conn.executemany("INSERT INTO patients (profile_id, photo, name, created_at) VALUES (?, ?, ?, datetime('now', ?))",
+                         rows)
+        # Archive about a third, as /view/<id> does
+        conn.execute("INSERT INTO stored_patients (profile_id, photo, name, created_at, archived_at) "
+                     "SELECT profile_id, photo, name, created_at, datetime(created_at, '+1 hour') "
+                     "FROM patients WHERE id % 3 = 0")
+        conn.execute("DELETE FROM patients WHERE id % 3 = 0")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--profiles', type=int, default=50000)
+    ap.add_argument('--visits', type=int, default=3, help='average visits per profile')
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        t = time.perf_counter()
+        fill(args.profiles, args.visits)
+        conn = db.get_conn()
+        counts = [conn.execute(q).fetchone()[0] for q in OLD_HEADER_QUERIES[:1] + OLD_HEADER_QUERIES[2:]]
+        print(f'{counts[0]} profiles, {counts[1]} current + {counts[2]} archived visits '
+              f'(built in {time.perf_counter() - t:.1f}s, triggers on)')
+
+        def old_page():
+            conn.execute(OLD_PAGE_QUERY).fetchall()
+            for q in OLD_HEADER_QUERIES:
+                conn.execute(q).fetchone()
+
+        def new_page():
+            db.get_all_patient_profiles()
+            db.profile_directory_stats()
+
+        old_p = timed(old_page, args.repeat)
+        new_p = timed(new_page, args.repeat)
+        print(f'PatientProfiles queries: aggregate joins {old_p:8.1f} ms   profile_stats {new_p:7.1f} ms')
+        old_l = timed(lambda: conn.execute(OLD_LIST_QUERY).fetchall(), args.repeat)
+        new_l = timed(db.get_all_patient_profiles, args.repeat)
+        print(f'get_all_patient_profiles: aggregate joins {old_l:7.1f} ms   profile_stats {new_l:7.1f} ms')
+
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s['hospital_ok'] = True
+            s['doctor_ok'] = True
+        page = timed(lambda: client.get('/PatientProfiles.html'), args.repeat)
+        api = timed(lambda: client.get('/api/profiles/list'), args.repeat)
+        print(f'full requests with profile_stats: /PatientProfiles.html {page:7.1f} ms   /api/profiles/list {api:7.1f} ms')
+
+        values = (7, 'x.jpg') + (None,) * 21
+        with_triggers = timed(lambda: [db.insert_patient(values) for _ in range(200)], 1) / 200
+        for table in ('patients',):
+            for kind in ('ai', 'ad', 'au'):
+                conn.execute(f'DROP TRIGGER profile_stats_{table}_{kind}')
+        without = timed(lambda: [db.insert_patient(values) for _ in range(200)], 1) / 200
+        print(f'insert_patient: {without:.3f} ms without stats triggers, {with_triggers:.3f} ms with')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Repeated QR page loads: rendering on every request vs the payload-keyed
+QR image cache, plus conditional requests answered with 304.
+
+Runs /qr/<id> and /api/qr/<id> in-process against a scratch database with a
+handful of profiles, as when a patient reopens their QR or a tablet polls it.
+
+    python scripts/bench_qr.py --loads 300 --profiles 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+
+def timed(client, urls, loads, etags=None):
+    started = time.perf_counter()
+    for i in range(loads):
+        url = urls[i % len(urls)]
+        headers = {'If-None-Match': etags[url]} if etags else {}
+        resp = client.get(url, headers=headers)
+        assert resp.status_code in (200, 304), resp.status_code
+    return (time.perf_counter() - started) / loads * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--loads', type=int, default=300)
+    ap.add_argument('--profiles', type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        ids = [db.create_patient_profile({'name': f'QR Patient {i}', 'age': 30 + i, 'gender': 'F'})
+               for i in range(args.profiles)]
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s['hospital_ok'] = True
+            s['doctor_ok'] = True
+
+        for kind, fmt in (('page', '/qr/{}'), ('api', '/api/qr/{}')):
+            urls = [fmt.format(i) for i in ids]
+            # Old behaviour: render the QR on every request
+            db.QR_CACHE_SIZE = 0
+            db.invalidate_qr_cache()
+            cold = timed(client, urls, args.loads)
+            db.QR_CACHE_SIZE = 512
+            db.invalidate_qr_cache()
+            timed(client, urls, len(urls))  # warm
+            warm = timed(client, urls, args.loads)
+            etags = {u: client.get(u).headers['ETag'] for u in urls}
+            cond = timed(client, urls, args.loads, etags)
+            print(f'{kind:>4}: render every time {cold:6.2f} ms   cached {warm:6.2f} ms   '
+                  f'If-None-Match (304) {cond:6.2f} ms')
+        print(f"cache: {db.qr_cache_stats['hits']} hits, {db.qr_cache_stats['misses']} misses")
+
+
+if __name__ == '__main__':
+    main()
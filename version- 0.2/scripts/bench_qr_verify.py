@@ -0,0 +1,85 @@
+"""Scan-to-verify cost of the legacy JSON QR payload vs the compact signed token.
+
+For each format it reports the payload size and QR symbol size, the time to
+detect and decode the rendered code with OpenCV (a stand-in for the tablet
+camera decoder), and the verification cost (verify_patient_qr_code alone and
+the whole /api/verify-qr request) for valid codes plus, for the compact token,
+forged codes that are rejected without a database lookup.
+
+    python scripts/bench_qr_verify.py --profiles 200 --scans 500
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+
+def decode_ms(payloads, rounds):
+    detector = cv2.QRCodeDetector()
+    images = []
+    for p in payloads:
+        png = base64.b64decode(db.generate_qr_code_image(p))
+        images.append(cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE))
+    started = time.perf_counter()
+    ok = 0
+    for i in range(rounds):
+        text = detector.detectAndDecode(images[i % len(images)])[0]
+        ok += text == payloads[i % len(payloads)]
+    return (time.perf_counter() - started) / rounds * 1000, ok / rounds, images[0].shape[0]
+
+
+def verify_us(payloads, scans):
+    started = time.perf_counter()
+    for i in range(scans):
+        db.verify_patient_qr_code(payloads[i % len(payloads)])
+    return (time.perf_counter() - started) / scans * 1e6
+
+
+def verify_ms(client, payloads, scans, expect):
+    started = time.perf_counter()
+    for i in range(scans):
+        resp = client.post('/api/verify-qr', json={'qr_data': payloads[i % len(payloads)]})
+        assert resp.status_code == expect, resp.status_code
+    return (time.perf_counter() - started) / scans * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--profiles', type=int, default=200)
+    ap.add_argument('--scans', type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        ids = [db.create_patient_profile({'name': f'Scan Patient {i}', 'age': 20 + i % 70, 'gender': 'Female'})
+               for i in range(args.profiles)]
+        profiles = [db.get_profile(i) for i in ids]
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s['hospital_ok'] = True
+        verify_ms(client, [db.qr_payload(profiles[0])], 50, 200)  # warm up
+
+        for fmt in ('json', 'compact'):
+            db.QR_FORMAT = fmt
+            payloads = [db.qr_payload(p) for p in profiles]
+            dec, rate, px = decode_ms(payloads, min(args.scans, 200))
+            fn = verify_us(payloads, args.scans)
+            api = verify_ms(client, payloads, args.scans, 200)
+            print(f'{fmt:>7}: {len(payloads[0]):3d} chars, {px // 10 - 8} modules/side, '
+                  f'decode {dec:5.2f} ms ({rate:.0%} ok), verify {fn:5.1f} us, /api/verify-qr {api:5.2f} ms')
+        forged = [p[:-2] + ('AA' if not p.endswith('AA') else 'BB') for p in payloads]
+        print(f' forged: rejected in {verify_us(forged, args.scans):5.1f} us, /api/verify-qr '
+              f'{verify_ms(client, forged, args.scans, 404):5.2f} ms (no database lookup)')
+
+
+if __name__ == '__main__':
+    main()
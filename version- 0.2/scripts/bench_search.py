@@ -0,0 +1,85 @@
+"""Search latency: LIKE '%term%' scans vs the FTS5 index used by query_patients.
+
+Seeds scratch databases with 100k and 1M visits and times typical
+keystroke-driven searches (/api/patients/recent?q=...) both ways.
+
+    python scripts/bench_search.py
+    python scripts/bench_search.py --sizes 20000 --repeat 3
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+FIRST = ['Ann', 'Bob', 'Chen', 'Dina', 'Emeka', 'Fatou', 'Gita', 'Hugo', 'Ines', 'Jabbi', 'Kofi', 'Lena']
+LAST = ['Smith', 'Jones', 'Wang', 'Diallo', 'Okafor', 'Sarr', 'Patel', 'Moreau', 'Silva', 'Touray']
+COMPLAINTS = ['headache', 'chest pain', 'fever and chills', 'abdominal pain', 'cough', 'dizziness',
+              'back pain', 'shortness of breath', 'rash', 'sore throat']
+TERMS = ['ann', 'jabbi', 'chest', 'fever', 'okafor sore', 'di']
+
+LIKE_SQL = """
+    SELECT * FROM patients
+    WHERE COALESCE(name,'') LIKE ?
+       OR COALESCE(age,'') LIKE ?
+       OR COALESCE(chief_complaint,'') LIKE ?
+    ORDER BY created_at DESC, id DESC
+"""
+
+
+def seed(conn, rows: int) -> None:
+    rnd = random.Random(7)
+
+    def visits():
+        for i in range(rows):
+            name = f'{rnd.choice(FIRST)} {rnd.choice(LAST)}'
+            ts = f'2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:00'
+            yield (name, rnd.randint(1, 90), f'07{i:08d}', rnd.choice(COMPLAINTS), ts)
+
+    conn.executemany(
+        "INSERT INTO patients(name, age, contact, chief_complaint, created_at) VALUES (?,?,?,?,?)",
+        visits(),
+    )
+    conn.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--limit', type=int, default=50)
+    args = ap.parse_args()
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.DB_PATH = os.path.join(tmp, f'search_{size}.db')
+            db.init_db()
+            conn = db.get_conn()
+            started = time.monotonic()
+            seed(conn, size)
+            print(f'\n{size} visits (seeded in {time.monotonic() - started:.1f}s, fts={db.fts_enabled(conn)})')
+            print(f"{'term':>14} {'LIKE ms':>10} {'FTS ms':>10} {'speedup':>8}")
+            for term in TERMS:
+                like = f'%{term}%'
+                like_ms = timed(lambda: conn.execute(LIKE_SQL, (like, like, like)).fetchall()[:args.limit], args.repeat)
+                fts_ms = timed(lambda: db.query_patients(term, limit=args.limit), args.repeat)
+                print(f'{term:>14} {like_ms:10.2f} {fts_ms:10.2f} {like_ms / max(fts_ms, 1e-6):7.1f}x')
+            db.close_conn()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Simulated hospital floor: many robots posting live readings through several workers.
+
+Each of --devices devices posts --readings readings to /api/vitals with its
+own device_id. Reading n of device d goes to worker (d + n) % workers, the
+way a load balancer spreads them, and the workers finish each round before
+the next starts, so every device's newest reading is known. The check fails
+unless each device's /api/sensor?device= snapshot is its own newest reading
+with an exact reading count (no robot clobbers another) and /api/devices
+lists every device. It also reports:
+
+- /api/vitals latency per reading
+- /api/sensor?device= and /api/devices latency once every device reported
+- registry lookup time as the number of devices grows (flat: O(1))
+
+    python scripts/bench_sensor_devices.py --devices 100 --readings 20 --workers 2
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+
+def device_name(d: int) -> str:
+    return f'robot-{d:03d}'
+
+
+def configure(tmp: str, devices: int) -> None:
+    # sensor_state reads these at import; spawned workers inherit them
+    os.environ['SENSOR_DEVICE_DIR'] = os.path.join(tmp, 'devices')
+    os.environ['SENSOR_STATE_PATH'] = os.path.join(tmp, 'sensor_state.bin')
+    os.environ['SENSOR_MAX_DEVICES'] = str(max(devices, 256))
+
+
+def load_app(tmp: str):
+    db.DB_PATH = os.path.join(tmp, 'devices.db')
+    import app as app_module
+    return app_module
+
+
+def worker(tmp, wid, workers, devices, readings, barrier, results):
+    client = load_app(tmp).app.test_client()
+    lat, errors = [], 0
+    barrier.wait()
+    for n in range(readings):
+        for d in range(devices):
+            if (d + n) % workers != wid:
+                continue
+            body = {'device_id': device_name(d), 'heartRate': 60 + d % 40, 'spo2': n, 'weight': d,
+                    'temperature': 36.5}
+            started = time.perf_counter()
+            resp = client.post('/api/vitals', json=body)
+            lat.append(time.perf_counter() - started)
+            errors += resp.status_code != 200
+        barrier.wait()
+    results.put((lat, errors))
+
+
+def ms(samples, q=0.5):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+def check_floor(tmp, args):
+    ctx = mp.get_context('spawn')
+    barrier, results = ctx.Barrier(args.workers), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(tmp, w, args.workers, args.devices, args.readings, barrier, results))
+             for w in range(args.workers)]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    got = [results.get(timeout=300) for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    lat = [x for g in got for x in g[0]]
+    errors = sum(g[1] for g in got)
+    print(f"{'✅' if not errors else '❌'} {len(lat)} readings from {args.devices} devices via {args.workers} "
+          f"workers in {elapsed:.1f}s; /api/vitals p50 {ms(lat):.2f} ms p99 {ms(lat, 0.99):.2f} ms, "
+          f"{errors} errors")
+
+    app_module = load_app(tmp)
+    client = app_module.app.test_client()
+    with client.session_transaction() as s:
+        s['hospital_ok'] = True
+    wrong, lookups = [], []
+    for d in range(args.devices):
+        started = time.perf_counter()
+        snap = client.get(f'/api/sensor?device={device_name(d)}').get_json()
+        lookups.append(time.perf_counter() - started)
+        want = (60 + d % 40, args.readings - 1, d, args.readings)
+        if (snap['heart_rate'], snap['spo2'], snap['weight'], snap['measurements']) != want:
+            wrong.append(device_name(d))
+    ok = not wrong and not errors
+    print(f"{'✅' if not wrong else '❌'} every device kept its own newest reading and count "
+          f"({len(wrong)} wrong{': ' + ', '.join(wrong[:5]) if wrong else ''}); "
+          f"/api/sensor?device= p50 {ms(lookups):.2f} ms")
+
+    started = time.perf_counter()
+    listing = client.get('/api/devices').get_json()
+    listed_ms = (time.perf_counter() - started) * 1000
+    listed_ok = sorted(x['device'] for x in listing['devices']) == [device_name(d) for d in range(args.devices)]
+    ok &= listed_ok
+    print(f"{'✅' if listed_ok else '❌'} /api/devices lists {listing['count']} devices in {listed_ms:.1f} ms")
+    return ok
+
+
+def check_lookup_scaling(tmp, sizes, lookups=20000):
+    from sensor_state import SensorRegistry
+    print(f'{"devices":>8} {"first lookup us":>16} {"cached lookup us":>17}')
+    for n in sizes:
+        path = os.path.join(tmp, f'scale-{n}')
+        writer = SensorRegistry(path, capacity=16, max_devices=n)
+        for d in range(n):
+            writer.publish(device_name(d), {'heart_rate': d})
+        # A fresh registry, like a worker that has not seen these devices yet
+        reader = SensorRegistry(path, capacity=16, max_devices=n)
+        ids = [device_name(d) for d in range(n)]
+        started = time.perf_counter()
+        for device in ids:
+            reader.get(device).snapshot()
+        first = (time.perf_counter() - started) / n
+        picks = [random.choice(ids) for _ in range(lookups)]
+        started = time.perf_counter()
+        for device in picks:
+            reader.get(device)
+        cached = (time.perf_counter() - started) / lookups
+        print(f'{n:>8} {first * 1e6:>16.1f} {cached * 1e6:>17.2f}')
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--devices', type=int, default=100)
+    ap.add_argument('--readings', type=int, default=20, help='readings per device')
+    ap.add_argument('--workers', type=int, default=2, help='processes serving /api/vitals')
+    ap.add_argument('--scale', type=int, nargs='+', default=[10, 100, 1000], help='registry sizes to time lookups at')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp, args.devices)
+        ok = check_floor(tmp, args)
+        check_lookup_scaling(tmp, args.scale)
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Concurrent stream capacity: gthread-style thread pool vs the async sidecar.
+
+Threaded mode serves everything from one Flask server with a fixed pool of
+--threads threads, the way gunicorn's gthread worker does (render.yaml runs
+2 workers with 1 thread each). Sidecar mode keeps that server for ordinary
+requests and sends the streams to streams.py.
+
+For each stream count the script opens that many /events/patients
+connections and --mjpeg /camera/video_feed viewers, fed by a synthetic
+camera at 10 fps. It then measures, while the streams stay open:
+
+- how many streams got their first event or frame
+- the latency of ordinary requests (/api/profiles?limit=1)
+- the time for one published event to reach every connected SSE client
+- the server's threads and RSS
+
+    python scripts/bench_streams.py --streams 50 500 2000 --mjpeg 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, HERE)
+import db  # noqa: E402
+
+CONNECT_TIMEOUT = 5.0
+
+
+# -- servers (run in subprocesses) ------------------------------------------
+
+def fake_camera(fps: float = 10.0) -> None:
+    """Feed camera.variants with synthetic JPEG parts instead of a device"""
+    import camera as camera_module
+    import numpy as np
+    cam = camera_module.camera
+    cam.start = lambda: None
+    cam.running = True
+
+    def run():
+        frame = np.zeros((480, 640, 3), np.uint8)
+        while True:
+            frame[:] = int(time.time() * 50) % 255
+            with cam.frame_ready:
+                for v in cam.variants.values():
+                    if v.subscribers:
+                        data = v.encode(frame)
+                        v.part = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + data + b'\r\n'
+                        v.seq += 1
+                cam.frame_ready.notify_all()
+            time.sleep(1 / fps)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def serve_threaded(port: int, threads: int) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+    import app as app_module
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class PoolServer(WSGIServer):
+        # Like gthread: a fixed set of threads; further connections wait
+        request_queue_size = 4096
+        pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._serve, request, client_address)
+
+        def _serve(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                pass
+            finally:
+                self.shutdown_request(request)
+
+    fake_camera()
+    server = make_server('127.0.0.1', port, app_module.app, server_class=PoolServer, handler_class=QuietHandler)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def serve_async(port: int) -> None:
+    import streams
+    fake_camera()
+    print('ready', flush=True)
+    asyncio.run(streams.serve('127.0.0.1', port))
+
+
+def start(mode: str, path: str, port: int, threads: int) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, __file__, '--serve', mode, '--db', path, '--port', str(port),
+                             '--threads', str(threads)], stdout=subprocess.PIPE, text=True)
+    while 'ready' not in proc.stdout.readline():
+        pass
+    time.sleep(0.5)
+    return proc
+
+
+def proc_status(pid: int):
+    fields = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.strip()
+    return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+
+
+# -- client -----------------------------------------------------------------
+
+class Stream:
+    def __init__(self):
+        self.writer = None
+        self.first = asyncio.Event()
+        self.events = 0
+        self.got_event = None
+
+    async def open(self, port, path, cookie, marker):
+        reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+        await self.writer.drain()
+        buf = b''
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            buf = (buf + chunk)[-4096:]
+            if marker in buf:
+                self.first.set()
+            if b'event: bench' in buf:
+                self.events += 1
+                buf = b''
+                if self.got_event is not None:
+                    self.got_event(self)
+
+
+async def ordinary_ms(port, cookie, n=10, timeout=3.0):
+    """Median and worst latency of ordinary requests (inf: no answer in ``timeout``)"""
+    times = []
+    for _ in range(n):
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            writer.write(f'GET /api/profiles?limit=1 HTTP/1.0\r\nCookie: {cookie}\r\n\r\n'.encode())
+            await asyncio.wait_for(reader.read(), timeout)
+            writer.close()
+            times.append((time.perf_counter() - started) * 1000)
+        except asyncio.TimeoutError:
+            times.append(float('inf'))
+    return statistics.median(times), max(times)
+
+
+async def run_load(stream_port, plain_port, cookie, n_sse, n_mjpeg, bus):
+    sse = [Stream() for _ in range(n_sse)]
+    mjpeg = [Stream() for _ in range(n_mjpeg)]
+    tasks = [asyncio.ensure_future(s.open(stream_port, '/events/patients', cookie, b'event: hello')) for s in sse]
+    tasks += [asyncio.ensure_future(s.open(stream_port, '/camera/video_feed?stream=thumb', cookie, b'--frame'))
+              for s in mjpeg]
+
+    async def first(s):
+        try:
+            await asyncio.wait_for(s.first.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    await asyncio.gather(*(first(s) for s in sse + mjpeg))
+    connected_sse = [s for s in sse if s.first.is_set()]
+    connected_mjpeg = sum(s.first.is_set() for s in mjpeg)
+    plain = await ordinary_ms(plain_port, cookie)
+
+    fanout = None
+    if connected_sse:
+        done, arrived = asyncio.Event(), []
+        sent = time.perf_counter()
+
+        def got(_s):
+            arrived.append(time.perf_counter() - sent)
+            if len(arrived) == len(connected_sse):
+                done.set()
+        for s in connected_sse:
+            s.got_event = got
+        bus.publish('bench', {'sent': time.time()})
+        try:
+            await asyncio.wait_for(done.wait(), 10)
+        except asyncio.TimeoutError:
+            pass
+        fanout = (len(arrived), max(arrived) * 1000 if arrived else float('nan'))
+    for s in sse + mjpeg:
+        if s.writer:
+            s.writer.close()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return len(connected_sse), connected_mjpeg, plain, fanout
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--streams', type=int, nargs='+', default=[50, 500, 2000], help='SSE connections per run')
+    ap.add_argument('--mjpeg', type=int, default=20, help='camera viewers per run')
+    ap.add_argument('--threads', type=int, default=2, help='threaded mode pool size')
+    ap.add_argument('--serve', choices=('threaded', 'async'), help=argparse.SUPPRESS)
+    ap.add_argument('--db', help=argparse.SUPPRESS)
+    ap.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.serve:
+        db.DB_PATH = args.db
+        return serve_threaded(args.port, args.threads) if args.serve == 'threaded' else serve_async(args.port)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'streams.db')
+        import app as app_module
+        import events
+        cookie = 'session=' + app_module.app.session_interface.get_signing_serializer(app_module.app).dumps(
+            {'hospital_ok': True, 'doctor_ok': True})
+        bus = events.SQLiteEventBus()
+        plain = start('threaded', db.DB_PATH, 18301, args.threads)
+        sidecar = start('async', db.DB_PATH, 18302, args.threads)
+        try:
+            print(f'{"mode":<9} {"SSE":>5} {"MJPEG":>6} {"ordinary p50/max ms":>20} '
+                  f'{"event to all SSE":>18} {"threads":>7} {"RSS MB":>7}')
+            for n in args.streams:
+                for mode, port in (('threaded', 18301), ('sidecar', 18302)):
+                    # A fresh pool each run: threads still stuck on the last
+                    # run's streams would skew the ordinary requests
+                    plain.kill()
+                    plain = start('threaded', db.DB_PATH, 18301, args.threads)
+                    proc = plain if mode == 'threaded' else sidecar
+                    result = {}
+
+                    def sample():
+                        time.sleep(CONNECT_TIMEOUT + 0.5)
+                        result['status'] = proc_status(proc.pid)
+                    sampler = threading.Thread(target=sample)
+                    sampler.start()
+                    ok_sse, ok_mjpeg, (p50, worst), fanout = asyncio.run(
+                        run_load(port, 18301, cookie, n, args.mjpeg, bus))
+                    sampler.join()
+                    threads, rss = result['status']
+                    reach = f'{fanout[0]} in {fanout[1]:.0f} ms' if fanout else '-'
+                    print(f'{mode:<9} {ok_sse:>5}/{n:<5} {ok_mjpeg:>3}/{args.mjpeg:<3} '
+                          f'{p50:>9.1f} / {worst:<8.1f} {reach:>18} {threads:>7} {rss:>7.0f}')
+        finally:
+            plain.kill()
+            sidecar.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Device-simulator load test: /api/vitals (one reading per request) vs
+/api/vitals/batch (many timestamped readings per request).
+
+Simulated robots run in threads and post through the Flask app in-process
+against a scratch database. Reports requests/sec, readings/sec, DB commits per
+reading and request bytes per reading for each mode.
+
+    python scripts/bench_vitals_batch.py --devices 8 --readings 400 --batch 50
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+try:
+    import msgpack  # type: ignore
+except Exception:
+    msgpack = None
+
+
+def reading(device: str, i: int, now: float) -> dict:
+    return {
+        'device_id': device, 'ts': now - (400 - i) * 2.0,
+        'heart_rate': 60 + i % 40, 'spo2': 95 + i % 5, 'body_temp': 36.5,
+        'weight': 70.0, 'env_temp': 24.0, 'humidity': 50.0,
+    }
+
+
+class CommitCounter:
+    """Wraps db.insert_vitals_samples; every call is one committed transaction"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            self.calls += 1
+        return self.fn(rows)
+
+
+def run(app, mode: str, devices: int, readings: int, batch: int, encoding: str):
+    sent_bytes = [0]
+    requests = [0]
+    lock = threading.Lock()
+
+    def device(idx):
+        client = app.test_client()
+        name = f'robot-{idx}'
+        now = time.time()
+        items = [reading(name, i, now) for i in range(readings)]
+        nbytes = nreq = 0
+        if mode == 'single':
+            for item in items:
+                body = json.dumps(item).encode()
+                client.post('/api/vitals', data=body, content_type='application/json')
+                nbytes += len(body)
+                nreq += 1
+        else:
+            for start in range(0, len(items), batch):
+                chunk = items[start:start + batch]
+                headers = {}
+                if encoding == 'msgpack' and msgpack is not None:
+                    body, ctype = msgpack.packb(chunk), 'application/msgpack'
+                elif encoding == 'ndjson-gzip':
+                    body = gzip.compress('\n'.join(json.dumps(r) for r in chunk).encode())
+                    ctype, headers = 'application/x-ndjson', {'Content-Encoding': 'gzip'}
+                else:
+                    body, ctype = json.dumps(chunk).encode(), 'application/json'
+                resp = client.post('/api/vitals/batch', data=body, content_type=ctype, headers=headers)
+                assert resp.status_code == 200, resp.get_json()
+                nbytes += len(body)
+                nreq += 1
+        with lock:
+            sent_bytes[0] += nbytes
+            requests[0] += nreq
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=device, args=(i,)) for i in range(devices)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.monotonic() - started, requests[0], sent_bytes[0]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--devices', type=int, default=8)
+    ap.add_argument('--readings', type=int, default=400, help='readings per device')
+    ap.add_argument('--batch', type=int, default=50, help='readings per batch request')
+    ap.add_argument('--encoding', choices=['json', 'ndjson-gzip', 'msgpack'], default='json')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        import app as app_module
+        import vitals
+        counter = CommitCounter(db.insert_vitals_samples)
+        vitals.vitals_buffer.writer = counter
+        app_module.insert_vitals_samples = counter
+        total = args.devices * args.readings
+
+        for mode in ('single', 'batch'):
+            counter.calls = 0
+            elapsed, nreq, nbytes = run(app_module.app, mode, args.devices, args.readings, args.batch, args.encoding)
+            vitals.vitals_buffer.flush()
+            label = mode if mode == 'single' else f'batch/{args.batch} {args.encoding}'
+            print(f'{label:>22}: {nreq / elapsed:8.0f} req/s  {total / elapsed:8.0f} readings/s  '
+                  f'{counter.calls / total:6.3f} commits/reading  {nbytes / total:6.1f} bytes/reading')
+        stored = db.get_conn().execute('SELECT COUNT(*) FROM vitals_samples').fetchone()[0]
+        print(f'stored samples: {stored} (expected {2 * total})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Sustained vitals ingest per worker: one committed visit row per reading vs
+the batched vitals_samples write-behind buffer.
+
+Producer threads play the part of request threads handling /api/vitals posts.
+Throughput is counted only once samples are committed, i.e. after the buffer
+has fully drained.
+
+    python scripts/bench_vitals_ingest.py --seconds 5 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+from vitals import VitalsBuffer, parse_reading, sample_tuple  # noqa: E402
+
+READING = {'heartRate': 72, 'spo2': 98, 'temperature': 36.7, 'weight': 70.2, 'envTemperature': 24.1, 'humidity': 51}
+
+
+def legacy_row(reading):
+    # The old /api/vitals path: a 24-column visit row with a commit per reading
+    return (
+        1, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None,
+        reading['heart_rate'], reading['spo2'],
+        reading['body_temp_c'] * 9 / 5 + 32, reading['env_temp_c'] * 9 / 5 + 32,
+        reading['humidity_percent'], reading['weight_kg'],
+    )
+
+
+def run_legacy(seconds: float, threads: int) -> float:
+    count = [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def producer():
+        n = 0
+        while time.monotonic() < stop:
+            db.insert_patient(legacy_row(parse_reading(READING)))
+            n += 1
+        with lock:
+            count[0] += n
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=producer) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return count[0] / (time.monotonic() - started)
+
+
+def run_buffered(seconds: float, threads: int, batch_size: int) -> tuple:
+    buf = VitalsBuffer(batch_size=batch_size, flush_interval=0.5, maxsize=50_000)
+    stop = time.monotonic() + seconds
+
+    def producer(device):
+        while time.monotonic() < stop:
+            if not buf.add(sample_tuple(parse_reading(READING), device, 1)):
+                time.sleep(0.0005)  # buffer full: back off like a rejected post
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=producer, args=(f'robot-{i}',)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    buf.close()
+    elapsed = time.monotonic() - started
+    return buf.written / elapsed, buf.flushes, buf.written
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--threads', type=int, default=4, help='request threads per worker (gthread)')
+    ap.add_argument('--batch-size', type=int, default=200)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'legacy.db')
+        db.init_db()
+        legacy = run_legacy(args.seconds, args.threads)
+        print(f'per-reading visit rows : {legacy:10.0f} samples/s (1 commit per sample)')
+
+        db.DB_PATH = os.path.join(tmp, 'samples.db')
+        db.init_db()
+        rate, flushes, written = run_buffered(args.seconds, args.threads, args.batch_size)
+        print(f'buffered vitals_samples: {rate:10.0f} samples/s '
+              f'({written} samples in {flushes} commits, {written / max(flushes, 1):.0f}/commit)')
+        db.close_conn()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Check the camera lifecycle with a fake VideoCapture (no hardware needed).
+
+Verifies that the device is opened on the first owner, that capture is paced
+to the subscribed stream's frame rate, that frames are swapped in without a
+copy, and that after the idle timeout the device is released and process CPU
+drops to near zero. Also restarts the camera while the idle-expired capture
+thread is still releasing the device: the device must never be open twice.
+
+    python scripts/check_camera_idle.py --idle-timeout 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import camera as camera_module  # noqa: E402
+from photos import photo_writer  # noqa: E402
+
+
+class FakeCapture:
+    """Returns a new frame immediately on every read, like a device with no
+    blocking of its own, so any pacing comes from the capture loop"""
+
+    instances = []
+    open_now = 0
+    max_open = 0
+    release_delay = 0.0
+
+    def __init__(self, *_args):
+        self.reads = 0
+        self.released = False
+        self.last = None
+        FakeCapture.instances.append(self)
+        FakeCapture.open_now += 1
+        FakeCapture.max_open = max(FakeCapture.max_open, FakeCapture.open_now)
+
+    def isOpened(self):
+        return True
+
+    def set(self, *_args):
+        return True
+
+    def read(self):
+        self.reads += 1
+        self.last = np.full((480, 640, 3), self.reads % 255, dtype=np.uint8)
+        return True, self.last
+
+    def release(self):
+        time.sleep(FakeCapture.release_delay)
+        FakeCapture.open_now -= 1
+        self.released = True
+
+
+def cpu_percent(seconds: float) -> float:
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    time.sleep(seconds)
+    return (time.process_time() - cpu0) / (time.monotonic() - wall0) * 100
+
+
+def watch(cam, stream, stop):
+    # What /camera/video_feed does for one viewer
+    cam.acquire()
+    gen = camera_module.generate_frames(stream)
+    try:
+        for _ in gen:
+            if stop.is_set():
+                break
+    finally:
+        gen.close()
+        cam.release()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--idle-timeout', type=float, default=1.0)
+    ap.add_argument('--seconds', type=float, default=2.0, help='length of each measurement')
+    args = ap.parse_args()
+
+    camera_module.cv2.VideoCapture = FakeCapture
+    photo_writer.directory = tempfile.mkdtemp()
+    cam = camera_module.Camera(idle_timeout=args.idle_timeout)
+    camera_module.camera = cam
+    failures = []
+
+    def check(ok, message):
+        print(('✅ ' if ok else '❌ ') + message)
+        if not ok:
+            failures.append(message)
+
+    for stream in ('full', 'thumb'):
+        stop = threading.Event()
+        viewer = threading.Thread(target=watch, args=(cam, stream, stop))
+        viewer.start()
+        time.sleep(0.3)
+        cap = FakeCapture.instances[-1]
+        reads0 = cap.reads
+        busy = cpu_percent(args.seconds)
+        fps = (cap.reads - reads0) / args.seconds
+        target = camera_module.STREAM_VARIANTS[stream]['max_fps']
+        check(abs(fps - target) <= target * 0.2 + 1, f'{stream}: captured {fps:.1f} fps (target {target}), {busy:.1f}% CPU')
+        check(cam.frame is cap.last, f'{stream}: latest frame is the array read() returned (no copy)')
+        stop.set()
+        viewer.join()
+
+    check(cam.running and cam.owners == 0, 'camera keeps running during the idle grace period')
+    time.sleep(args.idle_timeout + 0.5)
+    cap = FakeCapture.instances[-1]
+    check(not cam.running and cap.released, 'camera released after the idle timeout')
+    reads0 = cap.reads
+    idle = cpu_percent(args.seconds)
+    check(cap.reads == reads0 and idle < 2.0, f'idle: {cap.reads - reads0} reads, {idle:.2f}% CPU')
+
+    cam.acquire()
+    try:
+        filename = cam.take_picture(filename='check_camera_idle.jpg')
+    finally:
+        cam.release()
+    check(filename is not None and len(FakeCapture.instances) == 2, 'photo capture restarts the camera and gets a frame')
+    if filename:
+        check(photo_writer.wait(filename) == 'done', 'photo written by the background writer')
+    time.sleep(args.idle_timeout + 0.5)
+    check(not cam.running and FakeCapture.instances[-1].released, 'camera released again after the photo')
+
+    # Reopen in the gap between the idle expiry and the device release
+    FakeCapture.release_delay = 0.3
+    cam.acquire()
+    cam.release()
+    while cam.running:
+        time.sleep(0.001)
+    cam.acquire()
+    cam.release()
+    check(FakeCapture.max_open == 1 and FakeCapture.instances[-2].released,
+          f'restart during the idle release waits for it: device open at most {FakeCapture.max_open}x at once')
+    cam.stop()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Multi-process delivery check for the SSE event bus (events.py).
+
+Starts --workers processes against one scratch database, the way gunicorn
+runs workers. Each process subscribes, then publishes --events events, then
+reads until it has seen every worker's events. The check fails unless every
+process receives every event exactly once, in the same order, with
+increasing ids. It then checks Last-Event-ID replay and retention on the bus
+and through /events/patients:
+
+- a reconnect gets exactly the events it missed
+- a reconnect from beyond the retained window gets a reset
+- an event posted by another process reaches a streaming client
+- bursts coalesce, slow or stalled subscribers are evicted, and idle
+  streams get heartbeats and then close
+
+    python scripts/check_event_bus.py
+    python scripts/check_event_bus.py --workers 4 --events 500
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+import events  # noqa: E402
+
+
+def worker(path, wid, count, total, barrier, results):
+    db.DB_PATH = path
+    bus = events.SQLiteEventBus(poll_interval=0.05)
+    sub = bus.subscribe()
+    # Delivery, not backpressure: room for everything, and an event type
+    # that is never coalesced
+    sub.max_queue = total
+    barrier.wait()
+    for n in range(count):
+        bus.publish('delivery_check', {'worker': wid, 'n': n, 'sent': time.time()})
+    seen, lags = [], []
+    deadline = time.monotonic() + 30
+    while len(seen) < total and time.monotonic() < deadline:
+        ev = sub.get(timeout=1)
+        if ev is not None:
+            data = json.loads(ev.data)
+            seen.append((ev.id, data['worker'], data['n']))
+            lags.append(time.time() - data['sent'])
+    results.put((wid, seen, lags))
+
+
+def publish_later(path, delay):
+    db.DB_PATH = path
+    time.sleep(delay)
+    events.SQLiteEventBus().publish('patient_archived', {'stored_id': 99, 'sent': time.time()})
+
+
+def check_processes(path, workers, count):
+    ctx = mp.get_context('spawn')
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    total = workers * count
+    procs = [ctx.Process(target=worker, args=(path, w, count, total, barrier, results)) for w in range(workers)]
+    for p in procs:
+        p.start()
+    got = [results.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+    reference = None
+    ok = True
+    for wid, seen, lags in sorted(got):
+        ids = [s[0] for s in seen]
+        in_order = all(a < b for a, b in zip(ids, ids[1:]))
+        complete = len(set(seen)) == total == len(seen)
+        reference = reference or seen
+        same = seen == reference
+        ok &= in_order and complete and same
+        lags.sort()
+        p99 = lags[int(len(lags) * 0.99) - 1] * 1000 if lags else float('nan')
+        print(f"{'✅' if in_order and complete and same else '❌'} worker {wid}: {len(seen)}/{total} events, "
+              f"ordered={in_order} same-order={same}, "
+              f"delivery p50 {statistics.median(lags) * 1000 if lags else 0:.1f} ms p99 {p99:.1f} ms")
+    return ok
+
+
+def check_replay(path):
+    bus = events.SQLiteEventBus(retention=50)
+    first = bus.publish('hello_test', {'n': 0})
+    ids = [bus.publish('delivery_check', {'n': n}) for n in range(1, 40)]
+    sub = bus.subscribe(ids[19])
+    backlog = [e.id for e in sub.drain_backlog()]
+    sub.close()
+    ok = backlog == ids[20:] and not sub.reset
+    print(f"{'✅' if ok else '❌'} replay after id {ids[19]}: {len(backlog)} events, reset={sub.reset}")
+
+    for n in range(100):
+        bus.publish('patient_added', {'n': n})
+    bus.prune()
+    sub = bus.subscribe(first)
+    gap_ok = sub.reset and not sub.drain_backlog() and sub.last_id == bus.head()
+    sub.close()
+    print(f"{'✅' if gap_ok else '❌'} replay from a pruned id: reset={sub.reset}, resumes at {sub.last_id}")
+    return ok and gap_ok
+
+
+def check_backpressure():
+    bus = events.LocalEventBus()
+    ok = True
+    idle = bus.subscribe()
+    for n in range(5000):
+        bus.publish('patient_added', {'id': n})
+    ev = idle.get(timeout=0)
+    burst_ok = idle.depth() == 0 and ev.event == events.REFRESH and \
+        json.loads(ev.data) == {'events': {'patient_added': 5000}}
+    ok &= burst_ok
+    print(f"{'✅' if burst_ok else '❌'} 5000 patient_added to an idle tab: one {ev.event} hint {ev.data}")
+    idle.close()
+
+    slow = bus.subscribe()
+    for n in range(events.QUEUE_MAX + 1):
+        bus.publish('camera_note' if n % 2 else 'patient_added', {'n': n})
+    evicted_ok = slow.evicted and slow.depth() == 0 and slow.get(timeout=0) is None and \
+        slow not in bus._subs
+    ok &= evicted_ok
+    print(f"{'✅' if evicted_ok else '❌'} {events.QUEUE_MAX + 1} uncoalescible events to a slow tab: "
+          f"evicted={slow.evicted}, depth {slow.depth()}")
+
+    stuck = bus.subscribe()
+    stuck._returned -= events.STALL_SECONDS + 1  # consumer never came back
+    bus.publish('camera_note')
+    ok &= stuck.evicted
+    print(f"{'✅' if stuck.evicted else '❌'} stalled consumer evicted on the next event")
+
+    lines = events.sse_stream(bus.subscribe(), heartbeat=0.05, idle_timeout=0.3)
+    frames = list(lines)
+    pings = sum(f.startswith(':') for f in frames)
+    timing_ok = frames[0].startswith('retry:') and pings >= 3 and bus.subscriber_count() == 0
+    ok &= timing_ok
+    stats = bus.stats()
+    print(f"{'✅' if timing_ok else '❌'} idle stream: {pings} heartbeats, then closed after 0.3 s")
+    print(f"   stats: {stats}")
+    return ok
+
+
+def read_events(chunks, want):
+    """Parse SSE frames from a streaming response until ``want`` arrived"""
+    frames, buf = [], ''
+    while len(frames) < want:
+        buf += next(chunks).decode()
+        while '\n\n' in buf:
+            frame, buf = buf.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in frame.splitlines() if ': ' in line)
+            frames.append(fields)
+    return frames
+
+
+def check_http(path):
+    import app as app_module
+    client = app_module.app.test_client()
+    with client.session_transaction() as s:
+        s['hospital_ok'] = True
+    head = app_module.event_bus.head()
+    sent = [app_module.event_bus.publish('patient_added', {'n': n}) for n in range(3)]
+    resp = client.get('/events/patients', headers={'Last-Event-ID': str(head)}, buffered=False)
+    chunks = iter(resp.response)
+    frames = read_events(chunks, 2)
+    # The three missed intakes come back as one refresh hint
+    replay_ok = [f.get('event') for f in frames] == ['hello', 'refresh'] and int(frames[1]['id']) == sent[-1]
+    print(f"{'✅' if replay_ok else '❌'} /events/patients with Last-Event-ID: "
+          f"{[(f.get('id'), f.get('event')) for f in frames]}")
+    proc = mp.get_context('spawn').Process(target=publish_later, args=(path, 0.2))
+    proc.start()
+    live = read_events(chunks, 1)
+    lag = time.time() - json.loads(live[0]['data'])['sent']
+    proc.join()
+    resp.close()
+    live_ok = live[0].get('event') == 'patient_archived'
+    print(f"{'✅' if live_ok else '❌'} event from another process reached the stream "
+          f"{lag * 1000:.0f} ms after it was published")
+    return replay_ok and live_ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--workers', type=int, default=3)
+    ap.add_argument('--events', type=int, default=200, help='events published by each worker')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'events.db')
+        db.init_db()
+        ok = check_processes(db.DB_PATH, args.workers, args.events)
+        ok &= check_replay(db.DB_PATH)
+        ok &= check_backpressure()
+        ok &= check_http(db.DB_PATH)
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Check that incremental exports (/export.csv?since=) never lose or repeat a visit.
+
+Visits are stamped with second resolution, so several intakes share a
+timestamp. The script exports a scratch database, then adds visits stamped
+in the same second as the last exported one (and later ones), and pulls
+again from the X-Export-Cursor of the first export: it must get exactly the
+new visits. An ISO 'T'/'Z' timestamp must select the same rows as the stored
+'YYYY-MM-DD HH:MM:SS' form, and a malformed ?since= must be rejected.
+
+    python scripts/check_incremental_export.py
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+
+def add_visits(names, ts):
+    with db.get_conn() as conn:
+        conn.executemany("INSERT INTO patients (name, created_at) VALUES (?, ?)", [(n, ts) for n in names])
+
+
+def export(client, since=None):
+    resp = client.get('/export.csv', query_string={'since': since} if since else None)
+    if resp.status_code != 200:
+        return resp.status_code, None, []
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    return resp.status_code, resp.headers.get('X-Export-Cursor'), [r['name'] for r in rows]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SENSOR_DEVICE_DIR'] = os.path.join(tmp, 'devices')
+        os.environ['SENSOR_STATE_PATH'] = os.path.join(tmp, 'sensor_state.bin')
+        db.DB_PATH = os.path.join(tmp, 'export.db')
+        import app as app_module
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s['hospital_ok'] = True
+            s['doctor_ok'] = True
+
+        add_visits(['a1', 'a2'], '2024-05-01 08:00:00')
+        add_visits(['b1', 'b2'], '2024-05-01 08:00:05')
+        _status, cursor, first = export(client)
+        # Same second as the last exported visit, then a later one
+        add_visits(['b3', 'b4'], '2024-05-01 08:00:05')
+        add_visits(['c1'], '2024-05-01 08:00:09')
+        _status, next_cursor, second = export(client, cursor)
+        _status, _cursor, third = export(client, next_cursor)
+        ok = sorted(first) == ['a1', 'a2', 'b1', 'b2'] and second == ['b3', 'b4', 'c1'] and third == []
+        print(f"{'✅' if ok else '❌'} full export {first} (cursor {cursor}); "
+              f"since cursor {second}; since {next_cursor} {third}")
+
+        plain = export(client, '2024-05-01 08:00:05')[2]
+        iso = export(client, '2024-05-01T08:00:05Z')[2]
+        offset = export(client, '2024-05-01T10:00:05+02:00')[2]
+        same = plain == iso == offset == ['b1', 'b2', 'b3', 'b4', 'c1']
+        ok &= same
+        print(f"{'✅' if same else '❌'} since as stored/ISO Z/ISO offset timestamp: {plain} / {iso} / {offset}")
+
+        codes = [export(client, bad)[0] for bad in ('yesterday', '2024-05-01 08:00:05,x', '2024-13-01')]
+        rejected = codes == [400, 400, 400]
+        ok &= rejected
+        print(f"{'✅' if rejected else '❌'} malformed since rejected: {codes}")
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
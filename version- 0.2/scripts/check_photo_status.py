@@ -0,0 +1,69 @@
+"""Check /photo_status for photos written by another worker.
+
+Two PhotoWriter instances share one uploads directory, like two gunicorn
+workers. A photo written by the first must read as done from the second
+(which never saw it queued), for sharded content names (ab/cd/<sha256>.jpg)
+and legacy flat names alike, while names outside the directory stay unknown.
+
+A photo whose file is older than the GC grace period and referenced by
+nothing is then uploaded again with the same bytes (a deduplicated write):
+it must read as done and collect_garbage must keep it.
+
+    python scripts/check_photo_status.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import photos  # noqa: E402
+
+
+def check_reupload(uploads: str, writer: photos.PhotoWriter) -> bool:
+    data = b'\xff\xd8 orphaned photo'
+    name = writer.submit_bytes(data)
+    writer.join()
+    path = os.path.join(uploads, name)
+    old = time.time() - 2 * photos.GC_GRACE_SECONDS
+    os.utime(path, (old, old))
+    again = writer.submit_bytes(data)
+    writer.join()
+    state = writer.get_status(again)['status']
+    stats = photos.collect_garbage([], uploads)
+    kept = os.path.isfile(path)
+    ok = again == name and state == photos.DONE and kept and writer.stats()['deduplicated'] == 1
+    print(f"{'✅' if ok else '❌'} old orphan uploaded again: {state}, kept by GC={kept}; gc {stats}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uploads = os.path.join(tmp, 'uploads')
+        first, second = photos.PhotoWriter(uploads, threads=1), photos.PhotoWriter(uploads, threads=1)
+        frame = np.full((48, 64, 3), 7, np.uint8)
+        names = [first.submit_frame(frame), first.submit_bytes(b'\xff\xd8 legacy jpeg', photos.new_filename())]
+        first.join()
+        ok = True
+        for name in names:
+            state = second.get_status(name)['status']
+            ok &= state == photos.DONE
+            print(f"{'✅' if state == photos.DONE else '❌'} {name} written by another worker: {state}")
+        with open(os.path.join(tmp, 'outside.jpg'), 'wb') as f:
+            f.write(b'x')
+        for name in ('../outside.jpg', 'ab/../../outside.jpg', '/etc/passwd'):
+            state = second.get_status(name)['status']
+            ok &= state == 'unknown'
+            print(f"{'✅' if state == 'unknown' else '❌'} {name}: {state}")
+        ok &= check_reupload(uploads, second)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Check that profile_stats matches an aggregate recomputed from the visit tables.
+
+profile_stats (visit_count, current_visits, last_visit, visit_photo) is kept
+current by triggers on patients and stored_patients. This recomputes the same
+values from scratch with a plain GROUP BY and reports any profile that
+differs. --exercise runs a random mix of intakes, archiving, edits and
+deletes against a scratch database first, so the triggers themselves are
+what gets checked. --repair rebuilds the table from the visit tables.
+
+    python scripts/check_profile_stats.py
+    python scripts/check_profile_stats.py --exercise 5000
+    python scripts/check_profile_stats.py --repair
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+EXPECTED = """
+    SELECT profile_id, ts, photo, cur FROM (
+        SELECT profile_id, created_at AS ts, photo, 1 AS cur FROM patients WHERE profile_id IS NOT NULL
+        UNION ALL
+        SELECT profile_id, archived_at, photo, 0 FROM stored_patients WHERE profile_id IS NOT NULL
+    )
+"""
+
+
+def mismatches(conn):
+    expected = {}
+    for r in conn.execute(EXPECTED):
+        e = expected.setdefault(r['profile_id'], {'visit_count': 0, 'current_visits': 0, 'last_visit': None,
+                                                  'photo_ts': None, 'photos': set()})
+        e['visit_count'] += 1
+        e['current_visits'] += r['cur']
+        if r['ts'] is not None and (e['last_visit'] is None or r['ts'] > e['last_visit']):
+            e['last_visit'] = r['ts']
+        if r['photo'] and r['ts'] is not None:
+            # Visits stamped in the same second are equally "newest"
+            if e['photo_ts'] is None or r['ts'] > e['photo_ts']:
+                e['photo_ts'], e['photos'] = r['ts'], {r['photo']}
+            elif r['ts'] == e['photo_ts']:
+                e['photos'].add(r['photo'])
+    actual = {r['profile_id']: dict(r) for r in conn.execute('SELECT * FROM profile_stats')}
+    bad = []
+    for pid in set(expected) | set(actual):
+        e, a = expected.get(pid), actual.get(pid)
+        if e is None:
+            if a['visit_count'] or a['current_visits'] or a['last_visit'] or a['visit_photo']:
+                bad.append((pid, 'stats for a profile without visits', a))
+            continue
+        if a is None:
+            bad.append((pid, 'missing', e))
+            continue
+        for col in ('visit_count', 'current_visits', 'last_visit'):
+            if e[col] != a[col]:
+                bad.append((pid, col, (e[col], a[col])))
+        if (a['visit_photo'] not in e['photos']) if e['photos'] else a['visit_photo'] is not None:
+            bad.append((pid, 'visit_photo', (sorted(e['photos']), a['visit_photo'])))
+    return bad
+
+
+def exercise(ops: int, seed: int) -> None:
+    rng = random.Random(seed)
+    profiles = [db.create_patient_profile({'name': f'Stats {i}'}) for i in range(max(10, ops // 50))]
+    visit_cols = 23
+    for n in range(ops):
+        op = rng.random()
+        pid = rng.choice(profiles)
+        with db.get_conn() as conn:
+            current = [r['id'] for r in conn.execute('SELECT id FROM patients ORDER BY RANDOM() LIMIT 1')]
+            stored = [r['id'] for r in conn.execute('SELECT id FROM stored_patients ORDER BY RANDOM() LIMIT 1')]
+        if op < 0.45:
+            photo = rng.choice([None, '', f'photo_{n}.jpg'])
+            db.insert_patient((pid, photo) + (None,) * (visit_cols - 2))
+        elif op < 0.65 and current:
+            db.store_patient(current[0])
+        elif op < 0.72 and current:
+            db.update_patient(current[0], {'photo': rng.choice([None, f'edit_{n}.jpg'])})
+        elif op < 0.78 and current:
+            with db.get_conn() as conn:
+                conn.execute('UPDATE patients SET profile_id = ? WHERE id = ?', (rng.choice(profiles + [None]), current[0]))
+        elif op < 0.83 and stored:
+            with db.get_conn() as conn:
+                conn.execute("UPDATE stored_patients SET archived_at = datetime(archived_at, '+1 day') WHERE id = ?",
+                             (stored[0],))
+        elif op < 0.90 and current:
+            db.delete_patient(current[0])
+        elif op < 0.96 and stored:
+            db.delete_stored(stored[0])
+        elif op < 0.97:
+            # Same statements as /doctor/delete_profile
+            with db.get_conn() as conn:
+                conn.execute('DELETE FROM patients WHERE profile_id = ?', (pid,))
+                conn.execute('DELETE FROM stored_patients WHERE profile_id = ?', (pid,))
+                conn.execute('DELETE FROM patient_profiles WHERE id = ?', (pid,))
+            profiles.remove(pid)
+            profiles.append(db.create_patient_profile({'name': f'Stats new {n}'}))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--exercise', type=int, default=0, help='random operations on a scratch database first')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--repair', action='store_true', help='rebuild profile_stats if it differs')
+    args = ap.parse_args()
+
+    tmp = None
+    if args.exercise:
+        tmp = tempfile.TemporaryDirectory()
+        db.DB_PATH = os.path.join(tmp.name, 'stats.db')
+    db.init_db()
+    if args.exercise:
+        exercise(args.exercise, args.seed)
+    conn = db.get_conn()
+    bad = mismatches(conn)
+    rows = conn.execute('SELECT COUNT(*) FROM profile_stats').fetchone()[0]
+    for pid, what, detail in bad[:20]:
+        print(f'❌ profile {pid}: {what} {detail}')
+    if bad and args.repair:
+        with conn:
+            db.rebuild_profile_stats(conn)
+        print(f'🔧 rebuilt profile_stats; {len(mismatches(conn))} mismatches remain')
+    elif not bad:
+        print(f'✅ profile_stats consistent ({rows} profiles)')
+    if tmp:
+        tmp.cleanup()
+    sys.exit(1 if bad and not args.repair else 0)
+
+
+if __name__ == '__main__':
+    main()
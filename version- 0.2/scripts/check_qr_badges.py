@@ -0,0 +1,64 @@
+"""Check that badge sheets rendered by the worker pool carry this database's QR codes.
+
+A scratch database gets --count profiles. The badges are rendered once in
+this process and once across --workers pool processes; every tile must be
+identical, so the pool signs nothing with another database's key. The
+default database (app.db) must not change, and every payload must verify
+against the scratch database.
+
+    python scripts/check_qr_badges.py --count 40 --workers 2
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import badges  # noqa: E402
+import db  # noqa: E402
+
+
+def digest(path: str) -> str:
+    if not os.path.exists(path):
+        return 'missing'
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--count', type=int, default=40, help='profiles (more than one sheet uses the pool)')
+    ap.add_argument('--workers', type=int, default=2)
+    args = ap.parse_args()
+    if not badges.available():
+        sys.exit('Pillow is not installed; badge sheets are unavailable')
+
+    default_db = db.DB_PATH
+    before = digest(default_db)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'badges.db')
+        db.init_db()
+        with db.get_conn() as conn:
+            conn.executemany("INSERT INTO patient_profiles (name, age, gender) VALUES (?, ?, ?)",
+                             [(f'Badge Patient {i}', 20 + i % 60, 'FM'[i % 2]) for i in range(args.count)])
+        profiles = list(badges._profiles(None, None))
+        local = list(badges._tiles(iter(profiles), workers=1))
+        pooled = list(badges._tiles(iter(profiles), workers=args.workers))
+        same = len(local) == len(pooled) == args.count and local == pooled
+        print(f"{'✅' if same else '❌'} {len(pooled)} badges from {args.workers} pool workers match "
+              f"{len(local)} rendered in-process")
+
+        verified = sum(db.parse_compact_qr(p[4]) == p[0] for p in profiles) if db.QR_FORMAT == 'compact' \
+            else len(profiles)
+        signed = verified == len(profiles)
+        print(f"{'✅' if signed else '❌'} {verified}/{len(profiles)} payloads verify against the scratch database")
+        db.close_conn()
+    untouched = digest(default_db) == before
+    print(f"{'✅' if untouched else '❌'} default database {os.path.basename(default_db)} "
+          f"{'untouched' if untouched else 'was modified'}")
+    sys.exit(0 if same and signed and untouched else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Query-plan regression check for the hot visit/profile queries.
+
+Seeds a scratch database (1M visits by default) through db.init_db(), runs
+EXPLAIN QUERY PLAN on every hot query used by db.py and app.py and exits
+non-zero if any of them falls back to a full table scan or sorts a LIMITed
+result in a temporary B-tree.
+
+    python scripts/check_query_plans.py            # 1M visits
+    python scripts/check_query_plans.py --rows 50000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+# name -> (sql, params, tables allowed to be scanned via an index, limited)
+# 'limited' queries must come out in index order without a temp B-tree sort.
+HOT_QUERIES = {
+    'get_profile_visits.current': (
+        "SELECT *, 'current' AS source FROM patients WHERE profile_id = ? ORDER BY created_at DESC, id DESC",
+        (42,), set(), True,
+    ),
+    'get_profile_visits.archived': (
+        "SELECT *, 'archived' AS source FROM stored_patients WHERE profile_id = ? ORDER BY archived_at DESC, id DESC",
+        (42,), set(), True,
+    ),
+    'sensor.latest_for_profile': (
+        "SELECT heart_rate, spo2, body_temp_f, env_temp_f, humidity_percent, weight_kg, datetime(created_at) AS ts "
+        "FROM patients WHERE profile_id = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+        (42,), set(), True,
+    ),
+    'sensor.latest': (
+        "SELECT heart_rate, spo2, body_temp_f, env_temp_f, humidity_percent, weight_kg, datetime(created_at) AS ts "
+        "FROM patients ORDER BY created_at DESC, id DESC LIMIT 1",
+        (), {'patients'}, True,
+    ),
+    'query_patients.recent': (
+        "SELECT * FROM patients ORDER BY created_at DESC, id DESC LIMIT 25",
+        (), {'patients'}, True,
+    ),
+    'query_stored.recent': (
+        "SELECT * FROM stored_patients ORDER BY archived_at DESC, id DESC LIMIT 25",
+        (), {'stored_patients'}, True,
+    ),
+    'get_or_create_profile.lookup': (
+        "SELECT id FROM patient_profiles WHERE COALESCE(name,'') = ? AND COALESCE(contact,'') = ?",
+        ('Patient 42', '555-0042'), set(), False,
+    ),
+    'verify_patient_login': (
+        "SELECT * FROM patient_profiles WHERE username = ? AND patient_id_number = ?",
+        ('user42', 'pid42'), set(), False,
+    ),
+    # What the profile_stats triggers run for each visit insert/archive/delete
+    'profile_stats.refresh': (
+        db._PROFILE_STATS_ROW.format(pid='?'),
+        (42,) * db._PROFILE_STATS_ROW.count('{pid}'), set(), False,
+    ),
+    'profile_directory.stats_join': (
+        "SELECT pp.*, ps.visit_count, ps.last_visit, ps.visit_photo FROM patient_profiles pp"
+        " LEFT JOIN profile_stats ps ON ps.profile_id = pp.id ORDER BY pp.created_at DESC LIMIT 50",
+        (), {'pp'}, True,
+    ),
+    # /api/profiles keyset pages (db.page_profiles)
+    'page_profiles.name': (
+        "SELECT pp.id, pp.name FROM patient_profiles pp LEFT JOIN profile_stats ps ON ps.profile_id = pp.id"
+        " WHERE COALESCE(pp.name, '') >= ? AND (COALESCE(pp.name, ''), pp.id) > (?, ?)"
+        " ORDER BY COALESCE(pp.name, '') ASC, pp.id ASC LIMIT 51",
+        ('Patient 42', 'Patient 42', 42), {'pp'}, True,
+    ),
+    'page_profiles.last_visit': (
+        "SELECT pp.id, ps.last_visit FROM profile_stats ps JOIN patient_profiles pp ON pp.id = ps.profile_id"
+        " WHERE COALESCE(ps.last_visit, '') <= ? AND (COALESCE(ps.last_visit, ''), ps.profile_id) < (?, ?)"
+        " ORDER BY COALESCE(ps.last_visit, '') DESC, ps.profile_id DESC LIMIT 51",
+        ('2030-01-01 00:00:00', '2030-01-01 00:00:00', 42), {'ps'}, True,
+    ),
+    'page_profiles.visits': (
+        "SELECT pp.id, ps.visit_count FROM profile_stats ps JOIN patient_profiles pp ON pp.id = ps.profile_id"
+        " ORDER BY ps.visit_count DESC, ps.profile_id DESC LIMIT 51",
+        (), {'ps'}, True,
+    ),
+    'profile_changes': (
+        "SELECT pv.seq, pp.id FROM profile_versions pv LEFT JOIN patient_profiles pp ON pp.id = pv.profile_id"
+        " LEFT JOIN profile_stats ps ON ps.profile_id = pv.profile_id WHERE pv.seq > ? ORDER BY pv.seq LIMIT 201",
+        (1000,), set(), True,
+    ),
+}
+
+
+def seed(conn, rows: int) -> None:
+    profiles = max(1, rows // 10)
+    archived = rows // 5
+    rnd = random.Random(1234)
+    conn.executemany(
+        "INSERT INTO patient_profiles(name, contact, username, patient_id_number, created_at) VALUES (?,?,?,?,?)",
+        ((f'Patient {i}', f'555-{i:04d}', f'user{i}', f'pid{i}',
+          f'2024-{1 + i % 12:02d}-{1 + i % 28:02d} 08:00:00') for i in range(1, profiles + 1)),
+    )
+
+    def visits(n):
+        for i in range(n):
+            pid = rnd.randint(1, profiles)
+            ts = f'2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i * 7) % 60:02d}'
+            yield (pid, f'p{i}.jpg' if i % 3 == 0 else None, f'Patient {pid}', 40, 'headache', 72.0, 98.0, ts)
+
+    conn.executemany(
+        "INSERT INTO patients(profile_id, photo, name, age, chief_complaint, heart_rate, spo2, created_at)"
+        " VALUES (?,?,?,?,?,?,?,?)",
+        visits(rows),
+    )
+    conn.executemany(
+        "INSERT INTO stored_patients(profile_id, photo, name, age, chief_complaint, heart_rate, spo2, created_at, archived_at)"
+        " VALUES (?,?,?,?,?,?,?,?,?)",
+        (v + (v[-1],) for v in visits(archived)),
+    )
+    conn.commit()
+    conn.execute('ANALYZE')
+
+
+def check(conn) -> int:
+    failures = 0
+    for name, (sql, params, index_scans, limited) in HOT_QUERIES.items():
+        plan = [r['detail'] for r in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        problems = []
+        for detail in plan:
+            if detail.startswith('SCAN ') and not detail.startswith(('SCAN (', 'SCAN CONSTANT ROW')):
+                table = detail.split()[1]
+                via_index = ' USING ' in detail and 'INDEX' in detail
+                if not via_index or table not in index_scans:
+                    problems.append(detail)
+            if limited and 'TEMP B-TREE' in detail and 'ORDER BY' in detail:
+                problems.append(detail)
+        status = 'FAIL' if problems else 'ok'
+        print(f'[{status:>4}] {name}')
+        for detail in plan:
+            print(f'         {detail}')
+        failures += bool(problems)
+    return failures
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--rows', type=int, default=1_000_000, help='visits to seed into patients')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'plans.db')
+        db.init_db()
+        conn = db.get_conn()
+        started = time.monotonic()
+        seed(conn, args.rows)
+        print(f'Seeded {args.rows} visits in {time.monotonic() - started:.1f}s (schema v{db.SCHEMA_VERSION})')
+        failures = check(conn)
+        db.close_conn()
+    print('All hot queries use indexes.' if not failures else f'{failures} query plan(s) regressed.')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Check the ESP32 serial reader (sensor.py) against a fake ESP32 on a pty.
+
+A pseudo-terminal stands in for the USB serial port. The script checks:
+
+- idle CPU: the reader sits on a silent port for --seconds, next to the old
+  `while True: if ser.in_waiting > 0:` loop on a second port
+- parsing: JSON: and DATA_CSV: lines, noise and lines split across writes
+  all reach a scratch sensor_state exactly as sent
+- reconnect: the port vanishes (ESP32 unplugged) and comes back under the
+  same path, and readings resume
+- one reading process: while this process holds the serial lock, another
+  process (a second gunicorn worker) cannot claim it
+
+    python scripts/check_serial_reader.py --seconds 5
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import sensor  # noqa: E402
+from sensor_state import SharedSensorState  # noqa: E402
+
+
+class FakeESP32:
+    """A pty whose slave end is reachable at a stable symlink, like /dev/ttyUSB0"""
+
+    def __init__(self, link: str):
+        self.link = link
+        self.plug()
+
+    def plug(self) -> None:
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        tmp = self.link + '.new'
+        os.symlink(os.ttyname(self.slave), tmp)
+        os.replace(tmp, self.link)
+
+    def unplug(self) -> None:
+        os.unlink(self.link)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def send(self, data: bytes) -> None:
+        os.write(self.master, data)
+
+
+def wait_for(cond, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def cpu_percent(seconds: float) -> float:
+    started, cpu = time.monotonic(), time.process_time()
+    time.sleep(seconds)
+    return (time.process_time() - cpu) / (time.monotonic() - started) * 100
+
+
+def legacy_loop(port: str, stop: threading.Event) -> None:
+    """The reader app.py used to run (minus the prints)"""
+    ser = sensor.serial.Serial(port, sensor.BAUD_RATE, timeout=1)
+    while not stop.is_set():
+        if ser.in_waiting > 0:
+            ser.readline()
+    ser.close()
+
+
+def try_claim(path: str, out) -> None:
+    out.put(sensor.claim_serial_lock(path))
+
+
+def check_single_reader(tmp: str) -> bool:
+    path = os.path.join(tmp, 'serial.lock')
+    ctx = mp.get_context('spawn')
+    out = ctx.Queue()
+    mine = sensor.claim_serial_lock(path)
+    worker = ctx.Process(target=try_claim, args=(path, out))
+    worker.start()
+    theirs = out.get(timeout=30)
+    worker.join()
+    ok = mine and not theirs
+    print(f"{'✅' if ok else '❌'} serial lock: this process {mine}, a second worker {theirs}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--seconds', type=float, default=5.0, help='idle measurement length')
+    args = ap.parse_args()
+    if not sensor.available():
+        sys.exit('pyserial is not installed')
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        state = SharedSensorState(os.path.join(tmp, 'sensor_state.bin'), capacity=256)
+        esp = FakeESP32(os.path.join(tmp, 'ttyESP32'))
+        sensor.BACKOFF_MIN = 0.1
+        reader = sensor.SerialReader(esp.link, on_reading=lambda r: state.publish(**r))
+        reader.start()
+        if not wait_for(lambda: reader.connected, 5):
+            sys.exit('❌ reader never connected to the pty')
+
+        idle = cpu_percent(args.seconds)
+        old_esp, stop = FakeESP32(os.path.join(tmp, 'ttyOld')), threading.Event()
+        old = threading.Thread(target=legacy_loop, args=(old_esp.link, stop), daemon=True)
+        old.start()
+        busy = cpu_percent(args.seconds)
+        stop.set()
+        old.join()
+        old_esp.unplug()
+        idle_ok = idle < 2.0
+        ok &= idle_ok
+        print(f"{'✅' if idle_ok else '❌'} idle port: reader {idle:.2f}% CPU; "
+              f"old in_waiting loop {busy:.0f}% CPU")
+
+        sent = 0
+        for n in range(500):
+            if n % 2:
+                reading = {'temperature': 36.5, 'heartRate': 60 + n % 40, 'spo2': 97, 'weight': 70.2,
+                           'envTemperature': 24.0, 'humidity': 40, 'status': 'normal', 'measurements': n}
+                line = b'JSON:' + json.dumps(reading).encode() + b'\r\n'
+            else:
+                line = f'DATA_CSV:24.1,41,36.9,71.5,120,{60 + n % 40},98\r\n'.encode()
+            # Split each line across two writes, as a UART often does
+            esp.send(line[:7])
+            esp.send(line[7:])
+            sent += 1
+            if n % 50 == 0:
+                esp.send(b'Booting sensor...\r\nDATA_CSV:1,2\r\nJSON:{broken\r\n')
+        esp.send(b'JSON:{"temperature": 37.2, "heartRate": 88, "spo2": 95, "weight": 65, '
+                 b'"envTemperature": 22, "humidity": 55, "status": "fever", "measurements": 9}\n')
+        sent += 1
+        parsed_ok = wait_for(lambda: reader.readings == sent, 10)
+        snap = state.snapshot()
+        values_ok = (snap['temperature'], snap['heart_rate'], snap['status'], snap['measurements']) == \
+            (37.2, 88, 'fever', 9)
+        ok &= parsed_ok and values_ok
+        print(f"{'✅' if parsed_ok and values_ok else '❌'} {reader.readings}/{sent} readings published, "
+              f"{reader.ignored} noise lines ignored; latest {snap['temperature']}°C {snap['heart_rate']} bpm "
+              f"status={snap['status']}")
+
+        esp.unplug()
+        gone = wait_for(lambda: not reader.connected, 5)
+        time.sleep(1.0)  # a few failed reopen attempts, backing off
+        esp.plug()
+        started = time.monotonic()
+        back = wait_for(lambda: reader.connected, 10)
+        esp.send(b'DATA_CSV:24,40,36.6,70,100,75,99\n')
+        resumed = wait_for(lambda: reader.readings == sent + 1, 5)
+        ok &= gone and back and resumed
+        print(f"{'✅' if gone and back and resumed else '❌'} unplug/replug: reconnected "
+              f"{time.monotonic() - started:.2f}s after the port returned, readings resumed={resumed}; "
+              f"{reader.status()}")
+        reader.stop()
+        esp.unplug()
+        ok &= check_single_reader(tmp)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Cross-process check for the shared live sensor state.
+
+Writer processes publish readings whose channels all carry the same value,
+while reader processes hammer snapshot()/history() like /api/sensor polls
+served by other gunicorn workers. A reader fails the check if it ever sees a
+torn reading (channels from different writes) or a write count going
+backwards. Also reports read throughput, and checks that history() keeps
+out-of-range ``points`` (as in /api/sensor/history?points=) within
+1..MAX_POINTS.
+
+    python scripts/check_shared_sensor_state.py --writers 2 --readers 4 --seconds 3
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sensor_state import CHANNELS, CHART_POINTS, MAX_POINTS, SharedSensorState  # noqa: E402
+
+
+def writer(path: str, wid: int, seconds: float, out) -> None:
+    state = SharedSensorState(path)
+    stop = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < stop:
+        v = float(wid * 1_000_000 + n)
+        state.publish({c: v for c in CHANNELS}, status=f'w{wid}')
+        n += 1
+    out.put(('writes', n))
+
+
+def reader(path: str, seconds: float, out) -> None:
+    state = SharedSensorState(path)
+    stop = time.monotonic() + seconds
+    n = torn = backwards = 0
+    last_count = 0
+    while time.monotonic() < stop:
+        count = state.write_count()
+        if count < last_count:
+            backwards += 1
+        last_count = count
+        snap = state.snapshot()
+        if len({snap[c] for c in CHANNELS}) != 1:
+            torn += 1
+        if n % 20 == 0:
+            hist = state.history()
+            for row in zip(*(hist[c] for c in CHANNELS)):
+                if len(set(row)) != 1:
+                    torn += 1
+        n += 1
+    out.put(('reads', n, torn, backwards))
+
+
+def check_points_bounds(path: str) -> bool:
+    state = SharedSensorState(path, capacity=MAX_POINTS * 2)
+    for n in range(MAX_POINTS * 2):
+        state.publish({c: float(n) for c in CHANNELS}, ts=time.time() - MAX_POINTS * 2 + n)
+    ok = True
+    for points, want in ((-5, 1), (0, CHART_POINTS), (10, 10), (10 ** 9, MAX_POINTS)):
+        got = state.history(points=points)['temperature']
+        # Always the newest readings, never a wrapped slice of the ring
+        newest_ok = len(got) == want and got[-1] == float(MAX_POINTS * 2 - 1)
+        ok &= newest_ok
+        print(f"{'✅' if newest_ok else '❌'} history(points={points}): {len(got)} readings (want {want})")
+    windowed = state.history(window=3600, points=-5)['count']
+    ok &= len(windowed) == 1
+    print(f"{'✅' if len(windowed) == 1 else '❌'} history(window=1h, points=-5): {len(windowed)} bucket")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--writers', type=int, default=2)
+    ap.add_argument('--readers', type=int, default=4)
+    ap.add_argument('--seconds', type=float, default=3.0)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sensor_state.bin')
+        SharedSensorState(path).snapshot()  # create the file up front
+        out = mp.Queue()
+        procs = [mp.Process(target=writer, args=(path, i + 1, args.seconds, out)) for i in range(args.writers)]
+        procs += [mp.Process(target=reader, args=(path, args.seconds, out)) for _ in range(args.readers)]
+        for p in procs:
+            p.start()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        writes = sum(r[1] for r in results if r[0] == 'writes')
+        reads = sum(r[1] for r in results if r[0] == 'reads')
+        torn = sum(r[2] for r in results if r[0] == 'reads')
+        backwards = sum(r[3] for r in results if r[0] == 'reads')
+        final = SharedSensorState(path).write_count()
+        print(f'writes: {writes} ({writes / args.seconds:.0f}/s), reads: {reads} ({reads / args.seconds:.0f}/s)')
+        print(f'torn reads: {torn}, write count regressions: {backwards}, final write count: {final}')
+        ok = torn == 0 and backwards == 0 and final == writes
+        print('✅ shared sensor state consistent' if ok else '❌ shared sensor state inconsistent')
+        ok &= check_points_bounds(os.path.join(tmp, 'bounds.bin'))
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
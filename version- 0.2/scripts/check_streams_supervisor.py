@@ -0,0 +1,162 @@
+"""Check that streams.py supervises the upstream it fronts (render.yaml start-up).
+
+A small HTTP server stands in for gunicorn. The script checks:
+
+- slow start: the upstream binds its port --delay seconds late; the sidecar
+  must not accept connections before that, and its first answer must be
+  the upstream's, not a 502
+- upstream dies: the upstream is killed; the sidecar must exit on its own
+  with a failing status
+- upstream never starts: a command that exits at once stops the sidecar
+  with that command's status
+- shutdown: SIGTERM to the sidecar stops the upstream too
+
+    python scripts/check_streams_supervisor.py --delay 1.5
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+
+UPSTREAM_PORT = 18411
+SIDECAR_PORT = 18412
+
+FAKE_UPSTREAM = """
+import http.server, os, sys, time
+open(sys.argv[1], 'w').write(str(os.getpid()))
+time.sleep(float(sys.argv[2]))
+class Hello(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        self.wfile.write(b'hello')
+    def log_message(self, *args):
+        pass
+http.server.ThreadingHTTPServer(('127.0.0.1', int(sys.argv[3])), Hello).serve_forever()
+"""
+
+
+def listening(port: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(('127.0.0.1', port)) == 0
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        # A zombie has exited; only its parent has not reaped it yet
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(') ')[1][0] != 'Z'
+    except OSError:
+        return False
+
+
+def read_pid(path: str, timeout: float = 10) -> int:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            time.sleep(0.02)
+    raise RuntimeError('fake upstream never started')
+
+
+def supervise(streams, command, timeout=10.0):
+    started = time.monotonic()
+    code = asyncio.run(streams.run('127.0.0.1', SIDECAR_PORT, ('127.0.0.1', UPSTREAM_PORT), command, timeout))
+    return code, time.monotonic() - started
+
+
+def check_start_and_death(streams, tmp: str, delay: float) -> bool:
+    pid_file = os.path.join(tmp, 'upstream.pid')
+    probe = {}
+
+    def client():
+        pid = read_pid(pid_file)
+        spawned = time.monotonic()
+        while not listening(SIDECAR_PORT):
+            time.sleep(0.01)
+        probe['listened_after'] = time.monotonic() - spawned
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{SIDECAR_PORT}/hospital_login', timeout=5) as resp:
+                probe['first'] = (resp.status, resp.read())
+        except urllib.error.HTTPError as e:
+            probe['first'] = (e.code, e.read())
+        probe['killed_at'] = time.monotonic()
+        os.kill(pid, signal.SIGKILL)
+
+    t = threading.Thread(target=client, daemon=True)
+    t.start()
+    code, _elapsed = supervise(streams, [sys.executable, '-c', FAKE_UPSTREAM, pid_file, str(delay), str(UPSTREAM_PORT)])
+    exited_after = time.monotonic() - probe.get('killed_at', time.monotonic())
+    t.join(5)
+    start_ok = probe.get('first') == (200, b'hello') and probe.get('listened_after', 0) >= delay * 0.8
+    print(f"{'✅' if start_ok else '❌'} upstream up after {delay}s: sidecar listened after "
+          f"{probe.get('listened_after', 0):.2f}s, first answer {probe.get('first')}")
+    death_ok = code != 0 and exited_after < 5 and not listening(SIDECAR_PORT)
+    print(f"{'✅' if death_ok else '❌'} upstream killed: sidecar exited {exited_after:.2f}s later with status {code}")
+    return start_ok and death_ok
+
+
+def check_never_starts(streams) -> bool:
+    code, elapsed = supervise(streams, [sys.executable, '-c', 'raise SystemExit(3)'])
+    ok = code == 3 and elapsed < 5
+    print(f"{'✅' if ok else '❌'} upstream exits at start-up: sidecar stopped after {elapsed:.2f}s "
+          f"with status {code}, never listening")
+    return ok
+
+
+def check_sigterm(streams, tmp: str) -> bool:
+    pid_file = os.path.join(tmp, 'upstream-term.pid')
+    seen = {}
+
+    def client():
+        seen['pid'] = read_pid(pid_file)
+        while not listening(SIDECAR_PORT):
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    t = threading.Thread(target=client, daemon=True)
+    t.start()
+    code, _elapsed = supervise(streams, [sys.executable, '-c', FAKE_UPSTREAM, pid_file, '0', str(UPSTREAM_PORT)])
+    t.join(5)
+    stopped = not alive(seen.get('pid', 0)) if seen.get('pid') else False
+    ok = code == 0 and stopped
+    print(f"{'✅' if ok else '❌'} SIGTERM: sidecar status {code}, upstream stopped={stopped}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--delay', type=float, default=1.5, help='seconds before the fake upstream binds its port')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SENSOR_DEVICE_DIR'] = os.path.join(tmp, 'devices')
+        os.environ['SENSOR_STATE_PATH'] = os.path.join(tmp, 'sensor_state.bin')
+        db.DB_PATH = os.path.join(tmp, 'streams.db')
+        import streams
+        ok = check_start_and_death(streams, tmp, args.delay)
+        ok &= check_never_starts(streams)
+        ok &= check_sigterm(streams, tmp)
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Check that /api/vitals/batch refuses oversized bodies before reading them.
+
+The request body is a stream that counts the bytes the app pulls from it.
+
+- Content-Length above VITALS_MAX_BATCH_BYTES: 413, nothing read
+- chunked upload (no Content-Length) that keeps going past the limit: 413,
+  at most limit + 1 bytes read
+- gzip body that inflates past the limit: 400
+- an ordinary gzip'd batch: 200
+
+    python scripts/check_vitals_batch_limits.py
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+import vitals  # noqa: E402
+
+
+class CountingStream(io.RawIOBase):
+    """``size`` bytes of filler (or ``data``), counting what the reader takes"""
+
+    def __init__(self, size: int = 0, data: bytes = b''):
+        self.data = data
+        self.left = size or len(data)
+        self.taken = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        n = min(len(buf), self.left)
+        if self.data:
+            buf[:n] = self.data[self.taken:self.taken + n]
+        else:
+            buf[:n] = b' ' * n
+        self.left -= n
+        self.taken += n
+        return n
+
+
+def post(client, stream, length, ctype='application/json', encoding=None):
+    headers = {'Content-Encoding': encoding} if encoding else {}
+    # The stream goes in as wsgi.input untouched, as a server would hand it over
+    environ = {'wsgi.input': stream, 'CONTENT_LENGTH': '' if length is None else str(length)}
+    if length is None:
+        headers['Transfer-Encoding'] = 'chunked'
+        environ['wsgi.input_terminated'] = True
+    return client.open('/api/vitals/batch', method='POST', content_type=ctype, headers=headers,
+                       environ_overrides=environ)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SENSOR_DEVICE_DIR'] = os.path.join(tmp, 'devices')
+        os.environ['SENSOR_STATE_PATH'] = os.path.join(tmp, 'sensor_state.bin')
+        db.DB_PATH = os.path.join(tmp, 'batch.db')
+        import app as app_module
+        limit = vitals.MAX_BATCH_BYTES
+        client = app_module.app.test_client()
+
+        big = CountingStream(limit * 4)
+        resp = post(client, big, limit * 4)
+        ok = resp.status_code == 413 and big.taken == 0
+        print(f"{'✅' if ok else '❌'} Content-Length {limit * 4}: {resp.status_code}, {big.taken} bytes read")
+
+        chunked = CountingStream(limit * 4)
+        resp = post(client, chunked, None)
+        bounded = resp.status_code == 413 and chunked.taken <= limit + 1
+        ok &= bounded
+        print(f"{'✅' if bounded else '❌'} chunked body past the limit: {resp.status_code}, "
+              f"{chunked.taken} bytes read (limit {limit})")
+
+        bomb = gzip.compress(b' ' * (limit * 2))
+        resp = post(client, CountingStream(data=bomb), len(bomb), encoding='gzip')
+        inflated = resp.status_code == 400
+        ok &= inflated
+        print(f"{'✅' if inflated else '❌'} {len(bomb)}-byte gzip inflating past the limit: {resp.status_code} "
+              f"{resp.get_json().get('message')}")
+
+        now = time.time()
+        readings = [{'device_id': 'robot-1', 'ts': now - i, 'heart_rate': 70, 'spo2': 98} for i in range(50)]
+        body = gzip.compress(json.dumps(readings).encode())
+        resp = post(client, CountingStream(data=body), len(body), encoding='gzip')
+        accepted = resp.status_code == 200 and resp.get_json()['accepted'] == 50
+        ok &= accepted
+        print(f"{'✅' if accepted else '❌'} ordinary gzip'd batch: {resp.status_code}, "
+              f"{resp.get_json().get('accepted')} readings accepted")
+        app_module.vitals_buffer.close()
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Check that the vitals write-behind buffer survives failed flushes.
+
+- another connection holds the database write lock for --lock-seconds while
+  the buffer flushes: the flush must be retried and every reading committed
+- a writer that always fails: the readings must be counted as lost in
+  stats() instead of disappearing silently
+- --threads request threads add readings into a small queue while the
+  writer keeps failing: written + lost + dropped must equal the
+  readings sent (counters updated from several threads add up)
+- add() after close() is refused (busy) instead of queued and never written
+
+    python scripts/check_vitals_buffer.py --lock-seconds 0.5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+import vitals  # noqa: E402
+from vitals import VitalsBuffer, parse_reading, sample_tuple  # noqa: E402
+
+READING = {'heartRate': 72, 'spo2': 98, 'temperature': 36.7}
+
+
+def check_locked(lock_seconds: float, count: int = 50) -> bool:
+    # Fail fast on the lock, so the buffer's own retries do the waiting
+    def writer(batch):
+        conn = sqlite3.connect(db.DB_PATH, timeout=0.01)
+        try:
+            cols = ', '.join(db.VITALS_SAMPLE_COLUMNS)
+            marks = ', '.join(['?'] * len(db.VITALS_SAMPLE_COLUMNS))
+            with conn:
+                conn.executemany(f"INSERT INTO vitals_samples ({cols}) VALUES ({marks})", batch)
+            return len(batch)
+        finally:
+            conn.close()
+
+    blocker = sqlite3.connect(db.DB_PATH, isolation_level=None, check_same_thread=False)
+    blocker.execute('BEGIN IMMEDIATE')
+    threading.Timer(lock_seconds, blocker.rollback).start()
+    buf = VitalsBuffer(batch_size=count, flush_interval=0.05, writer=writer)
+    for _ in range(count):
+        buf.add(sample_tuple(parse_reading(READING), 'robot-1', None))
+    deadline = time.monotonic() + lock_seconds + 10
+    while buf.written + buf.lost < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    buf.close()
+    blocker.close()
+    with db.get_conn() as conn:
+        stored = conn.execute('SELECT COUNT(*) FROM vitals_samples').fetchone()[0]
+    stats = buf.stats()
+    ok = stored == count and stats['retries'] > 0 and stats['lost'] == 0
+    print(f"{'✅' if ok else '❌'} database locked for {lock_seconds}s: {stored}/{count} readings committed; {stats}")
+    return ok
+
+
+def check_failing(count: int = 30) -> bool:
+    def writer(batch):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    vitals.RETRY_BACKOFF = 0.01
+    buf = VitalsBuffer(batch_size=10, flush_interval=0.05, writer=writer)
+    for _ in range(count):
+        buf.add(sample_tuple(parse_reading(READING), 'robot-1', None))
+    buf.close()
+    stats = buf.stats()
+    ok = stats['lost'] == count and stats['written'] == 0 and stats['queued'] == 0
+    print(f"{'✅' if ok else '❌'} writer always failing: {stats['lost']}/{count} readings counted as lost; {stats}")
+    return ok
+
+
+def check_accounting(threads: int, per_thread: int = 2000) -> bool:
+    calls = [0]
+
+    def writer(batch):
+        calls[0] += 1
+        if calls[0] % 3:
+            raise sqlite3.OperationalError('database is locked')
+        return len(batch)
+
+    vitals.WRITE_RETRIES = 1  # so some batches fail twice and are lost
+    vitals.RETRY_BACKOFF = 0.0005
+    vitals.RETRY_BACKOFF_MAX = 0.001
+    buf = VitalsBuffer(batch_size=25, flush_interval=0.001, maxsize=500, writer=writer)
+    sample = sample_tuple(parse_reading(READING), 'robot-1', None)
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible
+    try:
+        workers = [threading.Thread(target=lambda: [buf.add(sample) for _ in range(per_thread)])
+                   for _ in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        buf.close()
+    finally:
+        sys.setswitchinterval(switch)
+    stats = buf.stats()
+    sent = threads * per_thread
+    total = stats['written'] + stats['lost'] + stats['dropped']
+    ok = total == sent and stats['queued'] == 0 and stats['written'] and stats['lost']
+    print(f"{'✅' if ok else '❌'} {threads} threads sent {sent}: written + lost + dropped = {total}; {stats}")
+    return ok
+
+
+def check_closed() -> bool:
+    written = []
+    buf = VitalsBuffer(flush_interval=0.05, writer=lambda batch: written.extend(batch) or len(batch))
+    sample = sample_tuple(parse_reading(READING), 'robot-1', None)
+    before = buf.add(sample)
+    buf.close()
+    after = buf.add(sample)
+    time.sleep(0.2)
+    stats = buf.stats()
+    ok = before and not after and len(written) == 1 and stats['queued'] == 0 and stats['dropped'] == 1
+    print(f"{'✅' if ok else '❌'} add() after close(): accepted={after}, {len(written)} written; {stats}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--lock-seconds', type=float, default=0.5, help='how long the database stays locked')
+    ap.add_argument('--threads', type=int, default=8, help='request threads adding readings at once')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'vitals.db')
+        db.init_db()
+        ok = check_locked(args.lock_seconds)
+        ok &= check_failing()
+        ok &= check_accounting(args.threads)
+        ok &= check_closed()
+        db.close_conn()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
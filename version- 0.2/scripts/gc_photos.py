@@ -0,0 +1,46 @@
+"""Remove photos in uploads/ that no visit or profile references any more.
+
+References come from the photo_refs table (kept current by triggers on
+patients, stored_patients and patient_profiles). Files newer than the grace
+period are kept because a photo is uploaded before its intake is saved.
+Cached thumbnails of deleted photos are removed as well.
+
+    python scripts/gc_photos.py --dry-run
+    python scripts/gc_photos.py --grace-hours 48
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import db  # noqa: E402
+import thumbs  # noqa: E402
+from photos import GC_GRACE_SECONDS, UPLOADS_DIR, collect_garbage  # noqa: E402
+
+
+def drop_thumbnails(name: str) -> None:
+    for width in thumbs.WIDTHS:
+        try:
+            os.remove(thumbs._cache_path(name, width))
+        except OSError:
+            pass
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--uploads', default=UPLOADS_DIR)
+    ap.add_argument('--grace-hours', type=float, default=GC_GRACE_SECONDS / 3600)
+    ap.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+    args = ap.parse_args()
+
+    db.init_db()
+    referenced = db.referenced_photos()
+    stats = collect_garbage(referenced, args.uploads, args.grace_hours * 3600, args.dry_run, drop_thumbnails)
+    pruned = 0 if args.dry_run else db.prune_photo_refs()
+    verb = 'would delete' if args.dry_run else 'deleted'
+    print(f"🧹 {len(referenced)} referenced photos; kept {stats['kept']}, skipped {stats['recent']} recent, "
+          f"{verb} {stats['deleted']} unreferenced ({stats['bytes'] / 1e6:.1f} MB); pruned {pruned} zero-count refs")
+
+
+if __name__ == '__main__':
+    main()
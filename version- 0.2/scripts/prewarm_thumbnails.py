@@ -0,0 +1,47 @@
+"""Generate avatar derivatives for every photo already in uploads/.
+
+Run after deploying the thumbnail cache (or after clearing it) so the first
+page views do not pay for resizing. Photos whose derivatives are already
+cached and current are skipped.
+
+    python scripts/prewarm_thumbnails.py --widths 96 128 256 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import thumbs  # noqa: E402
+from photos import UPLOADS_DIR  # noqa: E402
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--uploads', default=UPLOADS_DIR)
+    ap.add_argument('--widths', type=int, nargs='+', default=[96, 128, 256])
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = ap.parse_args()
+
+    if thumbs.Image is None:
+        sys.exit('Pillow is not installed; thumbnails are disabled')
+    names = []
+    for root, _dirs, files in os.walk(args.uploads):
+        for f in files:
+            if f.lower().endswith(IMAGE_EXTS):
+                names.append(os.path.relpath(os.path.join(root, f), args.uploads).replace(os.sep, '/'))
+    jobs = [(name, w) for name in names for w in args.widths]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda job: thumbs.thumbnail(job[0], job[1], args.uploads), jobs))
+    made = sum(1 for r in results if r)
+    print(f'✅ {len(names)} photos, {made} derivatives ready ({len(jobs) - made} served as originals) '
+          f'in {time.monotonic() - started:.1f}s; cache is {thumbs.cache_size() / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Print QR badge sheets for many patients at once (the /qr/badges endpoint as a CLI).
+
+Selects profiles by id list, by search, or all of them, renders the QR codes
+across a process pool and writes a multi-page PDF (or one PNG per sheet).
+--demo N fills a scratch database with N profiles first, to time a large
+onboarding batch without touching app.db.
+
+    python scripts/qr_badges.py --out badges.pdf
+    python scripts/qr_badges.py --ids 12 13 14 --format png --out sheets/
+    python scripts/qr_badges.py --demo 3000 --out /tmp/badges.pdf
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import badges  # noqa: E402
+import db  # noqa: E402
+
+
+def fill_demo(count: int) -> None:
+    conn = db.get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO patient_profiles (name, age, gender) VALUES (?, ?, ?)",
+            [(f'Onboarding Patient {i}', 20 + i % 60, 'FM'[i % 2]) for i in range(count)])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--ids', type=int, nargs='+', help='profile ids (default: all profiles)')
+    ap.add_argument('--search', help='only profiles matching this search')
+    ap.add_argument('--format', choices=('pdf', 'png'), default='pdf')
+    ap.add_argument('--out', required=True, help='PDF file, or directory for PNG sheets')
+    ap.add_argument('--workers', type=int, default=badges.WORKERS)
+    ap.add_argument('--demo', type=int, default=0, help='use a scratch database with this many profiles')
+    args = ap.parse_args()
+
+    if not badges.available():
+        sys.exit('Pillow is not installed; badge sheets are unavailable')
+    tmp = None
+    if args.demo:
+        tmp = tempfile.TemporaryDirectory()
+        db.DB_PATH = os.path.join(tmp.name, 'badges.db')
+        db.init_db()
+        fill_demo(args.demo)
+    else:
+        db.init_db()
+
+    started = time.monotonic()
+    written = pages = 0
+    sheets = badges.sheets(ids=args.ids, search=args.search, workers=args.workers)
+    if args.format == 'pdf':
+        pdf = badges.PdfWriter()
+        with open(args.out, 'wb') as f:
+            f.write(pdf.start())
+            for sheet in sheets:
+                f.write(pdf.page(sheet))
+                pages += 1
+            f.write(pdf.finish())
+        written = pdf.position
+    else:
+        os.makedirs(args.out, exist_ok=True)
+        for sheet in sheets:
+            pages += 1
+            path = os.path.join(args.out, f'qr_badges_{pages:04d}.png')
+            sheet.save(path, format='PNG', optimize=True, dpi=(badges.DPI, badges.DPI))
+            written += os.path.getsize(path)
+    elapsed = time.monotonic() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'✅ {pages} sheets ({badges.PER_PAGE} badges each) -> {args.out}: {written / 1e6:.1f} MB '
+          f'in {elapsed:.1f}s with {args.workers} workers; peak RSS {peak_mb:.0f} MB')
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,273 @@
-import serial
+"""ESP32 serial reader: one blocking, buffered line reader for every protocol.
+
+The robot's ESP32 prints one reading per line, prefixed by its format:
+
+    JSON:{"temperature": 36.8, "heartRate": 72, "spo2": 98, ...}
+    DATA_CSV:<env temp>,<humidity>,<body temp>,<weight>,<distance>,<heart rate>,<spo2>
+
+SerialReader blocks in read() until bytes arrive (no polling of in_waiting),
+splits them into lines in its own buffer and hands each line to the parser
+registered for its prefix (PARSERS). Parsed readings are published to the
+sensor registry as device "serial:<port>" (and to the combined view behind
+/api/sensor). Other lines are ignored. If the port
+cannot be opened or disappears (cable pulled, ESP32 reset), the reader
+reconnects with exponential backoff. It logs connection changes only, not
+every reading.
+
+A port can only be read by one process, so of all the processes on the host
+only the one holding SERIAL_LOCK_PATH (see claim_serial_lock) runs readers.
+"""
+import json
+import os
 import threading
 import time
-import serial.tools.list_ports
-
-class SensorReader:
-    def __init__(self):
-        self.data = {'temp': 0, 'humidity': 0, 'body_temp': 0, 'weight': 0, 'distance': 0, 'heart_rate': 0, 'spo2': 0}
-        self.selected_port = None
-        self.serial_thread = None
-        self.running = False
-        
-    def get_available_ports(self):
-        ports = serial.tools.list_ports.comports()
-        return [port.device for port in ports]
-    
-    def set_port(self, port):
-        self.selected_port = port
-        self.start_reading()
-    
-    def start_reading(self):
-        if self.serial_thread and self.serial_thread.is_alive():
-            self.stop_reading()
-        
-        self.running = True
-        self.serial_thread = threading.Thread(target=self._read_serial, daemon=True)
-        self.serial_thread.start()
-    
-    def stop_reading(self):
-        self.running = False
-        
-    def _read_serial(self):
-        if not self.selected_port:
+from typing import Any, Callable, Dict, List, Optional
+
+# Serial is optional; on Render there is no COM port
+try:
+    import serial  # type: ignore
+    import serial.tools.list_ports  # type: ignore
+except Exception:
+    serial = None
+try:
+    import fcntl  # type: ignore
+except Exception:  # Windows: single-process dev server, nothing to share
+    fcntl = None
+
+BAUD_RATE = 115200
+# read() returns after this long without data, so stop() takes effect
+READ_TIMEOUT = 1.0
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30.0
+MAX_LINE = 4096
+LOCK_PATH = os.getenv('SERIAL_LOCK_PATH', os.path.join(os.path.dirname(__file__), 'serial.lock'))
+
+# A parsed line: keyword arguments for sensor_state.publish()
+Reading = Dict[str, Any]
+
+
+def parse_json_line(payload: str) -> Optional[Reading]:
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        return None
+    return {
+        'values': {
+            'temperature': data.get('temperature', 0),
+            'heart_rate': data.get('heartRate', 0),
+            'spo2': data.get('spo2', 0),
+            'weight': data.get('weight', 0),
+            'env_temperature': data.get('envTemperature', 0),
+            'humidity': data.get('humidity', 0),
+        },
+        'status': data.get('status', 'normal'),
+        'measurements': data.get('measurements', 0),
+    }
+
+
+def parse_csv_line(payload: str) -> Optional[Reading]:
+    values = payload.split(',')
+    if len(values) < 7:
+        return None
+    env_temp, humidity, body_temp, weight, _distance, heart_rate, spo2 = (float(v) for v in values[:7])
+    return {
+        'values': {
+            'temperature': body_temp,
+            'heart_rate': int(heart_rate),
+            'spo2': int(spo2),
+            'weight': weight,
+            'env_temperature': env_temp,
+            'humidity': humidity,
+        },
+    }
+
+
+# Line prefix -> parser for the rest of the line
+PARSERS: Dict[str, Callable[[str], Optional[Reading]]] = {
+    'JSON:': parse_json_line,
+    'DATA_CSV:': parse_csv_line,
+}
+
+
+def parse_line(line: str, parsers: Dict[str, Callable[[str], Optional[Reading]]] = PARSERS) -> Optional[Reading]:
+    """Parse one line; None for unknown prefixes and malformed payloads"""
+    for prefix, parser in parsers.items():
+        if line.startswith(prefix):
+            try:
+                return parser(line[len(prefix):])
+            except (ValueError, TypeError):
+                return None
+    return None
+
+
+def available() -> bool:
+    return serial is not None
+
+
+def available_ports() -> List[str]:
+    if serial is None:
+        return []
+    return [port.device for port in serial.tools.list_ports.comports()]
+
+
+_lock_fd = None
+
+
+def claim_serial_lock(path: str = LOCK_PATH) -> bool:
+    """Become this host's serial process; False if another live process already is.
+
+    The flock is held until the process exits, so a restarted worker can
+    take over from one that died.
+    """
+    global _lock_fd
+    if _lock_fd is not None:
+        return True
+    if fcntl is None:
+        _lock_fd = -1
+        return True
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _lock_fd = fd
+    return True
+
+
+class SerialReader:
+    """Background thread reading one serial port"""
+
+    def __init__(self, port: Optional[str], baud: int = BAUD_RATE,
+                 parsers: Optional[Dict[str, Callable[[str], Optional[Reading]]]] = None,
+                 on_reading: Optional[Callable[[Reading], None]] = None,
+                 open_port: Optional[Callable[[str, int], Any]] = None):
+        self.port = port
+        self.baud = baud
+        self.parsers = PARSERS if parsers is None else parsers
+        self.on_reading = on_reading or self._publish
+        self._open_port = open_port or self._open_serial
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ser = None
+        self.connected = False
+        self.readings = 0
+        self.ignored = 0
+        self.reconnects = 0
+        self.last_reading = None
+        self.last_error = None
+
+    @property
+    def device(self) -> str:
+        """Sensor registry id of this port's readings"""
+        return f'serial:{self.port}'
+
+    def _publish(self, reading: Reading) -> None:
+        from sensor_state import sensor_registry
+        sensor_registry.publish(self.device, **reading)
+
+    @staticmethod
+    def _open_serial(port: str, baud: int):
+        return serial.Serial(port, baud, timeout=READ_TIMEOUT)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='serial-reader', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = READ_TIMEOUT + 1) -> None:
+        self._stop.set()
+        ser = self._ser
+        if ser is not None:
+            try:
+                ser.cancel_read()
+            except Exception:
+                pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'port': self.port,
+            'device': self.device,
+            'connected': self.connected,
+            'readings': self.readings,
+            'ignored_lines': self.ignored,
+            'reconnects': self.reconnects,
+            'last_reading': self.last_reading,
+            'last_error': self.last_error,
+        }
+
+    def _run(self) -> None:
+        backoff = BACKOFF_MIN
+        while not self._stop.is_set():
+            try:
+                self._ser = self._open_port(self.port, self.baud)
+            except Exception as e:
+                self._note_error(f"Could not open {self.port}: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX)
+                continue
+            self.connected = True
+            print(f"✅ Connected to ESP32 on {self.port}")
+            backoff = BACKOFF_MIN
+            try:
+                self._read_lines(self._ser)
+            except Exception as e:
+                self._note_error(f"ESP32 on {self.port} disconnected: {e}")
+            finally:
+                self.connected = False
+                try:
+                    self._ser.close()
+                except Exception:
+                    pass
+                self._ser = None
+            if not self._stop.is_set():
+                self.reconnects += 1
+                self._stop.wait(backoff)
+
+    def _note_error(self, message: str) -> None:
+        # Log each new problem once, not every retry
+        if message != self.last_error:
+            print(f"ℹ️ {message}")
+        self.last_error = message
+
+    def _read_lines(self, ser) -> None:
+        buf = bytearray()
+        while not self._stop.is_set():
+            # Blocks until at least one byte arrives (or READ_TIMEOUT), then
+            # takes whatever else is already buffered in one call
+            chunk = ser.read(max(1, ser.in_waiting))
+            if not chunk:
+                continue
+            buf += chunk
+            while True:
+                end = buf.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buf[:end])
+                del buf[:end + 1]
+                self._handle(line)
+            if len(buf) > MAX_LINE:
+                # No newline in sight: line noise or the wrong baud rate
+                buf.clear()
+                self.ignored += 1
+
+    def _handle(self, raw: bytes) -> None:
+        line = raw.decode('utf-8', 'replace').strip()
+        reading = parse_line(line, self.parsers) if line else None
+        if reading is None:
+            self.ignored += 1
             return
         try:
-            ser = serial.Serial(self.selected_port, 115200, timeout=1)
-            while self.running:
-                line = ser.readline().decode().strip()
-                if line.startswith("DATA_CSV:"):
-                    values = line[9:].split(',')
-                    if len(values) >= 7:
-                        self.data['temp'] = float(values[0])
-                        self.data['humidity'] = float(values[1])
-                        self.data['body_temp'] = float(values[2])
-                        self.data['weight'] = float(values[3])
-                        self.data['distance'] = float(values[4])
-                        self.data['heart_rate'] = int(float(values[5]))
-                        self.data['spo2'] = int(float(values[6]))
-            ser.close()
+            self.on_reading(reading)
         except Exception as e:
-            print(f"Serial error: {e}")
-    
-    def get_data(self):
-        return self.data
\ No newline at end of file
+            self._note_error(f"Could not publish ESP32 reading: {e}")
+            return
+        self.readings += 1
+        self.last_reading = time.time()
@@ -0,0 +1,371 @@
+"""Live sensor state shared by every worker process.
+
+gunicorn runs several workers, so the latest reading and the recent history
+cannot live in module-level dicts: a reading posted to one worker would be
+invisible to /api/sensor served by another. Instead they live in a small
+memory-mapped file that all workers on the host map.
+
+Layout: a header followed by a ring of fixed-size records, viewed through a
+NumPy structured array so each channel is an array over the ring and history
+views (including min/max/mean downsampling for long windows) are computed
+without per-reading Python work. The depth is SENSOR_HISTORY_DEPTH readings
+(default one hour of 1 Hz data). Writers serialise
+on an flock (plus a thread lock inside the process) and bump a sequence
+counter before and after each write. Readers never lock: they copy the bytes
+they need and retry if the counter was odd or changed meanwhile (a seqlock),
+so a reader can never see a half-written reading.
+
+Several robots can report at once (a serial port each, or their own
+device_id over HTTP). SensorRegistry keeps one such file per device under
+SENSOR_DEVICE_DIR, so each device has its own latest reading, history and
+last-seen time. The file name is derived from the device id, so any worker
+finds a device another worker created without a shared index. The combined
+sensor_state still receives every reading: /api/sensor without ?device=
+shows the newest reading from any device, as it did with one robot.
+"""
+import base64
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl  # type: ignore
+except Exception:  # Windows: single-process dev server, thread lock only
+    fcntl = None
+
+STATE_PATH = os.getenv('SENSOR_STATE_PATH', os.path.join(os.path.dirname(__file__), 'sensor_state.bin'))
+HISTORY_DEPTH = int(os.getenv('SENSOR_HISTORY_DEPTH', '3600'))
+# /api/sensor/history without a window: the newest readings, like the old chart feed
+CHART_POINTS = 50
+MAX_POINTS = 2000
+DEVICE_DIR = os.getenv('SENSOR_DEVICE_DIR', os.path.join(os.path.dirname(__file__), 'sensor_devices'))
+# Device ids come from unauthenticated posts, so the number of state files is capped
+MAX_DEVICES = int(os.getenv('SENSOR_MAX_DEVICES', '256'))
+DEVICE_ID_MAX = 64
+
+CHANNELS = ('temperature', 'heart_rate', 'spo2', 'weight', 'env_temperature', 'humidity')
+
+_MAGIC = b'HCRSENS1'
+_HEADER = struct.Struct('<8sQQQ')      # magic, seq, write_count, capacity
+_RECORD = struct.Struct('<d6dI16s4x')  # ts, channels, measurements, status
+_U64 = struct.Struct('<Q')
+_SEQ_AT, _COUNT_AT = 8, 16              # header field offsets
+_DTYPE = np.dtype({
+    'names': ['ts', *CHANNELS, 'measurements', 'status'],
+    'formats': ['<f8'] * 7 + ['<u4', 'S16'],
+    'offsets': [0, 8, 16, 24, 32, 40, 48, 56, 60],
+    'itemsize': _RECORD.size,
+})
+_WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_window(raw: Optional[str]) -> Optional[float]:
+    """'90', '30s', '10m', '2h' -> seconds; None when absent. Raises ValueError."""
+    if raw is None or str(raw).strip() == '':
+        return None
+    raw = str(raw).strip().lower()
+    unit = _WINDOW_UNITS.get(raw[-1])
+    seconds = float(raw[:-1] if unit else raw) * (unit or 1)
+    if not 0 < seconds < float('inf'):
+        raise ValueError('window must be positive')
+    return seconds
+
+
+class SharedSensorState:
+    def __init__(self, path: str = STATE_PATH, capacity: int = HISTORY_DEPTH):
+        self.path = path
+        self.capacity = int(capacity)
+        self.size = _HEADER.size + _RECORD.size * self.capacity
+        self._lock = threading.Lock()
+        self._mm = None
+        self._ring = None
+        self._fd = None
+        self._pid = None
+
+    # -- mapping ---------------------------------------------------------
+
+    def _map(self):
+        # Re-open after fork so each worker has its own descriptor for flock
+        if self._mm is not None and self._pid == os.getpid():
+            return self._mm
+        with self._lock:
+            if self._mm is not None and self._pid == os.getpid():
+                return self._mm
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._flock(fd, True)
+            try:
+                if not self._valid(fd):
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, _HEADER.pack(_MAGIC, 0, 0, self.capacity))
+                mm = mmap.mmap(fd, self.size)
+            finally:
+                self._flock(fd, False)
+            self._ring = np.ndarray((self.capacity,), dtype=_DTYPE, buffer=mm, offset=_HEADER.size)
+            self._fd, self._mm, self._pid = fd, mm, os.getpid()
+            return mm
+
+    def _valid(self, fd) -> bool:
+        if os.fstat(fd).st_size != self.size:
+            return False
+        os.lseek(fd, 0, os.SEEK_SET)
+        magic, _seq, _count, capacity = _HEADER.unpack(os.read(fd, _HEADER.size))
+        return magic == _MAGIC and capacity == self.capacity
+
+    @staticmethod
+    def _flock(fd, exclusive: bool):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_UN)
+
+    # -- writes ----------------------------------------------------------
+
+    def publish(self, values: Dict[str, Any], status: Optional[str] = None,
+                measurements: Optional[int] = None, ts: Optional[float] = None) -> Dict[str, Any]:
+        """Record a reading; missing channels are stored as 0 like the old snapshot.
+
+        ``measurements`` defaults to the previous count plus one.
+        """
+        mm = self._map()
+        ts = time.time() if ts is None else float(ts)
+        chans = []
+        for c in CHANNELS:
+            try:
+                chans.append(float(values.get(c) or 0))
+            except (TypeError, ValueError):
+                chans.append(0.0)
+        status_b = str(status or 'normal').encode('utf-8')[:16]
+        with self._lock:
+            self._flock(self._fd, True)
+            try:
+                seq = _U64.unpack_from(mm, _SEQ_AT)[0]
+                count = _U64.unpack_from(mm, _COUNT_AT)[0]
+                capacity = self.capacity
+                if measurements is None:
+                    prev = self._record(mm, (count - 1) % capacity) if count else None
+                    measurements = (prev[7] if prev else 0) + 1
+                # seq is odd while the slot and count are being rewritten
+                _U64.pack_into(mm, _SEQ_AT, seq + 1)
+                _RECORD.pack_into(mm, _HEADER.size + _RECORD.size * (count % capacity),
+                                  ts, *chans, int(measurements) & 0xFFFFFFFF, status_b)
+                _U64.pack_into(mm, _COUNT_AT, count + 1)
+                _U64.pack_into(mm, _SEQ_AT, seq + 2)
+            finally:
+                self._flock(self._fd, False)
+        return self._as_snapshot((ts, *chans, measurements, status_b))
+
+    # -- lock-free reads -------------------------------------------------
+
+    @staticmethod
+    def _record(mm, index):
+        return _RECORD.unpack_from(mm, _HEADER.size + _RECORD.size * index)
+
+    def _read(self, last: int) -> np.ndarray:
+        """Consistent copy of up to ``last`` newest records, oldest first"""
+        mm = self._map()
+        ring, capacity = self._ring, self.capacity
+        while True:
+            seq1 = _U64.unpack_from(mm, _SEQ_AT)[0]
+            if seq1 & 1:
+                time.sleep(0)
+                continue
+            count = _U64.unpack_from(mm, _COUNT_AT)[0]
+            n = max(0, min(count, capacity, last))
+            start = (count - n) % capacity
+            if start + n <= capacity:
+                out = ring[start:start + n].copy()
+            else:
+                out = np.concatenate((ring[start:], ring[:start + n - capacity]))
+            if _U64.unpack_from(mm, _SEQ_AT)[0] == seq1:
+                return out
+
+    @staticmethod
+    def _as_snapshot(rec) -> Dict[str, Any]:
+        ts, *rest = rec
+        chans, measurements, status = rest[:6], rest[6], rest[7]
+        snap = {c: float(v) for c, v in zip(CHANNELS, chans)}
+        snap['status'] = status.rstrip(b'\0').decode('utf-8', 'replace') or 'normal'
+        snap['measurements'] = int(measurements)
+        snap['timestamp'] = datetime.fromtimestamp(ts).strftime('%H:%M:%S')
+        return snap
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Latest reading in the /api/sensor shape"""
+        recs = self._read(1)
+        if not len(recs):
+            snap = {c: 0 for c in CHANNELS}
+            snap.update(status='normal', measurements=0, timestamp=datetime.now().strftime('%H:%M:%S'))
+            return snap
+        return self._as_snapshot(recs[0].item())
+
+    def history(self, window: Optional[float] = None, points: Optional[int] = None,
+                now: Optional[float] = None) -> Dict[str, Any]:
+        """Recent readings as parallel lists (the /api/sensor/history shape).
+
+        Without a window this is the newest CHART_POINTS readings. With one,
+        readings from the last ``window`` seconds are reduced to at most
+        ``points`` time buckets: each channel list holds the bucket mean and
+        ``min``/``max`` hold the extremes per channel. ``points`` is clamped
+        to 1..MAX_POINTS either way.
+        """
+        points = max(1, min(int(points or (CHART_POINTS if window is None else 200)), MAX_POINTS))
+        if window is None:
+            recs = self._read(points)
+            out = {c: recs[c].tolist() for c in CHANNELS}
+            out['timestamps'] = [datetime.fromtimestamp(t).strftime('%H:%M:%S') for t in recs['ts']]
+            return out
+
+        now = time.time() if now is None else now
+        start = now - window
+        recs = self._read(self.capacity)
+        recs = recs[(recs['ts'] >= start) & (recs['ts'] <= now)]
+        width = window / points
+        bucket = np.minimum(((recs['ts'] - start) // width).astype(np.int64), points - 1)
+        order = np.argsort(bucket, kind='stable')
+        bucket = bucket[order]
+        used, first, counts = np.unique(bucket, return_index=True, return_counts=True)
+        out = {'min': {}, 'max': {}}
+        for c in CHANNELS:
+            vals = recs[c][order]
+            out[c] = (np.add.reduceat(vals, first) / counts).round(3).tolist() if len(vals) else []
+            out['min'][c] = np.minimum.reduceat(vals, first).tolist() if len(vals) else []
+            out['max'][c] = np.maximum.reduceat(vals, first).tolist() if len(vals) else []
+        out['count'] = counts.tolist()
+        out['timestamps'] = [datetime.fromtimestamp(start + (b + 0.5) * width).strftime('%H:%M:%S') for b in used]
+        out['window'] = window
+        out['bucket_seconds'] = width
+        return out
+
+    def last_seen(self) -> Optional[float]:
+        """Timestamp of the newest reading, None before the first"""
+        recs = self._read(1)
+        return float(recs['ts'][0]) if len(recs) else None
+
+    def write_count(self) -> int:
+        """Total readings published so far (seqlock-consistent)"""
+        mm = self._map()
+        while True:
+            seq1 = _U64.unpack_from(mm, _SEQ_AT)[0]
+            if not seq1 & 1:
+                count = _U64.unpack_from(mm, _COUNT_AT)[0]
+                if _U64.unpack_from(mm, _SEQ_AT)[0] == seq1:
+                    return count
+            time.sleep(0)
+
+
+def device_key(raw: Any) -> Optional[str]:
+    """Normalise a device id; None when absent. Raises ValueError when unusable."""
+    if raw is None:
+        return None
+    key = str(raw).strip()
+    if not key:
+        return None
+    if len(key.encode('utf-8')) > DEVICE_ID_MAX or not key.isprintable():
+        raise ValueError(f'device id must be printable and at most {DEVICE_ID_MAX} bytes')
+    return key
+
+
+class SensorRegistry:
+    """Live state per device: one SharedSensorState file per device id.
+
+    get() is a dict hit once this process has mapped the device, else one
+    stat of the file named after the id. Readings are also published to
+    ``combined`` (the device-less view).
+    """
+
+    def __init__(self, directory: str = DEVICE_DIR, capacity: int = HISTORY_DEPTH,
+                 max_devices: int = MAX_DEVICES, combined: Optional[SharedSensorState] = None):
+        self.directory = directory
+        self.capacity = int(capacity)
+        self.max_devices = int(max_devices)
+        self.combined = combined
+        self._states: Dict[str, SharedSensorState] = {}
+        self._lock = threading.Lock()
+        self._full_logged = False
+
+    def _path(self, device: str) -> str:
+        name = base64.urlsafe_b64encode(device.encode('utf-8')).decode('ascii').rstrip('=')
+        return os.path.join(self.directory, name + '.bin')
+
+    @staticmethod
+    def _device(filename: str) -> Optional[str]:
+        name, ext = os.path.splitext(filename)
+        if ext != '.bin':
+            return None
+        try:
+            return base64.urlsafe_b64decode(name + '=' * (-len(name) % 4)).decode('utf-8')
+        except ValueError:
+            return None
+
+    def ids(self) -> List[str]:
+        """Every device seen by any worker"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [d for d in map(self._device, names) if d is not None]
+
+    def get(self, device: str, create: bool = False) -> Optional[SharedSensorState]:
+        """The device's state; None if it never reported (or, with ``create``, the registry is full)"""
+        state = self._states.get(device)
+        if state is not None:
+            return state
+        device = device_key(device)
+        if device is None:
+            return None
+        path = self._path(device)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            if len(self.ids()) >= self.max_devices:
+                if not self._full_logged:
+                    print(f"ℹ️ {self.max_devices} sensor devices registered; not tracking '{device}' separately")
+                    self._full_logged = True
+                return None
+        with self._lock:
+            state = self._states.get(device)
+            if state is None:
+                state = self._states[device] = SharedSensorState(path, self.capacity)
+        return state
+
+    def publish(self, device: Optional[str], values: Dict[str, Any], status: Optional[str] = None,
+                measurements: Optional[int] = None, ts: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Record a reading for ``device`` (None: the combined view only)"""
+        snap = None
+        if self.combined is not None:
+            snap = self.combined.publish(values, status, measurements, ts)
+        state = self.get(device, create=True) if device is not None else None
+        if state is not None:
+            snap = state.publish(values, status, measurements, ts)
+        return snap
+
+    def describe(self, device: str) -> Optional[Dict[str, Any]]:
+        """/api/devices entry: latest reading, last-seen time and reading count"""
+        state = self.get(device)
+        if state is None:
+            return None
+        last_seen = state.last_seen()
+        return {
+            'device': device,
+            'last_seen': last_seen,
+            'age_seconds': round(time.time() - last_seen, 3) if last_seen is not None else None,
+            'readings': state.write_count(),
+            'latest': state.snapshot(),
+        }
+
+    def devices(self) -> List[Dict[str, Any]]:
+        """Every device, most recently seen first"""
+        out = [d for d in map(self.describe, self.ids()) if d is not None]
+        out.sort(key=lambda d: d['last_seen'] or 0, reverse=True)
+        return out
+
+
+sensor_state = SharedSensorState()
+sensor_registry = SensorRegistry(combined=sensor_state)
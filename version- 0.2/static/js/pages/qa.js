@@ -605,10 +605,15 @@
       if (typeof captureBrowserPhoto === 'function') {
         try {
           console.log('📸 Using browser camera...');
+          sessionStorage.removeItem('qa_photo');
           captureBrowserPhoto();
-          // Wait longer for the photo to be processed and uploaded
-          setTimeout(() => {
+          // The upload answers as soon as the photo is queued for writing, so
+          // poll for the filename instead of always waiting the full 5 seconds
+          const startedAt = Date.now();
+          const poll = setInterval(() => {
             const photoFilename = sessionStorage.getItem('qa_photo');
+            if (!photoFilename && Date.now() - startedAt < 5000) return;
+            clearInterval(poll);
             console.log('📸 Browser camera photo filename:', photoFilename);
             if (!photoFilename) {
               console.log('📸 No photo filename found, trying external camera...');
@@ -617,7 +622,7 @@
               console.log('✅ Photo captured successfully:', photoFilename);
               resolve();
             }
-          }, 5000); // Increased timeout to 5 seconds
+          }, 100);
         } catch (error) {
           console.error('❌ Browser camera failed:', error);
           // Fallback to external camera
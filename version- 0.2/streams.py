@@ -0,0 +1,512 @@
+"""Async sidecar for the long-lived streaming endpoints.
+
+/events/patients (SSE) and /camera/video_feed (MJPEG) never finish. Under
+gunicorn's gthread worker each open stream holds a worker thread for as long
+as the tab stays open, so a few dashboards and camera views can use up every
+thread and ordinary requests queue behind them. This server answers the
+streaming paths on one asyncio loop, so an idle stream costs a coroutine
+and a socket instead of a thread:
+
+- SSE streams are AsyncSubscriptions on the shared event bus (events.py),
+  with the same replay, coalescing, heartbeats and eviction as the Flask
+  route.
+- MJPEG viewers of one stream variant share a relay thread that waits for
+  the camera's encoded frames and wakes every viewer coroutine. A viewer
+  whose socket is still backed up skips frames instead of queueing them.
+
+The other camera routes (/take_picture, /test_photo, /camera_status,
+/camera/stream_stats) also run here, through the Flask app on a worker
+thread, so the camera device is only ever opened by this process.
+
+Logins, access rules and the ?stream= choice come from the Flask app: each
+request's cookies are checked in a Flask request context (on a worker
+thread, since that reads the session). Importing the app does not start the
+serial readers; those run in the gunicorn workers (see gunicorn.conf.py).
+
+With --upstream the sidecar is the front server: it answers the paths above
+and passes every other request through to gunicorn. A command after `--`
+is started as that upstream and supervised: the sidecar only starts
+listening once the upstream port accepts connections, and exits (with the
+upstream's exit status, or 1) as soon as the upstream exits, so the platform
+restarts both instead of the sidecar answering 502 forever. SIGTERM/SIGINT
+are passed on to the upstream. This is how render.yaml runs it:
+
+    python streams.py --host 0.0.0.0 --port $PORT --upstream 127.0.0.1:8000 \
+        -- gunicorn -c gunicorn.conf.py -b 127.0.0.1:8000 app:app
+
+Behind a proxy of your own, run it without --upstream and route the paths to it:
+
+    python streams.py --port 8001
+    # nginx: location ~ ^/(events/patients|camera/|take_picture|test_photo|camera_status|streams/) { proxy_pass http://127.0.0.1:8001; proxy_buffering off; }
+
+/streams/stats reports open streams and the bus counters of this process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import events
+from app import app as flask_app, can_view_camera, can_view_stats, requested_stream
+from camera import STREAM_VARIANTS, camera
+from flask import redirect, url_for
+
+HOST = os.getenv('STREAMS_HOST', '127.0.0.1')
+PORT = int(os.getenv('STREAMS_PORT', '8001'))
+# host:port of gunicorn for every other path (front server mode)
+UPSTREAM = os.getenv('STREAMS_UPSTREAM', '')
+# Seconds to wait for the upstream to accept connections before giving up
+UPSTREAM_START_TIMEOUT = float(os.getenv('STREAMS_UPSTREAM_START_TIMEOUT', '60'))
+# Seconds a supervised upstream gets to exit after SIGTERM before SIGKILL
+UPSTREAM_STOP_TIMEOUT = 30.0
+MAX_HEADER_BYTES = 16 * 1024
+HEADER_TIMEOUT = 10.0
+# Skip MJPEG frames while more than this much of earlier ones is unsent
+FRAME_BACKLOG_BYTES = 512 * 1024
+
+_REASONS = {200: 'OK', 302: 'Found', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+            405: 'Method Not Allowed', 431: 'Request Header Fields Too Large',
+            502: 'Bad Gateway', 503: 'Service Unavailable'}
+# Not forwarded upstream: the sidecar decides the connection's fate
+_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'te', 'upgrade'}
+
+open_streams = {'sse': 0, 'mjpeg': 0}
+served = {'sse': 0, 'mjpeg': 0, 'rejected': 0, 'camera': 0, 'proxied': 0}
+
+
+class Request:
+    def __init__(self, method: str, target: str, version: str, raw_headers: List[Tuple[str, str]]):
+        self.method = method
+        self.target = target
+        self.version = version
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query_string = parts.query
+        self.args = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        self.raw_headers = raw_headers
+        self.headers = {k.lower(): v for k, v in raw_headers}  # lower-cased names
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ', 2)
+    except ValueError:
+        return None
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers.append((name.strip(), value.strip()))
+    return Request(method, target, version, headers)
+
+
+def response_head(status: int, content_type: str, extra: Tuple[Tuple[str, str], ...] = ()) -> bytes:
+    lines = [f'HTTP/1.1 {status} {_REASONS.get(status, "")}', f'Content-Type: {content_type}',
+             'Cache-Control: no-cache', 'Connection: close', *(f'{k}: {v}' for k, v in extra)]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send_simple(writer: asyncio.StreamWriter, status: int, body: bytes = b'',
+                      content_type: str = 'text/plain', extra: Tuple[Tuple[str, str], ...] = ()) -> None:
+    writer.write(response_head(status, content_type, extra + (('Content-Length', str(len(body))),)) + body)
+    await writer.drain()
+
+
+def _gate(req: Request, check=None):
+    headers = [(k.title(), v) for k, v in req.headers.items() if k in ('cookie', 'save-data', 'host')]
+    with flask_app.test_request_context(req.path, query_string=req.query_string, headers=headers):
+        denied = flask_app.preprocess_request()
+        if denied is None and check is not None and not check():
+            denied = redirect(url_for('hospital_login'))
+        return denied
+
+
+async def gate(req: Request, check=None):
+    """Run the Flask access rules (and the view's own ``check``) for this request.
+
+    Returns None when allowed, else the Flask response to send instead.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, _gate, req, check)
+
+
+async def send_flask(writer: asyncio.StreamWriter, resp) -> None:
+    served['rejected'] += 1
+    extra = (('Location', resp.headers['Location']),) if 'Location' in resp.headers else ()
+    await send_simple(writer, resp.status_code, resp.get_data(), resp.content_type, extra)
+
+
+async def until_closed(reader: asyncio.StreamReader) -> None:
+    # Clients send nothing after the request; EOF means they left
+    try:
+        while await reader.read(1024):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def stream_until_closed(reader: asyncio.StreamReader, body) -> None:
+    """Run ``body`` until it ends or the client disconnects, whichever is first"""
+    task = asyncio.ensure_future(body)
+    watcher = asyncio.ensure_future(until_closed(reader))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in (task, watcher):
+            t.cancel()
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+
+async def sse_events(req: Request, reader, writer) -> None:
+    denied = await gate(req)
+    if denied is not None:
+        return await send_flask(writer, denied)
+    last_id = events.parse_last_event_id(req.headers.get('last-event-id') or req.args.get('last_event_id'))
+    sub = events.event_bus.subscribe(last_id, loop=asyncio.get_running_loop())
+
+    async def body():
+        writer.write(response_head(200, 'text/event-stream', (('X-Accel-Buffering', 'no'),)))
+        async for frame in events.asse_stream(sub):
+            writer.write(frame.encode())
+            await writer.drain()
+
+    open_streams['sse'] += 1
+    served['sse'] += 1
+    try:
+        await stream_until_closed(reader, body())
+    finally:
+        sub.close()
+        open_streams['sse'] -= 1
+
+
+class FrameRelay:
+    """Hands one variant's encoded frames from the camera thread to coroutines"""
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop):
+        self.name = name
+        self.loop = loop
+        self.viewers = 0
+        self.seq = 0
+        self.part = None
+        self._changed = asyncio.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def join(self) -> None:
+        with self._lock:
+            self.viewers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'mjpeg-relay-{self.name}', daemon=True)
+                self._thread.start()
+
+    def leave(self) -> None:
+        with self._lock:
+            self.viewers -= 1
+
+    def _run(self) -> None:
+        seq = 0
+        while True:
+            with self._lock:
+                # Decided under the lock, so a viewer joining now gets a new thread
+                if self.viewers <= 0:
+                    self._thread = None
+                    return
+            seq, part = camera.wait_for_frame(seq, timeout=1.0, name=self.name, count=False)
+            if part is not None:
+                self.loop.call_soon_threadsafe(self._publish, seq, part)
+            elif not camera.running:
+                time.sleep(0.1)
+
+    def _publish(self, seq: int, part: bytes) -> None:
+        self.seq, self.part = seq, part
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def next_frame(self, last_seq: int, timeout: float = 1.0) -> Tuple[int, Optional[bytes]]:
+        if self.seq == last_seq:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return last_seq, None
+        return self.seq, self.part
+
+
+_relays: Dict[str, FrameRelay] = {}
+
+
+async def video_feed(req: Request, reader, writer) -> None:
+    stream = None
+
+    def check():
+        nonlocal stream
+        stream = requested_stream()
+        return can_view_camera()
+
+    denied = await gate(req, check)
+    if denied is not None:
+        return await send_flask(writer, denied)
+    if stream not in STREAM_VARIANTS:
+        msg = f"Unknown stream '{stream}' (choose {', '.join(STREAM_VARIANTS)})"
+        return await send_simple(writer, 400, msg.encode())
+    loop = asyncio.get_running_loop()
+    try:
+        # Opening the device can block for a moment
+        await loop.run_in_executor(None, camera.acquire)
+    except Exception as e:
+        return await send_simple(writer, 503, f"Camera error: {e}".encode())
+    relay = _relays.get(stream)
+    if relay is None:
+        relay = _relays[stream] = FrameRelay(stream, loop)
+
+    async def body():
+        writer.write(response_head(200, 'multipart/x-mixed-replace; boundary=frame'))
+        seq = 0
+        while True:
+            seq, part = await relay.next_frame(seq)
+            if part is None:
+                continue
+            if writer.transport.get_write_buffer_size() > FRAME_BACKLOG_BYTES:
+                # Slow viewer: let the backlog go out and send the newest frame after
+                await writer.drain()
+                continue
+            writer.write(part)
+            camera.record_sent(stream, len(part))
+            await writer.drain()
+
+    camera.subscribe(stream)
+    relay.join()
+    open_streams['mjpeg'] += 1
+    served['mjpeg'] += 1
+    try:
+        await stream_until_closed(reader, body())
+    finally:
+        relay.leave()
+        open_streams['mjpeg'] -= 1
+        camera.unsubscribe(stream)
+        camera.release()
+
+
+async def stream_stats(req: Request, reader, writer) -> None:
+    denied = await gate(req, can_view_stats)
+    if denied is not None:
+        return await send_flask(writer, denied)
+    body = {'open_streams': open_streams, 'served': served, 'events': events.event_bus.stats(),
+            'mjpeg_viewers': {name: r.viewers for name, r in _relays.items()}}
+    await send_simple(writer, 200, json.dumps(body).encode(), 'application/json')
+
+
+def _run_flask(req: Request):
+    environ = EnvironBuilder(req.path, method=req.method, query_string=req.query_string,
+                             headers=req.raw_headers).get_environ()
+    app_iter, status, headers = run_wsgi_app(flask_app.wsgi_app, environ, buffered=True)
+    try:
+        return status, headers, b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+async def camera_view(req: Request, reader, writer) -> None:
+    """A short camera route (all GET), answered by the Flask view on a worker thread"""
+    served['camera'] += 1
+    status, headers, data = await asyncio.get_running_loop().run_in_executor(None, _run_flask, req)
+    skip = {'connection', 'content-length', 'transfer-encoding'}
+    lines = [f'HTTP/1.1 {status}', *(f'{k}: {v}' for k, v in headers.items() if k.lower() not in skip),
+             f'Content-Length: {len(data)}', 'Connection: close']
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+    await writer.drain()
+
+
+async def pipe(src: asyncio.StreamReader, dst: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            chunk = await src.read(65536)
+            if not chunk:
+                break
+            dst.write(chunk)
+            await dst.drain()
+    except ConnectionError:
+        pass
+
+
+async def proxy(req: Request, reader, writer, upstream: Tuple[str, int]) -> None:
+    """Pass one request through to gunicorn and its response back, byte for byte"""
+    try:
+        up_reader, up_writer = await asyncio.open_connection(*upstream)
+    except OSError:
+        return await send_simple(writer, 502, b'Upstream unavailable')
+    served['proxied'] += 1
+    # One request per connection upstream, so its response ends with EOF
+    head = [f'{req.method} {req.target} {req.version}',
+            *(f'{k}: {v}' for k, v in req.raw_headers if k.lower() not in _HOP_HEADERS), 'Connection: close']
+    up_writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+    upload = asyncio.ensure_future(pipe(reader, up_writer))
+    try:
+        await pipe(up_reader, writer)
+    finally:
+        upload.cancel()
+        await asyncio.gather(upload, return_exceptions=True)
+        up_writer.close()
+
+
+ROUTES = {
+    '/events/patients': sse_events,
+    '/camera/video_feed': video_feed,
+    '/streams/stats': stream_stats,
+    '/take_picture': camera_view,
+    '/test_photo': camera_view,
+    '/camera_status': camera_view,
+    '/camera/stream_stats': camera_view,
+}
+
+
+def parse_upstream(raw: str) -> Optional[Tuple[str, int]]:
+    if not raw:
+        return None
+    host, _, port = raw.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 upstream: Optional[Tuple[str, int]] = None) -> None:
+    try:
+        req = await read_request(reader)
+        if req is None:
+            return
+        route = ROUTES.get(req.path)
+        if route is None and upstream is not None:
+            await proxy(req, reader, writer, upstream)
+        elif route is None:
+            await send_simple(writer, 404, b'Not found (the stream sidecar only serves streaming and camera paths)')
+        elif req.method != 'GET':
+            await send_simple(writer, 405, b'Method not allowed', extra=(('Allow', 'GET'),))
+        else:
+            await route(req, reader, writer)
+    except ConnectionError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Stream sidecar error: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str = HOST, port: int = PORT, ready: Optional[asyncio.Future] = None,
+                upstream: Optional[Tuple[str, int]] = None) -> None:
+    server = await asyncio.start_server(lambda r, w: handle(r, w, upstream), host, port,
+                                        limit=MAX_HEADER_BYTES, backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    print(f"✅ Stream sidecar on http://{host}:{port} ({', '.join(ROUTES)})"
+          + (f", everything else to {upstream[0]}:{upstream[1]}" if upstream else ''))
+    if ready is not None:
+        ready.set_result(port)
+    async with server:
+        await server.serve_forever()
+
+
+async def wait_for_upstream(upstream: Tuple[str, int], timeout: float,
+                            proc: Optional[asyncio.subprocess.Process] = None) -> bool:
+    """True once the upstream accepts connections; False on timeout or if proc exits first"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.returncode is not None:
+            return False
+        try:
+            _reader, probe = await asyncio.open_connection(*upstream)
+        except OSError:
+            await asyncio.sleep(0.2)
+            continue
+        probe.close()
+        return True
+    return False
+
+
+async def stop_process(proc: asyncio.subprocess.Process, timeout: float = UPSTREAM_STOP_TIMEOUT) -> None:
+    if proc.returncode is not None:
+        return
+    proc.terminate()
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+def _exit_status(returncode: Optional[int]) -> int:
+    # Non-zero whatever happened: a signal N becomes 128 + N, like a shell
+    if returncode is None or returncode == 0:
+        return 1
+    return 128 - returncode if returncode < 0 else returncode
+
+
+async def run(host: str = HOST, port: int = PORT, upstream: Optional[Tuple[str, int]] = None,
+              command: Optional[List[str]] = None, start_timeout: float = UPSTREAM_START_TIMEOUT,
+              ready: Optional[asyncio.Future] = None) -> int:
+    """Serve until stopped; with ``command``, start and supervise the upstream too.
+
+    Returns the exit status: 0 after SIGTERM/SIGINT, otherwise the upstream's
+    (1 if it exited cleanly, since it is never supposed to; 128 + N if signal
+    N killed it).
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+    proc = await asyncio.create_subprocess_exec(*command) if command else None
+    waits = [asyncio.ensure_future(stop.wait())]
+    try:
+        if upstream is not None:
+            print(f"⏳ Waiting for upstream {upstream[0]}:{upstream[1]}")
+            if not await wait_for_upstream(upstream, start_timeout, proc):
+                code = proc.returncode if proc is not None and proc.returncode is not None else None
+                print(f"❌ Upstream {upstream[0]}:{upstream[1]} "
+                      + (f"exited with status {code}" if code is not None else f"not up after {start_timeout:.0f}s"))
+                return _exit_status(code)
+        waits.append(asyncio.ensure_future(serve(host, port, ready, upstream)))
+        if proc is not None:
+            waits.append(asyncio.ensure_future(proc.wait()))
+        done, _pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        if proc is not None and proc.returncode is not None:
+            print(f"❌ Upstream exited with status {proc.returncode}; stopping the sidecar")
+            return _exit_status(proc.returncode)
+        for task in done:
+            task.result()  # re-raise a server failure (e.g. port in use)
+        return 0
+    finally:
+        for task in waits:
+            task.cancel()
+        await asyncio.gather(*waits, return_exceptions=True)
+        if proc is not None:
+            await stop_process(proc)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default=HOST)
+    ap.add_argument('--port', type=int, default=PORT)
+    ap.add_argument('--upstream', default=UPSTREAM, help='host:port to pass all other requests to')
+    ap.add_argument('--start-timeout', type=float, default=UPSTREAM_START_TIMEOUT,
+                    help='seconds to wait for the upstream to accept connections')
+    ap.add_argument('command', nargs=argparse.REMAINDER,
+                    help='after --: the upstream server to start and supervise (e.g. gunicorn ...)')
+    args = ap.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    upstream = parse_upstream(args.upstream)
+    if command and upstream is None:
+        ap.error('a supervised command needs --upstream (the address it listens on)')
+    raise SystemExit(asyncio.run(run(args.host, args.port, upstream, command, args.start_timeout)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Resized derivatives of uploaded photos for /uploads/<name>?w=<width>.
+
+Avatars in the dashboard and profile lists are 44-120 px, but the originals
+are full camera frames. A derivative is generated once per (photo, width),
+written atomically into a disk cache and reused until the original changes.
+The cache is size-capped: a file's mtime doubles as its last-use time, and the
+least recently used derivatives are evicted when the cap is exceeded.
+"""
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from werkzeug.security import safe_join
+
+from photos import UPLOADS_DIR
+
+# Pillow is optional: without it the original image is served
+try:
+    from PIL import Image, ImageOps  # type: ignore
+except Exception:
+    Image = None
+    ImageOps = None
+
+CACHE_DIR = os.getenv('THUMB_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thumb_cache'))
+CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Requested widths snap up to one of these so the cache stays bounded
+WIDTHS = (48, 96, 128, 256, 512)
+JPEG_QUALITY = 82
+# Only refresh a hit's last-use time if it is older than this (saves a syscall per hit)
+TOUCH_INTERVAL_S = 3600
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+_size_estimate = {'bytes': None}
+
+
+def snap_width(w: int) -> int:
+    for width in WIDTHS:
+        if w <= width:
+            return width
+    return WIDTHS[-1]
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+
+def _cache_path(name: str, width: int) -> str:
+    return os.path.join(CACHE_DIR, str(width), name.replace('/', '__'))
+
+
+def thumbnail(name: str, width: int, uploads_dir: str = UPLOADS_DIR) -> Optional[Tuple[str, os.stat_result]]:
+    """Path of the cached derivative plus the original's stat.
+
+    Returns None when the original does not exist, cannot be resized, or is
+    already no wider than ``width`` (callers then serve the original).
+    """
+    if Image is None:
+        return None
+    source = safe_join(uploads_dir, name)
+    if source is None:
+        return None
+    try:
+        src_stat = os.stat(source)
+    except OSError:
+        return None
+    width = snap_width(width)
+    path = _cache_path(name, width)
+    try:
+        st = os.stat(path)
+        if st.st_mtime >= src_stat.st_mtime:
+            if time.time() - st.st_mtime > TOUCH_INTERVAL_S:
+                os.utime(path)
+            return path, src_stat
+    except OSError:
+        pass
+    with _lock_for(path):
+        # Another thread may have produced it while we waited
+        try:
+            if os.stat(path).st_mtime >= src_stat.st_mtime:
+                return path, src_stat
+        except OSError:
+            pass
+        if not _render(source, path, width):
+            return None
+    return path, src_stat
+
+
+def _render(source: str, path: str, width: int) -> bool:
+    tmp = f'{path}.{uuid.uuid4().hex[:6]}.tmp'
+    try:
+        with Image.open(source) as im:
+            if im.width <= width:
+                return False
+            im.draft('RGB', (width, width * im.height // im.width))  # fast JPEG downscale on decode
+            im = ImageOps.exif_transpose(im).convert('RGB')
+            im.thumbnail((width, width * im.height // im.width), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            im.save(tmp, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"❌ Thumbnail failed for {source} @ {width}px: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    _account(os.path.getsize(path))
+    return True
+
+
+def _account(added: int) -> None:
+    # Running per-process estimate; a full scan only happens when it crosses the cap
+    if _size_estimate['bytes'] is None:
+        _size_estimate['bytes'] = cache_size()
+    else:
+        _size_estimate['bytes'] += added
+    if _size_estimate['bytes'] > CACHE_MAX_BYTES:
+        _size_estimate['bytes'] = evict(CACHE_MAX_BYTES * 9 // 10)
+
+
+def _entries():
+    for root, _dirs, files in os.walk(CACHE_DIR):
+        for f in files:
+            p = os.path.join(root, f)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            yield p, st
+
+
+def cache_size() -> int:
+    return sum(st.st_size for _p, st in _entries())
+
+
+def evict(target_bytes: int) -> int:
+    """Delete least recently used derivatives until the cache fits target_bytes"""
+    entries = sorted(_entries(), key=lambda e: e[1].st_mtime)
+    total = sum(st.st_size for _p, st in entries)
+    for p, st in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(p)
+            total -= st.st_size
+        except OSError:
+            pass
+    return total
@@ -0,0 +1,298 @@
+"""Device vitals ingestion: reading normalisation, batch decoding and a
+write-behind buffer.
+
+Devices post a reading every couple of seconds. Instead of committing one row
+per request, readings are queued and a background thread writes them to the
+vitals_samples table in batches (whichever comes first: a full batch or the
+flush interval). Devices that buffer readings themselves can upload them in
+one request through /api/vitals/batch, which is committed in one transaction.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import db
+
+# Compact binary encodings for device batches are optional
+try:
+    import msgpack  # type: ignore
+except Exception:
+    msgpack = None
+try:
+    import cbor2  # type: ignore
+except Exception:
+    cbor2 = None
+
+BATCH_SIZE = int(os.getenv('VITALS_BATCH_SIZE', '200'))
+FLUSH_INTERVAL = float(os.getenv('VITALS_FLUSH_INTERVAL', '1.0'))
+QUEUE_MAX = int(os.getenv('VITALS_QUEUE_MAX', '10000'))
+# A failed flush (e.g. "database is locked") is retried with doubling waits
+WRITE_RETRIES = int(os.getenv('VITALS_WRITE_RETRIES', '5'))
+RETRY_BACKOFF = 0.1
+RETRY_BACKOFF_MAX = 2.0
+
+# /api/vitals/batch limits
+MAX_BATCH_ITEMS = int(os.getenv('VITALS_MAX_BATCH_ITEMS', '1000'))
+MAX_BATCH_BYTES = int(os.getenv('VITALS_MAX_BATCH_BYTES', str(2 * 1024 * 1024)))
+# Accepted clock skew for device timestamps (future) and maximum backfill age
+MAX_FUTURE_SKEW_S = 300
+MAX_SAMPLE_AGE_S = 7 * 24 * 3600
+CHANNELS = ('heart_rate', 'spo2', 'body_temp_c', 'env_temp_c', 'humidity_percent', 'weight_kg')
+
+
+def num_or_none(v):
+    try:
+        return float(v) if v is not None and v != '' else None
+    except Exception:
+        return None
+
+
+def parse_reading(data: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """Normalise a device reading (snake_case or camelCase keys, Celsius)"""
+    return {
+        'heart_rate': num_or_none(data.get('heart_rate') if 'heart_rate' in data else data.get('heartRate')),
+        'spo2': num_or_none(data.get('spo2')),
+        'body_temp_c': num_or_none(data.get('body_temp') if 'body_temp' in data else data.get('temperature')),
+        'env_temp_c': num_or_none(data.get('env_temp') if 'env_temp' in data else data.get('envTemperature')),
+        'humidity_percent': num_or_none(data.get('humidity')),
+        'weight_kg': num_or_none(data.get('weight')),
+    }
+
+
+def sample_tuple(reading: Dict[str, Optional[float]], device_id: Optional[str], profile_id: Optional[int],
+                 ts: Optional[float] = None) -> Tuple[Any, ...]:
+    """Row for db.insert_vitals_samples (VITALS_SAMPLE_COLUMNS order)"""
+    return (
+        device_id, profile_id, time.time() if ts is None else float(ts),
+        reading['heart_rate'], reading['spo2'], reading['body_temp_c'],
+        reading['env_temp_c'], reading['humidity_percent'], reading['weight_kg'],
+    )
+
+
+def decode_batch(body: bytes, content_type: str, content_encoding: str = '') -> List[Any]:
+    """Decode a /api/vitals/batch body into a list of readings.
+
+    Accepts a JSON array (or {"readings": [...]} object), NDJSON, MessagePack
+    or CBOR, any of them optionally gzip'd. Raises ValueError on bad input.
+    """
+    ctype = (content_type or '').split(';')[0].strip().lower()
+    if 'gzip' in (content_encoding or '').lower() or ctype in ('application/gzip', 'application/x-gzip'):
+        d = zlib.decompressobj(31)
+        # Bounded inflate so a small compressed body cannot expand without limit
+        body = d.decompress(body, MAX_BATCH_BYTES + 1)
+        if len(body) > MAX_BATCH_BYTES or d.unconsumed_tail:
+            raise ValueError('decompressed batch too large')
+        if ctype in ('application/gzip', 'application/x-gzip'):
+            ctype = 'application/x-ndjson'
+    if len(body) > MAX_BATCH_BYTES:
+        raise ValueError('batch too large')
+    try:
+        if ctype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+            payload = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+        elif ctype in ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack'):
+            if msgpack is None:
+                raise ValueError('MessagePack support is not installed')
+            payload = msgpack.unpackb(body, raw=False)
+        elif ctype == 'application/cbor':
+            if cbor2 is None:
+                raise ValueError('CBOR support is not installed')
+            payload = cbor2.loads(body)
+        else:
+            payload = json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f'could not decode batch: {e}')
+    if isinstance(payload, dict):
+        # Envelope form: batch-wide defaults apply to readings that omit them
+        defaults = {k: payload[k] for k in ('device_id', 'patient_id') if k in payload}
+        payload = [dict(defaults, **r) if isinstance(r, dict) else r for r in payload.get('readings') or []]
+    if not isinstance(payload, list):
+        raise ValueError('batch must be a list of readings')
+    if len(payload) > MAX_BATCH_ITEMS:
+        raise ValueError(f'batch exceeds {MAX_BATCH_ITEMS} readings')
+    return payload
+
+
+def validate_batch(items: List[Any], profile_exists: Callable[[int], bool],
+                   now: Optional[float] = None) -> Tuple[List[Tuple[Any, ...]], List[Dict[str, Any]]]:
+    """Validate readings; returns sample rows for the valid ones and a status per item.
+
+    Each reading may carry ``ts`` (epoch seconds) or ``age_ms`` (how long
+    before sending it was taken, for devices without a real-time clock).
+    """
+    now = time.time() if now is None else now
+    rows, statuses = [], []
+    known = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            statuses.append({'index': i, 'status': 'error', 'error': 'reading must be an object'})
+            continue
+        reading = parse_reading(item)
+        if all(reading[c] is None for c in CHANNELS):
+            statuses.append({'index': i, 'status': 'error', 'error': 'no numeric vitals'})
+            continue
+        ts = now
+        if item.get('ts') not in (None, ''):
+            ts = num_or_none(item.get('ts'))
+        elif item.get('age_ms') not in (None, ''):
+            age = num_or_none(item.get('age_ms'))
+            ts = None if age is None else now - age / 1000.0
+        if ts is None or ts > now + MAX_FUTURE_SKEW_S or ts < now - MAX_SAMPLE_AGE_S:
+            statuses.append({'index': i, 'status': 'error', 'error': 'invalid or out-of-range timestamp'})
+            continue
+        profile_id = None
+        pid_raw = item.get('patient_id')
+        if pid_raw not in (None, ''):
+            try:
+                profile_id = int(pid_raw)
+            except (TypeError, ValueError):
+                statuses.append({'index': i, 'status': 'error', 'error': 'invalid patient_id'})
+                continue
+            if profile_id not in known:
+                known[profile_id] = bool(profile_exists(profile_id))
+            if not known[profile_id]:
+                profile_id = None
+        device_id = str(item.get('device_id') or '') or None
+        rows.append(sample_tuple(reading, device_id, profile_id, ts))
+        statuses.append({'index': i, 'status': 'ok', 'profile_id': profile_id})
+    return rows, statuses
+
+
+class VitalsBuffer:
+    """Bounded queue of samples drained by a background writer thread.
+
+    Counters are updated from request threads and the writer thread, always
+    under ``lock``. Once closed, the buffer refuses new samples.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 maxsize: int = QUEUE_MAX, writer=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.writer = writer or db.insert_vitals_samples
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.retries = 0
+        self.lost = 0
+
+    def _ensure_thread(self):
+        # Started lazily, and again after a fork (gunicorn workers)
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='vitals-writer', daemon=True)
+            self.thread.start()
+
+    def add(self, sample: Tuple[Any, ...]) -> bool:
+        """Queue one sample; returns False (dropped) if the buffer is full or closed"""
+        if not self.stopping.is_set():
+            self._ensure_thread()
+        with self.lock:
+            # Checked under the lock close() sets it with, so nothing is
+            # queued after close() has started draining
+            if not self.stopping.is_set():
+                try:
+                    self.queue.put_nowait(sample)
+                    return True
+                except queue.Full:
+                    pass
+            self.dropped += 1
+            return False
+
+    def _fill(self, batch: list) -> list:
+        """Top up batch with whatever is already queued, up to batch_size"""
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list) -> None:
+        # The batch is one transaction, so a failed attempt left nothing behind
+        if not batch:
+            return
+        delay = RETRY_BACKOFF
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                written = self.writer(batch)
+                with self.lock:
+                    self.written += written
+                    self.flushes += 1
+                return
+            except Exception as e:
+                error = e
+            if attempt < WRITE_RETRIES:
+                with self.lock:
+                    self.retries += 1
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_BACKOFF_MAX)
+        with self.lock:
+            self.lost += len(batch)
+        print(f"❌ Vitals flush failed after {WRITE_RETRIES} retries, {len(batch)} samples lost: {error}")
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Give the batch until the flush deadline to fill up
+            deadline = time.monotonic() + self.flush_interval
+            batch = self._fill([first])
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                self._fill(batch)
+            self._write(batch)
+
+    def flush(self) -> None:
+        """Write everything queued so far on the calling thread"""
+        while True:
+            batch = self._fill([])
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the writer thread and persist anything still queued"""
+        with self.lock:
+            self.stopping.set()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'flushes': self.flushes,
+                'dropped': self.dropped,
+                'retries': self.retries,
+                'lost': self.lost,
+            }
+
+
+vitals_buffer = VitalsBuffer()
+atexit.register(vitals_buffer.close)